@@ -0,0 +1,8 @@
+CREATE TABLE spectrals_cache (
+    key TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    full_url TEXT,
+    zoom_url TEXT,
+    last_used REAL NOT NULL,
+    PRIMARY KEY (key)
+);
@@ -0,0 +1,12 @@
+CREATE TABLE audio_analysis (
+    path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    md5 TEXT NOT NULL,
+    streaminfo TEXT,
+    wasted_bits TEXT,
+    mqa TEXT,
+    integrity TEXT,
+    spectral_cutoff TEXT,
+    PRIMARY KEY (path)
+);
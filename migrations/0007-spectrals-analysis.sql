@@ -0,0 +1 @@
+ALTER TABLE spectrals ADD COLUMN analysis TEXT;
@@ -0,0 +1,9 @@
+CREATE TABLE transcode_results (
+    id INTEGER PRIMARY KEY,
+    batch TEXT NOT NULL,
+    path TEXT NOT NULL,
+    bitrate TEXT,
+    output TEXT,
+    error TEXT,
+    time TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
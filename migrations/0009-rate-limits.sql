@@ -0,0 +1,9 @@
+CREATE TABLE rate_limits (
+    key TEXT NOT NULL,
+    tokens REAL NOT NULL,
+    updated REAL NOT NULL,
+    requests INTEGER NOT NULL DEFAULT 0,
+    waited REAL NOT NULL DEFAULT 0,
+    max_wait REAL NOT NULL DEFAULT 0,
+    PRIMARY KEY (key)
+);
@@ -0,0 +1,15 @@
+CREATE TABLE site_log (
+    site TEXT NOT NULL,
+    torrent_id INTEGER NOT NULL,
+    artist TEXT NOT NULL,
+    title TEXT NOT NULL,
+    seen REAL NOT NULL,
+    PRIMARY KEY (site, torrent_id)
+);
+
+CREATE TABLE site_log_crawls (
+    site TEXT NOT NULL,
+    high_water INTEGER NOT NULL,
+    crawled REAL NOT NULL,
+    PRIMARY KEY (site)
+);
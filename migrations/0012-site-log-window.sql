@@ -0,0 +1 @@
+ALTER TABLE site_log_crawls ADD COLUMN window_size INTEGER;
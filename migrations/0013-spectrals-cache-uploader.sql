@@ -0,0 +1 @@
+ALTER TABLE spectrals_cache ADD COLUMN uploader TEXT;
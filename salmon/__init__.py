@@ -5,8 +5,11 @@ DEFAULT_VALUES = {
     "IMGUR_CLIENT_SECRET": None,
     "IMGUR_REFRESH_TOKEN": None,
     "SIMULTANEOUS_DOWNLOADS": 2,
-    "SIMULTANEOUS_SPECTRALS": 3,
-    "SIMULTANEOUS_CONVERSIONS": 2,
+    "SIMULTANEOUS_JOBS": None,
+    "SIMULTANEOUS_SPECTRALS": None,
+    "SPECTRALS_RENDERER": "sox",
+    "SIMULTANEOUS_CONVERSIONS": None,
+    "COPY_STRATEGY": "copy",
     "USER_AGENT": "salmon uploading tools",
     "FOLDER_TEMPLATE": "{artists} - {title} ({year}) [{source} {format}] {{{label}}}",
     "FILE_TEMPLATE": "{tracknumber}. {artist} - {title}",
@@ -42,6 +45,9 @@ DEFAULT_VALUES = {
     "WEB_PORT": 55110,
     "WEB_STATIC_ROOT_URL": "/static",
     "COMPRESS_SPECTRALS": False,
+    "SPECTRALS_CACHE_DIR": None,
+    "SPECTRALS_CACHE_SIZE": 512,
+    "PRESCREEN_SPECTRALS": True,
     "LMA_COMMENT_IN_T_DESC": False,
     "USE_UPC_AS_CATNO": True,
     "DEFAULT_TRACKER": False,
@@ -7,7 +7,7 @@ from heybrochecklog.score import score_log
 from heybrochecklog.translate import translate_log
 
 from salmon.checks.integrity import check_integrity, format_integrity
-from salmon.checks.mqa import check_mqa
+from salmon.checks.mqa import check_mqa, check_mqa_files
 from salmon.checks.upconverts import test_upconverted
 from salmon.common import commandgroup
 
@@ -89,12 +89,17 @@ def mqa(path):
         else:
             click.secho("Did not find MQA syncword", fg="green")
     elif os.path.isdir(path):
-        for root, _, figles in os.walk(path):
-            for f in figles:
-                if any(f.lower().endswith(ext) for ext in [".mp3", ".flac"]):
-                    filepath = os.path.join(root, f)
-                    click.secho(f"\nChecking {filepath}...", fg="cyan")
-                    if check_mqa(filepath):
-                        click.secho("MQA syncword present", fg="red")
-                    else:
-                        click.secho("Did not find MQA syncword", fg="green")
+        filepaths = [
+            os.path.join(root, f)
+            for root, _, figles in os.walk(path)
+            for f in sorted(figles)
+            if any(f.lower().endswith(ext) for ext in [".mp3", ".flac"])
+        ]
+        for filepath, result in check_mqa_files(filepaths):
+            click.secho(f"\nChecking {filepath}...", fg="cyan")
+            if isinstance(result, Exception):
+                click.secho(f"Failed to check: {result}", fg="yellow")
+            elif result:
+                click.secho("MQA syncword present", fg="red")
+            else:
+                click.secho("Did not find MQA syncword", fg="green")
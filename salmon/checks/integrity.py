@@ -3,6 +3,8 @@ import subprocess
 
 import click
 
+from salmon.common.analysis import cached
+
 FLAC_IMPORTANT_REGEXES = [
     re.compile(".+\\.flac: testing,.*\x08ok"),
 ]
@@ -15,9 +17,9 @@ MP3_IMPORTANT_REGEXES = [
 
 def check_integrity(path):
     if path.lower().endswith(".flac"):
-        return _check_flac_integrity(path)
+        return cached(path, "integrity", lambda: _check_flac_integrity(path))
     elif path.lower().endswith(".mp3"):
-        return _check_mp3_integrity(path)
+        return cached(path, "integrity", lambda: _check_mp3_integrity(path))
     raise click.Abort
 
 
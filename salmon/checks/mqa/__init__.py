@@ -22,30 +22,19 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 SOFTWARE.
 """
 
-import io
-import struct
 import wave
+from concurrent.futures import ProcessPoolExecutor
 
-from bitstring import Bits
+import numpy as np
 
-from . import flac
+from salmon import config
+from salmon.common.analysis import cached
+from salmon.common.flac import FlacFile
 
-MAGIC = Bits("0xbe0498c88")
-
-
-def twos_complement(n, bits):
-    mask = 2 ** (bits - 1)
-    return -(n & mask) + (n & ~mask)
-
-
-def iter_i24_as_i32(data):
-    for l, h in struct.iter_unpack("<BH", data):
-        yield twos_complement(h << 8 | l, 24) << 8
-
-
-def iter_i16_as_i32(data):
-    for (x,) in struct.iter_unpack("<h", data):
-        yield x << 16
+MAGIC = 0xBE0498C88
+MAGIC_LENGTH = 36
+# The bit planes of the L/R difference that the MQA syncword can be buried in.
+PLANES = np.arange(16, 24, dtype=np.int32)
 
 
 def peek(f, n):
@@ -56,36 +45,71 @@ def peek(f, n):
 
 
 def check_mqa(path):
+    return cached(path, "mqa", lambda: _check_mqa(path))
+
+
+def _check_mqa(path):
     with open(path, "rb") as f:
         magic = peek(f, 4)
 
-        if magic == b"fLaC":
-            with flac.BitInputStream(f) as bf:
-                f = io.BytesIO()
-                flac.decode_file(bf, f, seconds=1)
-                f.seek(0)
-
-        with wave.open(f) as wf:
+    if magic == b"fLaC":
+        flac = FlacFile(path)
+        if flac.channels != 2:
+            raise ValueError("Input must be stereo")
+        if flac.bits_per_sample not in {16, 24}:
+            raise ValueError("Input must be 16- or 24-bit")
+        samples = flac.decode(0, flac.sample_rate) << (32 - flac.bits_per_sample)
+    else:
+        with wave.open(path) as wf:
             nchannels, sampwidth, framerate, *_ = wf.getparams()
 
             if nchannels != 2:
                 raise ValueError("Input must be stereo")
-
-            if sampwidth == 3:
-                iter_data = iter_i24_as_i32
-            elif sampwidth == 2:
-                iter_data = iter_i16_as_i32
-            else:
+            if sampwidth not in {2, 3}:
                 raise ValueError("Input must be 16- or 24-bit")
 
             sound_data = wf.readframes(framerate)
-
-    samples = list(iter_data(sound_data))
-    streams = (
-        Bits((x ^ y) >> p & 1 for x, y in zip(samples[::2], samples[1::2]))
-        for p in range(16, 24)
-    )
-
-    if any(s.find(MAGIC) for s in streams):
-        return True
-    return False
+        samples = samples_as_i32(sound_data, sampwidth).reshape(-1, 2)
+
+    return find_syncword(samples[:, 0] ^ samples[:, 1])
+
+
+def check_mqa_files(filepaths):
+    """
+    Check many files for MQA across a process pool, yielding each filepath with
+    its result (or the error it raised) in order.
+    """
+    with ProcessPoolExecutor(max_workers=config.SIMULTANEOUS_JOBS) as executor:
+        yield from zip(filepaths, executor.map(_try_check_mqa, filepaths))
+
+
+def _try_check_mqa(path):
+    try:
+        return check_mqa(path)
+    except (ValueError, RuntimeError, EOFError, wave.Error) as e:
+        return e
+
+
+def samples_as_i32(data, sampwidth):
+    """Read little endian 16- or 24-bit PCM, left aligned into int32 samples."""
+    if sampwidth == 2:
+        return np.frombuffer(data, dtype="<i2").astype(np.int32) << 16
+    raw = np.frombuffer(data, dtype=np.uint8).reshape(-1, 3).astype(np.uint32)
+    return (raw[:, 0] << 8 | raw[:, 1] << 16 | raw[:, 2] << 24).view(np.int32)
+
+
+def find_syncword(difference):
+    """
+    Search each of the bit planes 16-23 of the channel difference for the MQA
+    syncword. The planes are packed into a sliding 36-bit window per sample,
+    which is then compared against the syncword in one go.
+    """
+    planes = (difference[np.newaxis, :] >> PLANES[:, np.newaxis] & 1).astype(np.uint64)
+    positions = planes.shape[1] - MAGIC_LENGTH + 1
+    if positions <= 0:
+        return False
+    window = np.zeros((len(PLANES), positions), dtype=np.uint64)
+    for i in range(MAGIC_LENGTH):
+        window <<= np.uint64(1)
+        window |= planes[:, i : i + positions]
+    return bool((window == np.uint64(MAGIC)).any())
@@ -18,13 +18,15 @@ import salmon.uploader
 import salmon.web  # noqa F401
 from salmon import config
 from salmon.common import commandgroup
-from salmon.common import compress as recompress
+from salmon.common import recompress_files
 from salmon.common import str_to_int_if_int
 from salmon.tagger.audio_info import gather_audio_info
 from salmon.tagger.combine import combine_metadatas
 from salmon.tagger.metadata import clean_metadata, remove_various_artists
 from salmon.tagger.retagger import create_artist_str
 from salmon.tagger.sources import run_metadata
+from salmon.trackers.throttle import wait_stats
+from salmon.uploader.cross_seed import cross_seed_folders
 from salmon.uploader.spectrals import (
     check_spectrals,
     handle_spectrals_upload_and_deletion,
@@ -124,12 +126,12 @@ def descgen(urls):
 )
 def compress(path):
     """Recompress a directory of FLACs to level 8"""
+    filepaths = []
     for root, _, figles in os.walk(path):
         for f in sorted(figles):
             if os.path.splitext(f)[1].lower() == ".flac":
-                filepath = os.path.join(root, f)
-                click.secho(f"Recompressing {filepath[len(path) + 1:]}...")
-                recompress(filepath)
+                filepaths.append(os.path.join(root, f))
+    recompress_files(filepaths, [f[len(path) + 1 :] for f in filepaths])
 
 
 @commandgroup.command()
@@ -192,3 +194,36 @@ def checkspecs(tracker, torrent_id, path):
     post_upload_spectral_check(
         gazelle_site, path, torrent_id, None, track_data, source, source_url
     )
+
+
+@commandgroup.command()
+def ratelimits():
+    """Show how long tracker requests have waited on the rate limit"""
+    stats = wait_stats()
+    if not stats:
+        return click.secho("No tracker requests have been made yet.", fg="yellow")
+    for row in stats:
+        mean = row["waited"] / row["requests"] if row["requests"] else 0
+        click.echo(
+            f"{row['key']}: {row['requests']} requests waited {row['waited']:.1f}s "
+            f"in total, {mean:.2f}s on average and {row['max_wait']:.1f}s at most"
+        )
+
+
+@commandgroup.command("cross-seed")
+@click.argument("paths", type=click.Path(file_okay=False), nargs=-1, required=True)
+@click.option(
+    "--tracker",
+    "-t",
+    callback=salmon.trackers.validate_tracker,
+    help=f'Tracker to make torrents for ({"/".join(salmon.trackers.tracker_list)})',
+)
+@click.option(
+    "--rehash",
+    is_flag=True,
+    help="Hash the folders that no existing torrent matches instead of skipping them",
+)
+def cross_seed(paths, tracker, rehash):
+    """Make torrents for a tracker from other trackers' torrents of the same folders"""
+    gazelle_site = salmon.trackers.get_class(tracker)()
+    cross_seed_folders(paths, gazelle_site, rehash)
@@ -6,8 +6,9 @@ from requests import RequestException
 
 from salmon.common.aliases import AliasedCommands  # noqa: F401
 from salmon.common.constants import RE_FEAT  # noqa: F401
+from salmon.common.compression import recompress_files  # noqa: F401
 from salmon.common.figles import (  # noqa: F401
-    compress,
+    audio_checksum,
     create_relative_path,
     get_audio_files,
     alac_to_flac,
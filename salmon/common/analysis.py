@@ -0,0 +1,82 @@
+"""
+A cache of per-file audio analysis in smoked.db: stream info, wasted bits, the
+MQA verdict, the integrity check and the spectral cutoff. Rows are keyed on the
+file's path and are only used while its size, mtime and STREAMINFO MD5 are all
+unchanged, so a file that was edited or replaced is analysed again.
+"""
+
+import json
+import os
+import sqlite3
+
+from salmon.common.flac import FlacFile
+from salmon.database import DB_PATH
+
+FIELDS = {"streaminfo", "wasted_bits", "mqa", "integrity", "spectral_cutoff"}
+
+
+def cached(filepath, field, compute):
+    """
+    Return a field of a file's analysis, calling `compute` to get and store it
+    if it isn't cached. Results of None aren't cached.
+    """
+    if field not in FIELDS:
+        raise ValueError(f"Unknown analysis field {field}")
+    filepath = os.path.abspath(filepath)
+    identity = file_identity(filepath)
+    with sqlite3.connect(DB_PATH) as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            f"SELECT {field} FROM audio_analysis WHERE path = ? AND size = ? "
+            "AND mtime_ns = ? AND md5 = ?",
+            (filepath, *identity),
+        )
+        row = cursor.fetchone()
+    if row and row[0] is not None:
+        return json.loads(row[0])
+
+    value = compute()
+    if value is not None:
+        store(filepath, identity, field, value)
+    return value
+
+
+def save(filepath, field, value):
+    """Store a field of a file's analysis that was computed elsewhere."""
+    if field not in FIELDS:
+        raise ValueError(f"Unknown analysis field {field}")
+    filepath = os.path.abspath(filepath)
+    store(filepath, file_identity(filepath), field, value)
+
+
+def store(filepath, identity, field, value):
+    """Store a field of a file's analysis, dropping any made of an older file."""
+    with sqlite3.connect(DB_PATH) as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "DELETE FROM audio_analysis WHERE path = ? AND NOT "
+            "(size = ? AND mtime_ns = ? AND md5 = ?)",
+            (filepath, *identity),
+        )
+        cursor.execute(
+            "INSERT OR IGNORE INTO audio_analysis (path, size, mtime_ns, md5) "
+            "VALUES (?, ?, ?, ?)",
+            (filepath, *identity),
+        )
+        cursor.execute(
+            f"UPDATE audio_analysis SET {field} = ? WHERE path = ?",
+            (json.dumps(value), filepath),
+        )
+        conn.commit()
+
+
+def file_identity(filepath):
+    """The size, mtime and STREAMINFO MD5 (empty for non-FLACs) of a file."""
+    stat = os.stat(filepath)
+    md5 = ""
+    if filepath.lower().endswith(".flac"):
+        try:
+            md5 = FlacFile(filepath).md5.hex()
+        except ValueError:
+            pass
+    return stat.st_size, stat.st_mtime_ns, md5
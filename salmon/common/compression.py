@@ -0,0 +1,137 @@
+"""
+Recompression of FLACs to FLAC_COMPRESSION_LEVEL. Files are recompressed on a
+job pool, and files that are already at the level are skipped. The level isn't
+stored in a FLAC, so it is estimated: the file must have been encoded by the
+installed version of libFLAC, with the block size of the level, and the highest
+LPC order in a few sampled frames must be one only the level's preset reaches.
+The presets 0-2, 4-6 and 7-8 can't be told apart this way, so a file at any
+level of the target's group counts as done.
+"""
+
+import os
+import subprocess
+from functools import lru_cache, partial
+
+import click
+import mutagen
+
+from salmon import config
+from salmon.common.flac import FlacFile
+from salmon.common.jobs import Job, run_jobs
+from salmon.errors import JobFailedError
+
+# The block size and the maximum LPC order of every preset (0 is fixed only).
+COMPRESSION_LEVELS = {
+    0: (1152, 0),
+    1: (1152, 0),
+    2: (1152, 0),
+    3: (4096, 6),
+    4: (4096, 8),
+    5: (4096, 8),
+    6: (4096, 8),
+    7: (4096, 12),
+    8: (4096, 12),
+}
+SAMPLED_WINDOWS = 3
+WINDOW_SIZE = 1 << 17
+
+
+def recompress_files(filepaths, names=None):
+    """
+    Recompress FLACs to the configured level across a job pool. Every new file
+    is checked against the MD5 of the audio in the original's STREAMINFO before
+    it replaces the original. `names` are shown in place of the filepaths.
+    Returns the filepaths that failed, which are left as they were.
+    """
+    level = config.FLAC_COMPRESSION_LEVEL
+    names = names or [os.path.basename(f) for f in filepaths]
+    todo = []
+    for filepath, name in zip(filepaths, names):
+        if is_compressed(filepath, level):
+            click.secho(f"Skipping {name}, it is already at level {level}")
+        else:
+            todo.append((filepath, name))
+
+    jobs = (
+        Job(
+            ["flac", f"-{level}", "-f", filepath, "-o", f"{filepath}.new"],
+            name=name,
+            on_start=partial(
+                click.echo, f"Recompressing {name} [{left} left to recompress]"
+            ),
+            on_done=partial(_replace_if_identical, filepath),
+        )
+        for left, (filepath, name) in zip(range(len(todo) - 1, -1, -1), todo)
+    )
+    failed = []
+    results = run_jobs(jobs, config.SIMULTANEOUS_CONVERSIONS, return_exceptions=True)
+    for (filepath, name), result in zip(todo, results):
+        if isinstance(result, Exception):
+            if isinstance(result, JobFailedError):
+                result = result.stderr.strip() or result
+            click.secho(f"Error recompressing {name}: {result}", fg="red")
+            if os.path.isfile(f"{filepath}.new"):
+                os.remove(f"{filepath}.new")
+            failed.append(filepath)
+    return failed
+
+
+def _replace_if_identical(filepath, _=None):
+    """
+    Replace a FLAC with its recompressed .new file if their audio MD5s match.
+    Files without an MD5 have nothing to be checked against, so are replaced.
+    """
+    original, new = FlacFile(filepath).md5, FlacFile(f"{filepath}.new").md5
+    if any(original) and original != new:
+        raise OSError("The recompressed audio does not match the original")
+    os.replace(f"{filepath}.new", filepath)
+
+
+def is_compressed(filepath, level):
+    """Estimate whether a FLAC is already compressed at a level."""
+    block_size, max_order = COMPRESSION_LEVELS[level]
+    min_order = max(
+        (order for _, order in COMPRESSION_LEVELS.values() if order < max_order),
+        default=-1,
+    )
+    version = flac_version()
+    try:
+        vendor = mutagen.File(filepath).tags.vendor
+        flac = FlacFile(filepath)
+    except (AttributeError, ValueError, OSError, mutagen.MutagenError):
+        return False
+    if not version or vendor.split(" ")[:3] != ["reference", "libFLAC", version]:
+        return False
+    if flac.max_block_size != block_size:
+        return False
+    try:
+        order = max_lpc_order(flac)
+    except ValueError:
+        return False
+    return min_order < order <= max_order
+
+
+def max_lpc_order(flac):
+    """
+    Find the highest LPC order of the first subframes of frames sampled from
+    across a FLAC. Subframes that aren't LPC count as 0.
+    """
+    audio_size = flac.file_size - flac.audio_offset
+    runs = []
+    for i in range(SAMPLED_WINDOWS):
+        lo = flac.audio_offset + audio_size * (i + 1) // (SAMPLED_WINDOWS + 1)
+        runs.append(flac.frames_in(lo, lo + WINDOW_SIZE))
+    return max(flac.lpc_orders(runs), default=0)
+
+
+@lru_cache(maxsize=None)
+def flac_version():
+    """The version of the installed flac, e.g. 1.4.3, or None if it's unknown."""
+    try:
+        out = subprocess.run(
+            ["flac", "--version"], capture_output=True, text=True, check=True
+        ).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    parts = out.split()
+    return parts[1] if len(parts) > 1 else None
@@ -1,8 +1,20 @@
+import fcntl
+import hashlib
 import os
+import shutil
 import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+import click
+import mutagen
 
 from salmon import config
 
+COPY_STRATEGIES = ["reflink", "hardlink", "copy"]
+COPY_THREADS = 4
+# The Linux ioctl that clones a file's extents onto another (cp --reflink).
+FICLONE = 0x40049409
+
 
 def get_audio_files(path):
     """
@@ -32,22 +44,38 @@ def create_relative_path(root, path, filename):
     )  # [1:] to get rid of the slash.
 
 
-def compress(filepath):
-    """Re-compress a .flac file with the configured level."""
-    with open(os.devnull, "w") as devnull:
-        subprocess.call(
-            [
-                "flac",
-                f"-{config.FLAC_COMPRESSION_LEVEL}",
-                filepath,
-                "-o",
-                f"{filepath}.new",
-                "--delete-input-file",
-            ],
-            stdout=devnull,
-            stderr=devnull,
-        )
-    os.rename(f"{filepath}.new", filepath)
+def audio_checksum(filepath):
+    """
+    Return a checksum of a file's audio that doesn't change when it is retagged.
+    FLACs use the MD5 of the decoded audio stored in their STREAMINFO block; for
+    other files (and FLACs without one), the file is hashed minus its ID3 tags.
+    """
+    if filepath.lower().endswith(".flac"):
+        md5 = mutagen.File(filepath).info.md5_signature
+        if md5:
+            return f"{md5:032x}"
+
+    digest = hashlib.md5()
+    with open(filepath, "rb") as f:
+        start, end = 0, os.fstat(f.fileno()).st_size
+        header = f.read(10)
+        if header[:3] == b"ID3":
+            start = 10 + (
+                header[6] << 21 | header[7] << 14 | header[8] << 7 | header[9]
+            )
+        if end >= 128:
+            f.seek(end - 128)
+            if f.read(3) == b"TAG":
+                end -= 128
+        f.seek(start)
+        remaining = end - start
+        while remaining > 0:
+            chunk = f.read(min(remaining, 1 << 20))
+            if not chunk:
+                break
+            digest.update(chunk)
+            remaining -= len(chunk)
+    return digest.hexdigest()
 
 
 def alac_to_flac(filepath):
@@ -68,3 +96,80 @@ def alac_to_flac(filepath):
             stderr=devnull,
         )
     os.rename(f"{filepath}.flac", filepath)
+
+
+def copy_file(src, dest, link=True):
+    """
+    Copy a file with the configured COPY_STRATEGY, falling back down the list of
+    reflink, hardlink and copy from it when a strategy isn't supported. Files
+    that may be edited in place later, like audio, shouldn't be hardlinked to
+    their source, which `link` disables. The result is verified by size.
+    """
+    strategies = COPY_STRATEGIES[COPY_STRATEGIES.index(config.COPY_STRATEGY) :]
+    if not link and "hardlink" in strategies:
+        strategies.remove("hardlink")
+    for strategy in strategies:
+        if os.path.lexists(dest):
+            os.remove(dest)
+        try:
+            _COPIERS[strategy](src, dest)
+            break
+        except OSError:
+            if strategy == strategies[-1]:
+                raise
+    if os.path.getsize(dest) != os.path.getsize(src):
+        raise OSError(f"{dest} does not have the size of {src}")
+
+
+def _reflink(src, dest):
+    with open(src, "rb") as s, open(dest, "wb") as d:
+        fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+
+
+_COPIERS = {"reflink": _reflink, "hardlink": os.link, "copy": shutil.copyfile}
+
+
+class FileCopier:
+    """
+    Copies files with `copy_file` on a background thread pool, so large copies
+    don't hold up the scheduling of jobs meanwhile. A copy's `on_done` is called
+    on its thread as soon as it's made, so the copies made before a run is
+    interrupted are kept. `wait` reports each copy and re-raises the first
+    failure.
+    """
+
+    def __init__(self):
+        self.executor = ThreadPoolExecutor(max_workers=COPY_THREADS)
+        self.futures = []
+
+    def copy(self, src, dest, link=True, on_done=None):
+        future = self.executor.submit(_copy_and_report, src, dest, link, on_done)
+        self.futures.append((src, dest, future))
+
+    def wait(self, on_error=None):
+        """
+        Wait for the copies. If `on_error` is given, it's called with the
+        source, destination and error of every failed copy instead of raising.
+        """
+        for src, dest, future in self.futures:
+            try:
+                future.result()
+            except OSError as e:
+                if not on_error:
+                    raise
+                on_error(src, dest, e)
+                continue
+            click.secho(f"Copied {os.path.basename(dest)}")
+        self.futures = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.executor.shutdown(wait=True, cancel_futures=exc_type is not None)
+
+
+def _copy_and_report(src, dest, link, on_done):
+    copy_file(src, dest, link=link)
+    if on_done:
+        on_done()
@@ -0,0 +1,706 @@
+"""
+A FLAC decoder built on NumPy, for the checks and the spectral renderer, which
+want samples as arrays and often only from a small part of a file.
+
+Frames are found with an index of their sync codes, which is built from the
+SEEKTABLE when there is one so that only the bytes around the wanted range are
+scanned. They are then decoded in batches: subframe headers are read in Python,
+but the Rice residuals of every subframe in a batch are decoded in lockstep, one
+code of every subframe per step, and the LPC restoration is done the same way,
+so all the per-sample work happens in NumPy.
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from salmon import config
+
+# Roughly how many bytes of frames are decoded at once.
+BATCH_BYTES = 1 << 21
+# Longer than any frame header, so a header at the end of a range can be read.
+MAX_HEADER_LENGTH = 16
+
+BLOCK_SIZES = {
+    1: 192,
+    **{code: 576 << (code - 2) for code in range(2, 6)},
+    **{code: 256 << (code - 8) for code in range(8, 16)},
+}
+SAMPLE_SIZES = {1: 8, 2: 12, 4: 16, 5: 20, 6: 24, 7: 32}
+FIXED_COEFFICIENTS = ([], [1], [2, -1], [3, -3, 1], [4, -6, 4, -1])
+# The channel that carries the side signal, which has an extra bit, per assignment.
+SIDE_CHANNELS = {8: 1, 9: 0, 10: 1}
+
+
+def _crc8_table():
+    table = []
+    for byte in range(256):
+        crc = byte
+        for _ in range(8):
+            crc = (crc << 1 ^ 0x07 if crc & 0x80 else crc << 1) & 0xFF
+        table.append(crc)
+    return table
+
+
+CRC8_TABLE = _crc8_table()
+
+
+class FlacFile:
+    """
+    A FLAC file's stream info and frame index, and methods to decode it into
+    int32 arrays of shape (samples, channels).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.seekpoints = []
+        self._full_index = None
+        with open(path, "rb") as f:
+            magic = f.read(4)
+            if magic[:3] == b"ID3":
+                header = magic + f.read(6)
+                f.seek(10 + _syncsafe(header[6:10]))
+                magic = f.read(4)
+            if magic != b"fLaC":
+                raise ValueError("Not a FLAC file")
+            last = False
+            while not last:
+                header = f.read(4)
+                if len(header) < 4:
+                    raise ValueError("Truncated metadata")
+                last = bool(header[0] & 0x80)
+                block_type = header[0] & 0x7F
+                block = f.read(int.from_bytes(header[1:], "big"))
+                if block_type == 0:
+                    self._parse_streaminfo(block)
+                elif block_type == 3:
+                    self._parse_seektable(block)
+            self.audio_offset = f.tell()
+            self.file_size = os.fstat(f.fileno()).st_size
+        if not hasattr(self, "sample_rate"):
+            raise ValueError("Stream info metadata block absent")
+
+    def _parse_streaminfo(self, block):
+        self.min_block_size = int.from_bytes(block[0:2], "big")
+        self.max_block_size = int.from_bytes(block[2:4], "big")
+        self.max_frame_size = int.from_bytes(block[7:10], "big")
+        info = int.from_bytes(block[10:18], "big")
+        self.sample_rate = info >> 44
+        self.channels = (info >> 41 & 0x7) + 1
+        self.bits_per_sample = (info >> 36 & 0x1F) + 1
+        self.total_samples = info & 0xFFFFFFFFF
+        self.md5 = block[18:34]
+
+    def _parse_seektable(self, block):
+        for i in range(0, len(block) - 17, 18):
+            sample = int.from_bytes(block[i : i + 8], "big")
+            if sample != 0xFFFFFFFFFFFFFFFF:
+                offset = int.from_bytes(block[i + 8 : i + 16], "big")
+                self.seekpoints.append((sample, offset))
+        self.seekpoints.sort()
+
+    @property
+    def duration(self):
+        return self.total_samples / self.sample_rate
+
+    def frames(self, start=0, end=None):
+        """
+        Find the frames holding samples [start, end). Returns the byte offsets of
+        the frames, their first samples and block sizes, and the offset at which
+        the last of them ends.
+        """
+        end = self._clamp_end(end)
+        offsets, samples, sizes, stop = self._index(start, end)
+        wanted = np.flatnonzero((samples + sizes > start) & (samples < end))
+        if not wanted.size:
+            empty = np.zeros(0, dtype=np.int64)
+            return empty, empty, empty, self.audio_offset
+        first, last = wanted[0], wanted[-1]
+        if last + 1 < len(offsets):
+            stop = offsets[last + 1]
+        return (
+            offsets[first : last + 1],
+            samples[first : last + 1],
+            sizes[first : last + 1],
+            int(stop),
+        )
+
+    def decode(self, start=0, end=None):
+        """Decode samples [start, end) of the file."""
+        end = self._clamp_end(end)
+        offsets, samples, _, stop = self.frames(start, end)
+        if not offsets.size:
+            return np.zeros((0, self.channels), dtype=np.int32)
+        decoded = self.decode_frames(offsets, stop)
+        return decoded[start - samples[0] : end - samples[0]]
+
+    def decode_frames(self, offsets, stop):
+        """Decode consecutive frames at `offsets`, the last of which ends at `stop`."""
+        with open(self.path, "rb") as f:
+            f.seek(offsets[0])
+            data = f.read(stop - offsets[0])
+        ends = np.append(offsets[1:], stop) - offsets[0]
+        starts = offsets - offsets[0]
+        decoded = []
+        i = 0
+        while i < len(starts):
+            j = int(np.searchsorted(ends, starts[i] + BATCH_BYTES, side="right"))
+            j = max(j, i + 1)
+            decoded.append(
+                _decode_batch(
+                    data[starts[i] : ends[j - 1]],
+                    starts[i:j] - starts[i],
+                    self.bits_per_sample,
+                )
+            )
+            i = j
+        return np.concatenate(decoded)
+
+    def _clamp_end(self, end):
+        if self.total_samples:
+            return (
+                min(end, self.total_samples) if end is not None else self.total_samples
+            )
+        return end if end is not None else 1 << 62
+
+    def _index(self, start, end):
+        """
+        Index the frames of the region holding [start, end). With a SEEKTABLE,
+        only the bytes between the seekpoints around the region are scanned;
+        otherwise the whole file is indexed, once.
+        """
+        if not self.seekpoints:
+            if self._full_index is None:
+                self._full_index = self._scan(self.audio_offset, self.file_size, 0)
+            return self._full_index
+        lo, lo_sample, hi = self.audio_offset, 0, self.file_size
+        for sample, offset in self.seekpoints:
+            if sample <= start:
+                lo, lo_sample = self.audio_offset + offset, sample
+            elif sample >= end:
+                hi = self.audio_offset + offset
+                break
+        return self._scan(lo, hi, lo_sample)
+
+    def _scan(self, lo, hi, first_sample):
+        """
+        Find the frames in bytes [lo, hi), the first of which starts at sample
+        `first_sample`. Candidate sync codes are only taken as frames when their
+        header CRC matches and they continue the sample numbering of the frame
+        before them, which rules out sync codes that turn up in audio data.
+        """
+        with open(self.path, "rb") as f:
+            f.seek(lo)
+            data = f.read(hi - lo + MAX_HEADER_LENGTH)
+        raw = np.frombuffer(data, dtype=np.uint8)
+        candidates = np.flatnonzero((raw[:-1] == 0xFF) & (raw[1:] & 0xFE == 0xF8))
+        offsets, samples, sizes = [], [], []
+        expected = first_sample
+        stop = self.file_size
+        for candidate in candidates.tolist():
+            if candidate >= hi - lo:
+                stop = lo + candidate
+                break
+            header = _parse_frame_header(data, candidate)
+            if not header:
+                continue
+            number, variable, block_size = header[:3]
+            sample = number if variable else number * self.max_block_size
+            if sample != expected:
+                continue
+            offsets.append(lo + candidate)
+            samples.append(sample)
+            sizes.append(block_size)
+            expected = sample + block_size
+        else:
+            stop = hi
+        return (
+            np.array(offsets, dtype=np.int64),
+            np.array(samples, dtype=np.int64),
+            np.array(sizes, dtype=np.int64),
+            stop,
+        )
+
+    def frames_in(self, lo, hi):
+        """
+        Find the frames that start in bytes [lo, hi) without an index, so that
+        frames can be sampled from anywhere in a file. As the sample number the
+        first frame should have is unknown, a sync code is only taken as the
+        first frame when the frame after it is found too. Returns the offsets of
+        the frames and the offset at which the last of them ends.
+        """
+        frame_size = self.max_frame_size or (
+            self.max_block_size * self.channels * self.bits_per_sample // 8 + 1024
+        )
+        lo = max(lo, self.audio_offset)
+        with open(self.path, "rb") as f:
+            f.seek(lo)
+            data = f.read(hi - lo + frame_size + MAX_HEADER_LENGTH)
+        raw = np.frombuffer(data, dtype=np.uint8)
+        candidates = np.flatnonzero((raw[:-1] == 0xFF) & (raw[1:] & 0xFE == 0xF8))
+        frames = []
+        for candidate in candidates.tolist():
+            header = _parse_frame_header(data, candidate)
+            if header:
+                number, variable, block_size = header[:3]
+                sample = number if variable else number * self.max_block_size
+                frames.append((candidate, sample, block_size))
+
+        offsets, expected = [], None
+        for i, (offset, sample, block_size) in enumerate(frames):
+            if expected is None:
+                if not any(s == sample + block_size for _, s, _ in frames[i + 1 :]):
+                    continue
+            elif sample != expected:
+                continue
+            if offset >= hi - lo:
+                return np.array(offsets, dtype=np.int64) + lo, lo + offset
+            offsets.append(offset)
+            expected = sample + block_size
+        if lo + len(data) >= self.file_size:
+            # The last frame of the file has no frame after it.
+            stop = self.file_size
+        elif offsets:
+            stop = offsets.pop()
+        else:
+            stop = 0
+        return np.array(offsets, dtype=np.int64) + lo, lo + stop
+
+    def wasted_bits(self, runs):
+        """
+        Read the wasted bits of every subframe in runs of consecutive frames,
+        given as (offsets, stop) pairs, without decoding them.
+        """
+        chunks, offsets, size = [], [], 0
+        with open(self.path, "rb") as f:
+            for run_offsets, stop in runs:
+                if not len(run_offsets):
+                    continue
+                f.seek(run_offsets[0])
+                chunks.append(f.read(stop - run_offsets[0]))
+                offsets.append(run_offsets - run_offsets[0] + size)
+                size += len(chunks[-1])
+        if not chunks:
+            return np.zeros(0, dtype=np.int64)
+        wasted = _decode_batch(
+            b"".join(chunks),
+            np.concatenate(offsets),
+            self.bits_per_sample,
+            headers_only=True,
+        )
+        return wasted[wasted >= 0]
+
+    def lpc_orders(self, runs):
+        """
+        Read the LPC order of the first subframe of every frame in runs of
+        consecutive frames, given as (offsets, stop) pairs, without decoding
+        them. Subframes that aren't LPC have order 0.
+        """
+        orders = []
+        with open(self.path, "rb") as f:
+            for run_offsets, stop in runs:
+                if not len(run_offsets):
+                    continue
+                f.seek(run_offsets[0])
+                data = f.read(stop - run_offsets[0])
+                for offset in (run_offsets - run_offsets[0]).tolist():
+                    header = _parse_frame_header(data, offset)
+                    if not header:
+                        raise ValueError(f"Invalid frame header at byte {offset}")
+                    _, kind, _ = _parse_subframe_header(data, (offset + header[5]) * 8)
+                    orders.append(kind - 31 if kind >= 32 else 0)
+        return orders
+
+
+def decode(path, start=0, end=None, workers=None):
+    """
+    Decode samples [start, end) of a FLAC file, splitting its frames across a
+    process pool. `workers` defaults to SIMULTANEOUS_JOBS.
+    """
+    flac = FlacFile(path)
+    end = flac._clamp_end(end)
+    offsets, samples, _, stop = flac.frames(start, end)
+    if not offsets.size:
+        return np.zeros((0, flac.channels), dtype=np.int32)
+    workers = workers or config.SIMULTANEOUS_JOBS or os.cpu_count() or 1
+    bounds = np.linspace(0, len(offsets), workers + 1).astype(int)
+    chunks = [
+        (offsets[a:b], int(offsets[b]) if b < len(offsets) else stop)
+        for a, b in zip(bounds[:-1], bounds[1:])
+        if a < b
+    ]
+    if len(chunks) == 1:
+        decoded = flac.decode_frames(*chunks[0])
+    else:
+        with ProcessPoolExecutor(max_workers=len(chunks)) as executor:
+            decoded = np.concatenate(
+                list(executor.map(_decode_chunk, [path] * len(chunks), *zip(*chunks)))
+            )
+    return decoded[start - samples[0] : end - samples[0]]
+
+
+def _decode_chunk(path, offsets, stop):
+    return FlacFile(path).decode_frames(offsets, stop)
+
+
+def _parse_frame_header(data, offset):
+    """
+    Parse the frame header at a byte offset. Returns the frame (or sample)
+    number, whether the stream has a variable block size, the block size, the
+    channel assignment, the sample size (None for the STREAMINFO one) and the
+    header length, or None if there isn't a valid header there.
+    """
+    try:
+        if data[offset] != 0xFF or data[offset + 1] & 0xFE != 0xF8:
+            return None
+        variable = bool(data[offset + 1] & 1)
+        block_code, rate_code = data[offset + 2] >> 4, data[offset + 2] & 0xF
+        assignment, size_code = data[offset + 3] >> 4, data[offset + 3] >> 1 & 0x7
+        if (
+            not block_code
+            or rate_code == 15
+            or assignment > 10
+            or size_code == 3
+            or data[offset + 3] & 1
+        ):
+            return None
+
+        pos = offset + 4
+        first = data[pos]
+        length = 8 - (first ^ 0xFF).bit_length()
+        if length == 1 or length == 8:
+            return None
+        number = first & (0x7F >> length)
+        for byte in data[pos + 1 : pos + max(length, 1)]:
+            if byte & 0xC0 != 0x80:
+                return None
+            number = number << 6 | byte & 0x3F
+        pos += max(length, 1)
+
+        if block_code == 6:
+            block_size = data[pos] + 1
+            pos += 1
+        elif block_code == 7:
+            block_size = int.from_bytes(data[pos : pos + 2], "big") + 1
+            pos += 2
+        else:
+            block_size = BLOCK_SIZES[block_code]
+        if rate_code == 12:
+            pos += 1
+        elif rate_code in {13, 14}:
+            pos += 2
+
+        crc = 0
+        for byte in data[offset:pos]:
+            crc = CRC8_TABLE[crc ^ byte]
+        if crc != data[pos]:
+            return None
+    except IndexError:
+        return None
+    return (
+        number,
+        variable,
+        block_size,
+        assignment,
+        SAMPLE_SIZES.get(size_code),
+        pos + 1 - offset,
+    )
+
+
+def _decode_batch(data, offsets, bits_per_sample, headers_only=False):
+    """
+    Decode a run of whole frames starting at `offsets` in `data`. With
+    `headers_only`, the subframe headers are only walked, skipping the last
+    channel's residuals, and the wasted bits of every subframe are returned as
+    a (frames, channels) array, with -1 for channels a frame doesn't have.
+    """
+    # The padding lets reads run past the end without bounds checks.
+    raw = np.frombuffer(bytes(data) + bytes(16), dtype=np.uint8)
+    next_one = _next_one_table(raw)
+    headers = []
+    for offset in offsets.tolist():
+        header = _parse_frame_header(data, offset)
+        if not header:
+            raise ValueError(f"Invalid frame header at byte {offset}")
+        headers.append(header)
+
+    channels = max(h[3] + 1 if h[3] < 8 else 2 for h in headers)
+    max_block_size = max(h[2] for h in headers)
+    samples = np.zeros((len(headers), channels, max_block_size), dtype=np.int64)
+    wasted = np.full((len(headers), channels), -1 if headers_only else 0)
+    pos = [(offset + header[5]) * 8 for offset, header in zip(offsets, headers)]
+    predictors = []
+
+    for channel in range(channels):
+        residuals = []
+        for i, (_, _, block_size, assignment, size, _) in enumerate(headers):
+            if channel >= (assignment + 1 if assignment < 8 else 2):
+                continue
+            size = (size or bits_per_sample) + (
+                SIDE_CHANNELS.get(assignment) == channel
+            )
+            p, kind, shift = _parse_subframe_header(data, pos[i])
+            wasted[i, channel] = shift
+            p, predictor = _read_subframe(
+                data, raw, p, kind, size - shift, block_size, samples[i, channel]
+            )
+            if predictor:
+                order, coefficients, lpc_shift, partition_order, param_bits = predictor
+                residuals.append((i, p, block_size, order, partition_order, param_bits))
+                predictors.append((i, channel, order, coefficients, lpc_shift))
+            pos[i] = p
+        if headers_only and channel == channels - 1:
+            return wasted
+        if residuals:
+            ends = _decode_residuals(
+                raw, next_one, residuals, None if headers_only else samples[:, channel]
+            )
+            for (i, *_), end in zip(residuals, ends):
+                pos[i] = end
+
+    if predictors:
+        _restore(samples, predictors)
+    samples <<= wasted[:, :, np.newaxis]
+    if channels == 2:
+        _decorrelate(samples, np.array([h[3] for h in headers]))
+    return np.concatenate(
+        [samples[i, :, : h[2]].T for i, h in enumerate(headers)]
+    ).astype(np.int32)
+
+
+def _read_subframe(data, raw, p, kind, size, block_size, out):
+    """
+    Read a subframe after its header into `out`. Constant and verbatim
+    subframes are read whole; of fixed and LPC ones, only the warmup samples.
+    Returns the position after what was read and, for predicted subframes,
+    their order, coefficients, shift, partition order and Rice parameter size.
+    """
+    if kind == 0:
+        out[:block_size] = _int(data, p, size)
+        return p + size, None
+    if kind == 1:
+        out[:block_size] = _read_ints(raw, p + size * np.arange(block_size), size)
+        return p + size * block_size, None
+    if not (8 <= kind <= 12 or kind >= 32):
+        raise ValueError("Reserved subframe type")
+
+    order = kind - 8 if kind < 32 else kind - 31
+    out[:order] = _read_ints(raw, p + size * np.arange(order), size)
+    p += size * order
+    if kind < 32:
+        coefficients, lpc_shift = FIXED_COEFFICIENTS[order], 0
+    else:
+        precision = _uint(data, p, 4) + 1
+        lpc_shift = _int(data, p + 4, 5)
+        if precision == 16 or lpc_shift < 0:
+            raise ValueError("Invalid LPC subframe")
+        p += 9
+        coefficients = _read_ints(
+            raw, p + precision * np.arange(order), precision
+        ).tolist()
+        p += precision * order
+    method, partition_order = _uint(data, p, 2), _uint(data, p + 2, 4)
+    if method > 1 or block_size >> partition_order < order:
+        raise ValueError("Invalid residual coding")
+    return p + 6, (order, coefficients, lpc_shift, partition_order, 4 + method)
+
+
+def _parse_subframe_header(data, pos):
+    """Return the position after a subframe header, its type and wasted bits."""
+    header = _uint(data, pos, 8)
+    if header & 0x80:
+        raise ValueError("Invalid subframe header")
+    pos += 8
+    wasted = 0
+    if header & 1:
+        wasted = 1
+        while not _uint(data, pos, 1):
+            wasted += 1
+            pos += 1
+        pos += 1
+    return pos, header >> 1 & 0x3F, wasted
+
+
+def _next_one_table(raw):
+    """
+    Map every bit position to the position of the first one bit at or after it.
+    Positions past the last one bit map to a sentinel in the padding, far
+    enough from the end that reads from it stay in bounds.
+    """
+    bits = np.unpackbits(raw)
+    sentinel = (raw.size - 9) * 8
+    positions = np.where(bits, np.arange(bits.size, dtype=np.int32), sentinel)
+    backwards = positions[::-1]
+    np.minimum.accumulate(backwards, out=backwards)
+    return positions
+
+
+def _decode_residuals(raw, next_one, residuals, out):
+    """
+    Decode the Rice coded residuals of many subframes in lockstep, writing them
+    into their rows of `out` after the warmup samples. Every step decodes the
+    next code of every subframe: the first one bit at or after the start of a
+    code ends its unary quotient, and its remainder is the parameter's worth of
+    bits after that. Only the one bits are found per step; the quotients and
+    remainders of all the codes are extracted at the end. Partitions coded with
+    the escape code hold raw values, which are read as if they had a zero
+    quotient. Returns the bit positions at which the subframes end; with no
+    `out`, the codes are only walked to find them.
+    """
+    count = len(residuals)
+    lengths = [r[2] - r[3] for r in residuals]
+    longest = max(lengths)
+    pos = np.array([r[1] for r in residuals], dtype=np.int32)
+    param_bits = np.array([r[5] for r in residuals], dtype=np.int32)
+
+    # The residual indexes at which partitions start, with the subframes they
+    # start in. An empty first partition starts at the same index as the second.
+    boundaries = {}
+    for j, (_, _, block_size, order, partition_order, _) in enumerate(residuals):
+        partition_size = block_size >> partition_order
+        for partition in range(1 << partition_order):
+            start = max(partition * partition_size - order, 0)
+            passes = boundaries.setdefault(start, [[]])
+            if j in passes[-1]:
+                passes.append([])
+            passes[-1].append(j)
+    finishes = {}
+    for j, length in enumerate(lengths):
+        finishes.setdefault(length, []).append(j)
+
+    params = np.zeros(count, dtype=np.int32)
+    escaped = np.zeros(count, dtype=bool)
+    steps = np.ones(count, dtype=np.int32)
+    # Indexed [code, subframe], so that every step writes a contiguous row.
+    stops = np.empty((longest, count), dtype=np.int32)
+    events = []
+    ends = np.zeros(count, dtype=np.int64)
+
+    for i in range(longest + 1):
+        if i in boundaries:
+            for subframes in boundaries[i]:
+                idx = np.array(subframes)
+                bits = param_bits[idx]
+                param = _read_uints(raw, pos[idx], bits)
+                pos[idx] += bits
+                escape = param == (1 << bits) - 1
+                raw_bits = _read_uints(raw, pos[idx], 5)
+                params[idx] = np.where(escape, raw_bits, param)
+                pos[idx] += np.where(escape, 5, 0)
+                escaped[idx] = escape
+                events.append((i, idx, pos[idx], params[idx], escape))
+            steps = params + 1
+            any_escaped = escaped.any()
+        if i in finishes:
+            ends[finishes[i]] = pos[finishes[i]]
+        if i == longest:
+            break
+        np.take(next_one, pos, out=stops[i])
+        if any_escaped:
+            np.copyto(stops[i], pos - 1, where=escaped)
+        np.add(stops[i], steps, out=pos)
+    if out is None:
+        return ends.tolist()
+
+    stops = stops.T.astype(np.int64)
+    code_params = _forward_fill(events, 3, (count, longest), 0)
+    code_escaped = _forward_fill(events, 4, (count, longest), False)
+    starts = np.empty_like(stops)
+    starts[:, 1:] = stops[:, :-1] + 1 + code_params[:, :-1]
+    for i, idx, start, *_ in events:
+        starts[idx, i] = start
+
+    remainders = _read_uints(raw, stops + 1, code_params)
+    values = (stops - starts) << code_params | remainders
+    values = values >> 1 ^ -(values & 1)
+    if code_escaped.any():
+        values = np.where(code_escaped, _sign_extend(remainders, code_params), values)
+    for j, (i, _, block_size, order, _, _) in enumerate(residuals):
+        out[i, order:block_size] = values[j, : block_size - order]
+    return ends.tolist()
+
+
+def _forward_fill(events, field, shape, fill):
+    """Spread the values set at partition boundaries over the partitions' codes."""
+    values = np.full(shape, fill)
+    changed = np.zeros(shape, dtype=bool)
+    for event in events:
+        i, idx = event[0], event[1]
+        if i < shape[1]:
+            values[idx, i] = event[field]
+            changed[idx, i] = True
+    last = np.where(changed, np.arange(shape[1]), 0)
+    np.maximum.accumulate(last, axis=1, out=last)
+    return np.take_along_axis(values, last, axis=1)
+
+
+def _restore(samples, predictors):
+    """
+    Undo the prediction of every fixed and LPC subframe in lockstep, one sample
+    of every subframe per step. Coefficients are padded to the highest order, so
+    lower order subframes predict from zero coefficients.
+    """
+    rows = np.array([(i, channel) for i, channel, *_ in predictors])
+    orders = np.array([p[2] for p in predictors])
+    shifts = np.array([p[4] for p in predictors], dtype=np.int64)
+    width = max(int(orders.max()), 1)
+    coefficients = np.zeros((len(predictors), width), dtype=np.int64)
+    for r, (*_, order, coefs, _) in enumerate(predictors):
+        # Reversed so that they line up with the samples preceding the predicted one.
+        coefficients[r, width - order :] = coefs[::-1]
+
+    x = np.zeros((len(predictors), width + samples.shape[2]), dtype=np.int64)
+    x[:, width:] = samples[rows[:, 0], rows[:, 1]]
+    for n in range(int(orders.min()), samples.shape[2]):
+        prediction = np.einsum("ij,ij->i", x[:, n : n + width], coefficients)
+        restored = x[:, width + n] + (prediction >> shifts)
+        x[:, width + n] = np.where(n >= orders, restored, x[:, width + n])
+    samples[rows[:, 0], rows[:, 1]] = x[:, width:]
+
+
+def _decorrelate(samples, assignments):
+    left_side = assignments == 8
+    samples[left_side, 1] = samples[left_side, 0] - samples[left_side, 1]
+    side_right = assignments == 9
+    samples[side_right, 0] += samples[side_right, 1]
+    mid_side = assignments == 10
+    side = samples[mid_side, 1]
+    mid = samples[mid_side, 0] << 1 | side & 1
+    samples[mid_side, 0] = mid + side >> 1
+    samples[mid_side, 1] = mid - side >> 1
+
+
+def _read_uints(raw, positions, widths):
+    """Read unsigned big endian integers of up to 32 bits at bit positions."""
+    positions = np.asarray(positions, dtype=np.int64)
+    windows = np.lib.stride_tricks.sliding_window_view(raw, 8)[positions >> 3]
+    words = windows.view(">u8")[..., 0].astype(np.uint64)
+    words <<= (positions & 7).astype(np.uint64)
+    # Shifting in two steps keeps zero width reads from shifting by 64 bits.
+    widths = np.asarray(widths).astype(np.uint64)
+    return (words >> (np.uint64(63) - widths) >> np.uint64(1)).astype(np.int64)
+
+
+def _read_ints(raw, positions, width):
+    return _sign_extend(_read_uints(raw, positions, np.int64(width)), width)
+
+
+def _sign_extend(values, widths):
+    sign = np.int64(1) << (np.asarray(widths, dtype=np.int64) - 1).clip(0)
+    return np.where(widths, (values ^ sign) - sign, 0)
+
+
+def _uint(data, pos, n):
+    start, end = pos >> 3, (pos + n + 7) >> 3
+    value = int.from_bytes(data[start:end], "big")
+    return value >> ((end << 3) - pos - n) & ((1 << n) - 1)
+
+
+def _int(data, pos, n):
+    value = _uint(data, pos, n)
+    return value - (1 << n) if n and value >> (n - 1) else value
+
+
+def _syncsafe(data):
+    return data[0] << 21 | data[1] << 14 | data[2] << 7 | data[3]
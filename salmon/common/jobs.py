@@ -0,0 +1,241 @@
+import asyncio
+import os
+import signal
+
+from salmon import config
+from salmon.errors import JobFailedError
+
+loop = asyncio.get_event_loop()
+
+CPU_COUNT = os.cpu_count() or 1
+DEVNULL = asyncio.subprocess.DEVNULL
+PIPE = asyncio.subprocess.PIPE
+TEE_CHUNK = 1 << 16
+
+
+def _global_limit():
+    return config.SIMULTANEOUS_JOBS or CPU_COUNT
+
+
+GLOBAL_SLOTS = asyncio.Semaphore(_global_limit())
+
+
+class Job:
+    """
+    A single subprocess to run on a pool. `command` is an argument list, or a
+    string to be run through the shell when `shell` is set. `on_start` is called
+    when the job gets a slot and `on_done` with the job's stdout once it exits
+    cleanly. `on_done` runs on a worker thread, so the file IO done there, like
+    tagging and hashing outputs, doesn't hold up the other jobs.
+    """
+
+    def __init__(
+        self,
+        command,
+        name=None,
+        shell=False,
+        capture_stdout=False,
+        on_start=None,
+        on_done=None,
+    ):
+        self.command = command
+        self.name = name or (command if shell else os.path.basename(command[0]))
+        self.shell = shell
+        self.capture_stdout = capture_stdout
+        self.on_start = on_start
+        self.on_done = on_done
+
+
+class TeeJob(Job):
+    """
+    A job whose `command` produces a stream that is copied into the stdin of
+    every command in `sinks`, so the work of producing it is done once for all
+    of them. The sinks are argument lists too, or shell strings with `shell`.
+    The job holds one slot, and fails if any of its processes does.
+    """
+
+    def __init__(self, command, sinks, **kwargs):
+        super().__init__(command, **kwargs)
+        self.sinks = sinks
+
+
+class Pool:
+    """
+    A pool of subprocess jobs. Every pool draws from the global budget of
+    SIMULTANEOUS_JOBS slots (the core count by default), and can be limited
+    further with its own limit, which is where the SIMULTANEOUS_* options go.
+    """
+
+    def __init__(self, limit=None):
+        self.limit = min(limit or _global_limit(), _global_limit())
+        self.slots = asyncio.Semaphore(self.limit)
+
+    async def run(self, job):
+        """Run one job once both a pool and a global slot are free."""
+        async with self.slots, GLOBAL_SLOTS:
+            if job.on_start:
+                job.on_start()
+            if isinstance(job, TeeJob):
+                returncode, out, err = await _run_tee(job)
+            else:
+                returncode, out, err = await _run_single(job)
+
+        if returncode != 0:
+            raise JobFailedError(job, returncode, err)
+        if job.on_done:
+            await loop.run_in_executor(None, job.on_done, out)
+        return out
+
+    async def map(self, jobs, return_exceptions=False):
+        """
+        Run an iterable of jobs and return their outputs in order. The iterable
+        is consumed lazily: no more jobs are queued than there are slots, so
+        generators of jobs see backpressure. The first failure cancels (and
+        kills) everything still running and is re-raised, unless
+        `return_exceptions` is set, in which case the errors of failed jobs are
+        returned in place of their outputs and the rest keep running.
+        """
+        results = {}
+        pending = set()
+        try:
+            for i, job in enumerate(jobs):
+                if len(pending) >= self.limit:
+                    pending = await self._collect(pending, results)
+                run = self.run(job)
+                if return_exceptions:
+                    run = _settle(run)
+                pending.add(_indexed(i, run))
+            while pending:
+                pending = await self._collect(pending, results)
+        except BaseException:
+            await cancel(pending)
+            raise
+        return [results[i] for i in sorted(results)]
+
+    @staticmethod
+    async def _collect(pending, results):
+        done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            i, out = task.result()
+            results[i] = out
+        return pending
+
+
+async def _spawn(command, shell, stdin=None, stdout=DEVNULL):
+    if shell:
+        return await asyncio.create_subprocess_shell(
+            command, stdin=stdin, stdout=stdout, stderr=PIPE, start_new_session=True
+        )
+    return await asyncio.create_subprocess_exec(
+        *command, stdin=stdin, stdout=stdout, stderr=PIPE, start_new_session=True
+    )
+
+
+async def _run_single(job):
+    proc = await _spawn(
+        job.command, job.shell, stdout=PIPE if job.capture_stdout else DEVNULL
+    )
+    try:
+        out, err = await proc.communicate()
+    except asyncio.CancelledError:
+        _kill(proc)
+        await proc.wait()
+        raise
+    return proc.returncode, out, err
+
+
+async def _run_tee(job):
+    procs = []
+    try:
+        for command in job.sinks:
+            procs.append(await _spawn(command, job.shell, stdin=PIPE))
+        source = await _spawn(job.command, job.shell, stdout=PIPE)
+        procs.insert(0, source)
+        _, *errs = await asyncio.gather(
+            _pump(source, procs[1:]), *(_finish(proc) for proc in procs)
+        )
+    except BaseException:
+        for proc in procs:
+            _kill(proc)
+        await asyncio.gather(*(proc.wait() for proc in procs))
+        raise
+    for proc, err in zip(procs, errs):
+        if proc.returncode != 0:
+            return proc.returncode, None, err
+    return 0, None, b""
+
+
+async def _pump(source, sinks):
+    """Copy the stdout of the source into every sink still accepting input."""
+    open_sinks = list(sinks)
+    while True:
+        chunk = await source.stdout.read(TEE_CHUNK)
+        if not chunk:
+            break
+        for sink in list(open_sinks):
+            try:
+                sink.stdin.write(chunk)
+                await sink.stdin.drain()
+            except (BrokenPipeError, ConnectionResetError):
+                open_sinks.remove(sink)
+    for sink in open_sinks:
+        sink.stdin.close()
+
+
+async def _finish(proc):
+    """Wait for a process to exit, returning its stderr."""
+    err, _ = await asyncio.gather(proc.stderr.read(), proc.wait())
+    return err
+
+
+async def _settle(coro):
+    """
+    Return the error of a failed job instead of raising it. A job also fails if
+    its on_done callback raises, as when the tags of its output can't be written.
+    """
+    try:
+        return await coro
+    except Exception as e:
+        return e
+
+
+def _indexed(i, coro):
+    async def wrapper():
+        return i, await coro
+
+    return asyncio.ensure_future(wrapper())
+
+
+def _kill(proc):
+    """Kill a job and anything it spawned (shell pipelines run in their own group)."""
+    try:
+        os.killpg(proc.pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+
+async def cancel(tasks):
+    """Cancel a set of tasks and wait until their processes are dead."""
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def run_jobs(jobs, limit=None, return_exceptions=False):
+    """Synchronously run jobs on a new pool."""
+    return run_coroutine(Pool(limit).map(jobs, return_exceptions=return_exceptions))
+
+
+def run_coroutine(coro):
+    """
+    Run a coroutine that runs jobs to completion. If the user interrupts it, it
+    is cancelled and every job's process is killed before the interrupt is
+    re-raised, so nothing is left orphaned.
+    """
+    task = asyncio.ensure_future(coro)
+    try:
+        return loop.run_until_complete(task)
+    except KeyboardInterrupt:
+        task.cancel()
+        loop.run_until_complete(asyncio.gather(task, return_exceptions=True))
+        raise
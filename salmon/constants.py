@@ -384,3 +384,6 @@ ALLOWED_EXTENSIONS = {
     ".sfv",
     ".txt",
 }
+
+# The manifest the converters keep in their output folders to resume runs.
+MANIFEST_NAME = ".salmon-manifest.json"
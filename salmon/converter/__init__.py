@@ -1,8 +1,17 @@
+import os
+
 import click
 
 from salmon.common import commandgroup
-from salmon.converter.downconverting import convert_folder
-from salmon.converter.transcoding import transcode_folder
+from salmon.converter.batch import transcode_batch
+from salmon.converter.downconverting import (
+    convert_and_transcode_folder,
+    convert_folder,
+)
+from salmon.converter.transcoding import (
+    transcode_folder,
+    transcode_folder_multi,
+)
 
 VALID_TRANSCODE_BITRATES = ["V0", "320"]
 
@@ -17,27 +26,66 @@ def validate_bitrate(ctx, param, value):
         )
 
 
+def validate_bitrates(ctx, param, value):
+    bitrates = []
+    for bitrate in value:
+        bitrate = validate_bitrate(ctx, param, bitrate)
+        if bitrate not in bitrates:
+            bitrates.append(bitrate)
+    return bitrates
+
+
 @commandgroup.command()
-@click.argument(
-    "path", type=click.Path(exists=True, file_okay=False, resolve_path=True), nargs=1
-)
+@click.argument("paths", type=click.Path(file_okay=False), nargs=-1, required=True)
 @click.option(
     "--bitrate",
     "-b",
     type=click.STRING,
-    callback=validate_bitrate,
+    callback=validate_bitrates,
     required=True,
-    help=f'Bitrate to transcode to ({", ".join(VALID_TRANSCODE_BITRATES)})',
+    multiple=True,
+    help=f'Bitrate to transcode to ({", ".join(VALID_TRANSCODE_BITRATES)}), can '
+    "be given more than once to decode every FLAC once for all of them",
+)
+@click.option(
+    "--batch",
+    is_flag=True,
+    help="Transcode every dir given (or matched by a glob) on one pool, carrying "
+    "on past failed files and saving the results to the database",
 )
-def transcode(path, bitrate):
+def transcode(paths, bitrate, batch):
     """Transcode a dir of FLACs into "perfect" MP3"""
-    transcode_folder(path, bitrate)
+    if batch:
+        transcode_batch(paths, bitrate)
+        return
+    if len(paths) != 1 or not os.path.isdir(paths[0]):
+        raise click.BadParameter(
+            "Give a single existing dir, or use --batch.", param_hint="PATHS"
+        )
+    path = os.path.abspath(paths[0])
+    if len(bitrate) == 1:
+        transcode_folder(path, bitrate[0])
+    else:
+        transcode_folder_multi(path, bitrate)
 
 
 @commandgroup.command()
 @click.argument(
     "path", type=click.Path(exists=True, file_okay=False, resolve_path=True), nargs=1
 )
-def downconv(path):
+@click.option(
+    "--bitrate",
+    "-b",
+    type=click.STRING,
+    callback=validate_bitrates,
+    multiple=True,
+    help="Also transcode to a bitrate "
+    f'({", ".join(VALID_TRANSCODE_BITRATES)}) in the same pass, can be given '
+    "more than once",
+)
+def downconv(path, bitrate):
     """Downconvert a dir of 24bit FLACs to 16bit"""
-    convert_folder(path)
+    if bitrate:
+        convert_and_transcode_folder(path, bitrate)
+    else:
+        convert_folder(path)
@@ -0,0 +1,160 @@
+"""
+Batch transcodes of many releases. Every FLAC of every release is scheduled on
+one pool sized to the machine, longest tracks first, so that a long track isn't
+left to run on its own at the end of the batch. A failed file doesn't stop the
+rest of the batch, and the result of every file is saved to the database.
+"""
+
+import glob
+import os
+import sqlite3
+import time
+
+import click
+import mutagen
+
+from salmon.common.figles import FileCopier
+from salmon.common.jobs import run_jobs
+from salmon.converter.transcoding import (
+    open_transcode_folders,
+    plan_transcodes,
+    transcode_job,
+)
+from salmon.database import DB_PATH
+from salmon.errors import JobFailedError
+
+
+def transcode_batch(patterns, bitrates):
+    folders = expand_folders(patterns)
+    if not folders:
+        click.secho("No folders matched.", fg="red")
+        raise click.Abort
+
+    batch = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime())
+    results = []
+    copier = FileCopier()
+    todo = []
+    opened = []
+    for folder in folders:
+        click.secho(f"\nPlanning {folder}", fg="cyan", bold=True)
+        try:
+            manifests = open_transcode_folders(folder, bitrates)
+            for task in plan_transcodes(folder, manifests, copier):
+                todo.append((task, manifests))
+            opened.extend(manifests.values())
+        except click.Abort:
+            results.append((folder, None, None, "A lossy file was found."))
+            continue
+        except (OSError, mutagen.MutagenError) as e:
+            click.secho(f"Error reading {folder}: {e}", fg="red")
+            results.append((folder, None, None, str(e)))
+            continue
+        for bitrate in bitrates:
+            if bitrate not in manifests:
+                results.append((folder, bitrate, None, "The output folder exists."))
+
+    todo.sort(key=lambda t: _duration(t[0][0]), reverse=True)
+    click.secho(
+        f"\nTranscoding {len(todo)} files from {len(folders)} folders",
+        fg="cyan",
+        bold=True,
+    )
+    jobs = (
+        transcode_job(*task, files_left, manifests)
+        for files_left, (task, manifests) in zip(range(len(todo) - 1, -1, -1), todo)
+    )
+
+    def copy_failed(src, dest, error):
+        click.secho(f"Error copying {os.path.basename(src)}: {error}", fg="red")
+        results.append((src, None, dest, str(error)))
+
+    with copier:
+        outs = run_jobs(jobs, return_exceptions=True)
+        copier.wait(on_error=copy_failed)
+
+    failed = 0
+    for ((file_, outputs, *_), _), out in zip(todo, outs):
+        error = None
+        if isinstance(out, Exception):
+            failed += 1
+            error = _report_failure(file_, out)
+        for bitrate, output in outputs.items():
+            results.append((file_, bitrate, output, error))
+            # Don't leave partial outputs behind in a folder that may be uploaded.
+            if error and os.path.isfile(output):
+                os.remove(output)
+    save_results(batch, results)
+    _finish_manifests(opened, results)
+
+    click.secho(
+        f"\nTranscoded {len(todo) - failed} of {len(todo)} files.",
+        fg="green" if not failed else "yellow",
+        bold=True,
+    )
+    if any(error for *_, error in results):
+        click.secho(
+            "The failures are saved to the transcode_results table, as batch "
+            f"{batch}.",
+            fg="red",
+        )
+
+
+def expand_folders(patterns):
+    """
+    Expand a list of folders and globs into the folders they match, in order.
+    Release folders often have brackets in their names, so existing folders are
+    taken as they are rather than globbed.
+    """
+    folders = []
+    for pattern in patterns:
+        pattern = os.path.expanduser(pattern)
+        matches = [pattern] if os.path.isdir(pattern) else sorted(glob.glob(pattern))
+        for match in matches:
+            match = os.path.abspath(match)
+            if os.path.isdir(match) and match not in folders:
+                folders.append(match)
+    return folders
+
+
+def save_results(batch, results):
+    """Save a list of (path, bitrate, output, error) results of a batch."""
+    with sqlite3.connect(DB_PATH) as conn:
+        cursor = conn.cursor()
+        cursor.executemany(
+            "INSERT INTO transcode_results (batch, path, bitrate, output, error) "
+            "VALUES (?, ?, ?, ?, ?)",
+            [(batch, *result) for result in results],
+        )
+        conn.commit()
+
+
+def _finish_manifests(manifests, results):
+    """
+    Delete the manifests of the output folders with no failures, leaving the
+    others to be resumed.
+    """
+    failed = [output for _, _, output, error in results if error and output]
+    for manifest in manifests:
+        prefix = os.path.join(manifest.folder, "")
+        if not any(output.startswith(prefix) for output in failed):
+            manifest.finish()
+
+
+def _report_failure(file_, error):
+    if isinstance(error, JobFailedError):
+        click.secho(
+            f"Error transcoding {os.path.basename(file_)}, "
+            f"error {error.returncode}:",
+            fg="red",
+        )
+        click.secho(error.stderr)
+        return error.stderr.strip() or str(error)
+    click.secho(f"Error writing {os.path.basename(file_)}: {error}", fg="red")
+    return str(error)
+
+
+def _duration(filepath):
+    try:
+        return mutagen.File(filepath).info.length
+    except (AttributeError, OSError, mutagen.MutagenError):
+        return 0
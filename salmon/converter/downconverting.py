@@ -1,41 +1,95 @@
 import os
 import re
 import shlex
-import subprocess
-import time
 from copy import copy
-from shutil import copyfile
+from functools import partial
 
 import click
 
-from salmon import config
+from salmon.common.figles import FileCopier
+from salmon.common.jobs import Job, TeeJob
+from salmon.converter.manifest import open_output_folder
+from salmon.converter.transcoding import (
+    DECODE_COMMAND,
+    _generate_transcode_path_name,
+    _get_files_to_handle,
+    _mp3_path,
+    _validate_folder_is_lossless,
+    copy_tags,
+    encode_commands,
+    queue_copy,
+    run_with_copies,
+)
 from salmon.errors import InvalidSampleRate
 from salmon.tagger.audio_info import gather_audio_info
 
-THREADS = [None] * config.SIMULTANEOUS_CONVERSIONS
 COMMAND = "sox {input_} -G -b 16 {output} rate -v -L {rate} dither"
+# To downconvert and transcode at once, sox's resampled and dithered output is
+# teed as raw PCM into a FLAC encoder and an MP3 encoder per bitrate.
+PCM_COMMAND = (
+    "sox {input_} -G -b 16 -e signed-integer -t raw --endian little - "
+    "rate -v -L {rate} dither"
+)
+FLAC_ENCODE_COMMAND = (
+    "flac --silent --force-raw-format --endian=little --sign=signed "
+    "--channels={channels} --bps=16 --sample-rate={rate} -o {output} -"
+)
+LAME_RAW_FORMAT = "-r --signed --little-endian --bitwidth 16 -s {khz} -m {mode}"
 FLAC_FOLDER_REGEX = re.compile(r"(24 ?bit )?FLAC", flags=re.IGNORECASE)
 
 
 def convert_folder(path):
     new_path = _generate_conversion_path_name(path)
-    if os.path.isdir(new_path):
-        return click.secho(
-            f"{new_path} already exists, please delete it to re-convert.", fg="red"
-        )
+    manifest = open_output_folder(new_path, "convert")
+    if not manifest:
+        return None
 
     files_convert, files_copy = _determine_files_actions(path)
-    _convert_files(path, new_path, files_convert, files_copy)
+    _convert_files(path, new_path, files_convert, files_copy, manifest)
+    manifest.finish()
+    return new_path
+
+
+def convert_and_transcode_folder(path, bitrates):
+    """
+    Downconvert a folder to 16bit FLAC and transcode it to MP3 in one pass. Each
+    24bit file is resampled and dithered once, and the result feeds both the
+    FLAC and the MP3 encoders. The MP3 folders are named as if the new 16bit
+    folder was transcoded, and ones that exist but can't be resumed are skipped.
+    Returns the 16bit folder and a dict of the bitrates transcoded to and their
+    folders, or None if the 16bit folder can't be made.
+    """
+    _validate_folder_is_lossless(path)
+    new_path = _generate_conversion_path_name(path)
+    manifest = open_output_folder(new_path, "convert")
+    if not manifest:
+        return None
+    mp3_manifests = {}
+    for bitrate in bitrates:
+        mp3_path = _generate_transcode_path_name(new_path, bitrate)
+        mp3_manifest = open_output_folder(mp3_path, "transcode")
+        if mp3_manifest:
+            mp3_manifests[bitrate] = mp3_manifest
+
+    files_convert, files_copy = _determine_files_actions(path)
+    _convert_and_transcode_files(
+        path, manifest, mp3_manifests, files_convert, files_copy
+    )
+    for finished in [manifest, *mp3_manifests.values()]:
+        finished.finish()
+    return new_path, {
+        bitrate: mp3_manifest.folder for bitrate, mp3_manifest in mp3_manifests.items()
+    }
 
 
 def _determine_files_actions(path):
     convert_files = []
-    copy_files = [os.path.join(r, f) for r, _, files in os.walk(path) for f in files]
+    copy_files = _get_files_to_handle(path)
     audio_info = gather_audio_info(path)
     for figle in copy(copy_files):
         for info_figle, figle_info in audio_info.items():
             if figle.endswith(info_figle) and figle_info["precision"] == 24:
-                convert_files.append((figle, figle_info["sample rate"]))
+                convert_files.append((figle, figle_info))
                 copy_files.remove(figle)
     return convert_files, copy_files
 
@@ -52,57 +106,170 @@ def _generate_conversion_path_name(path):
     return os.path.join(os.path.dirname(path), foldername)
 
 
-def _convert_files(old_path, new_path, files_convert, files_copy):
-    files_left = len(files_convert) - 1
-    files = iter(files_convert)
-
+def _convert_files(old_path, new_path, files_convert, files_copy, manifest):
+    copier = FileCopier()
     for file_ in files_copy:
         output = file_.replace(old_path, new_path)
-        _create_path(output)
-        copyfile(file_, output)
-        click.secho(f"Copied {os.path.basename(file_)}")
-
-    converting = True
-    while converting:
-        converting = False
-        for i, thread in enumerate(THREADS):
-            if thread and thread.poll() is not None:
-                if thread.poll() != 0:
-                    click.secho(
-                        f"Error downconverting a file, error {thread.poll()}:", fg="red"
-                    )
-                    click.secho(thread.communicate()[1].decode("utf-8", "ignore"))
-                    raise click.Abort
-                try:
-                    thread.kill()
-                except:  # noqa: E722
-                    pass
-
-            if not thread or thread.poll() is not None:
-                try:
-                    file_, sample_rate = next(files)
-                except StopIteration:
-                    break
-
-                output = file_.replace(old_path, new_path)
-                THREADS[i] = _convert_single_file(
-                    file_, output, sample_rate, files_left
-                )
-                files_left -= 1
-            converting = True
-        time.sleep(0.1)
-
-
-def _convert_single_file(file_, output, sample_rate, files_left):
-    click.echo(f"Converting {os.path.basename(file_)} [{files_left} left to convert]")
+        queue_copy(
+            copier, manifest, file_, output, link=not file_.lower().endswith(".flac")
+        )
+
+    todo = []
+    for file_, info in files_convert:
+        output = file_.replace(old_path, new_path)
+        command = COMMAND.format(
+            input_=shlex.quote(file_),
+            output=shlex.quote(output),
+            rate=_get_final_sample_rate(info["sample rate"]),
+        )
+        if manifest.complete(file_, output, command):
+            click.secho(f"Skipping {os.path.basename(file_)}, it is already done")
+        else:
+            todo.append((file_, output, command))
+
+    jobs = (
+        _convert_single_file(
+            file_,
+            output,
+            command,
+            files_left,
+            manifest.recorder(file_, {output: command}),
+        )
+        for files_left, (file_, output, command) in zip(
+            range(len(todo) - 1, -1, -1), todo
+        )
+    )
+    run_with_copies(jobs, copier, "downconverting")
+
+
+def _convert_single_file(file_, output, command, files_left, on_done):
     _create_path(output)
-    command = COMMAND.format(
-        input_=shlex.quote(file_),
-        output=shlex.quote(output),
-        rate=_get_final_sample_rate(sample_rate),
+    return Job(
+        command,
+        name=os.path.basename(file_),
+        shell=True,
+        on_start=partial(
+            click.echo,
+            f"Converting {os.path.basename(file_)} [{files_left} left to convert]",
+        ),
+        on_done=on_done,
     )
-    return subprocess.Popen(
-        command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True
+
+
+def _convert_and_transcode_files(
+    old_path, manifest, mp3_manifests, files_convert, files_copy
+):
+    copier = FileCopier()
+    transcode = []
+    for file_ in files_copy:
+        is_flac = file_.lower().endswith(".flac")
+        output = file_.replace(old_path, manifest.folder)
+        queue_copy(copier, manifest, file_, output, link=not is_flac)
+        if is_flac:
+            transcode.append(file_)
+        else:
+            for mp3_manifest in mp3_manifests.values():
+                output = file_.replace(old_path, mp3_manifest.folder)
+                queue_copy(copier, mp3_manifest, file_, output)
+
+    def mp3_outputs(file_):
+        return {
+            bitrate: _mp3_path(file_.replace(old_path, mp3_manifest.folder))
+            for bitrate, mp3_manifest in mp3_manifests.items()
+        }
+
+    todo = []
+    for file_, info in files_convert:
+        rate = _get_final_sample_rate(info["sample rate"])
+        flac_output = file_.replace(old_path, manifest.folder)
+        outputs = mp3_outputs(file_)
+        _create_path(flac_output)
+        sinks = [
+            FLAC_ENCODE_COMMAND.format(
+                channels=info["channels"], rate=rate, output=shlex.quote(flac_output)
+            ),
+            *encode_commands(
+                outputs,
+                input_format=LAME_RAW_FORMAT.format(
+                    khz=f"{rate / 1000:g}", mode="m" if info["channels"] == 1 else "j"
+                ),
+            ),
+        ]
+        todo.append(
+            (
+                file_,
+                PCM_COMMAND.format(input_=shlex.quote(file_), rate=rate),
+                sinks,
+                [(manifest, flac_output), *_targets(mp3_manifests, outputs)],
+                ["16bit FLAC", *outputs],
+            )
+        )
+    for file_ in transcode if mp3_manifests else []:
+        outputs = mp3_outputs(file_)
+        todo.append(
+            (
+                file_,
+                DECODE_COMMAND.format(input_=shlex.quote(file_)),
+                encode_commands(outputs),
+                _targets(mp3_manifests, outputs),
+                list(outputs),
+            )
+        )
+
+    todo = [item for item in map(_pending, todo) if item]
+    finished = iter(range(1, len(todo) + 1))
+    jobs = (
+        TeeJob(
+            source,
+            sinks,
+            name=os.path.basename(file_),
+            shell=True,
+            on_start=partial(
+                click.echo,
+                f"Converting {os.path.basename(file_)} to {', '.join(labels)}",
+            ),
+            on_done=partial(
+                _finish_file, file_, source, sinks, targets, finished, len(todo)
+            ),
+        )
+        for file_, source, sinks, targets, labels in todo
+    )
+    run_with_copies(jobs, copier, "converting")
+
+
+def _targets(manifests, outputs):
+    return [(manifests[bitrate], output) for bitrate, output in outputs.items()]
+
+
+def _pending(item):
+    """
+    Leave out the outputs of a file that are already done, removing partial ones,
+    so that only the encoders of the rest are fed. Returns None if all are done.
+    """
+    file_, source, sinks, targets, labels = item
+    pending = [
+        (sink, target, label)
+        for sink, target, label in zip(sinks, targets, labels)
+        if not target[0].complete(file_, target[1], f"{source} | {sink}")
+    ]
+    if not pending:
+        click.secho(f"Skipping {os.path.basename(file_)}, it is already done")
+        return None
+    sinks, targets, labels = map(list, zip(*pending))
+    return file_, source, sinks, targets, labels
+
+
+def _finish_file(file_, source, sinks, targets, finished, total, _):
+    for (manifest, output), sink in zip(targets, sinks):
+        copy_tags(file_, output)
+        manifest.record(file_, output, f"{source} | {sink}")
+    _report_finished(file_, finished, total)
+
+
+def _report_finished(file_, finished, total):
+    click.secho(
+        f"Finished {os.path.basename(file_)} [{next(finished)}/{total} files done]",
+        fg="green",
     )
 
 
@@ -0,0 +1,153 @@
+"""
+A manifest kept in the output folder of a transcode or downconvert while it is
+being made. For every output it records the size, mtime and checksum of its
+source, the command that produced it and its own size, mtime and checksum, so an
+interrupted run can be resumed: outputs that are still valid are skipped, and
+everything else is made again. Files are only hashed when their size and mtime
+don't match the recorded ones. The manifest is deleted once every output of the
+folder is made, so it doesn't end up in the upload.
+"""
+
+import hashlib
+import json
+import os
+import threading
+
+import click
+
+from salmon.constants import MANIFEST_NAME
+
+MANIFEST_VERSION = 1
+# The command recorded for files that are copied rather than converted.
+COPY_COMMAND = "copy"
+
+
+def open_output_folder(path, action):
+    """
+    Create an output folder and its manifest, or open them to resume a run.
+    Folders that exist without a manifest weren't made by a resumable run, so
+    they are left alone and None is returned.
+    """
+    if os.path.isdir(path):
+        if not os.path.isfile(os.path.join(path, MANIFEST_NAME)):
+            click.secho(
+                f"{path} already exists, please delete it to re-{action}.", fg="red"
+            )
+            return None
+        click.secho(f"Resuming the {action} into {path}...", fg="yellow")
+    os.makedirs(path, exist_ok=True)
+    manifest = Manifest(path)
+    manifest.save()
+    return manifest
+
+
+class Manifest:
+    def __init__(self, folder):
+        self.folder = folder
+        self.path = os.path.join(folder, MANIFEST_NAME)
+        self.entries = {}
+        # Outputs are recorded from the threads of jobs' callbacks and copies.
+        self.lock = threading.Lock()
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+            if data.get("version") == MANIFEST_VERSION:
+                self.entries = data["files"]
+        except (OSError, ValueError, KeyError):
+            pass
+
+    def complete(self, source, output, command):
+        """
+        Check whether an output was made by the command from the source as it
+        is now, and is still intact. Outputs that aren't are deleted, so that no
+        partial file is left behind if making them again fails.
+        """
+        entry = self.entries.get(self._key(output))
+        if (
+            entry
+            and entry["command"] == command
+            and os.path.isfile(output)
+            and _unchanged(output, entry, "output")
+            and _unchanged(source, entry, "source")
+        ):
+            return True
+        with self.lock:
+            self.entries.pop(self._key(output), None)
+        if os.path.lexists(output):
+            os.remove(output)
+        return False
+
+    def record(self, source, output, command):
+        """
+        Record a finished output and save the manifest. The files are hashed
+        first, so this is called off the event loop, from a job's callback or a
+        copy's thread.
+        """
+        entry = {
+            "source_stat": _stat(source),
+            "source_checksum": file_checksum(source),
+            "command": command,
+            "output_stat": _stat(output),
+            "output_checksum": file_checksum(output),
+        }
+        with self.lock:
+            self.entries[self._key(output)] = entry
+            self.save()
+
+    def recorder(self, source, outputs):
+        """
+        Return an on_done callback for the job making a dict of outputs and their
+        commands from a source, which records them all.
+        """
+
+        def on_done(_=None):
+            for output, command in outputs.items():
+                self.record(source, output, command)
+
+        return on_done
+
+    def save(self):
+        """Write the manifest atomically, so a killed run can't truncate it."""
+        with open(f"{self.path}.new", "w") as f:
+            json.dump({"version": MANIFEST_VERSION, "files": self.entries}, f)
+        os.replace(f"{self.path}.new", self.path)
+
+    def finish(self):
+        """Delete the manifest once the folder is complete."""
+        if os.path.isfile(self.path):
+            os.remove(self.path)
+
+    def _key(self, output):
+        return os.path.relpath(output, self.folder)
+
+
+def file_checksum(filepath):
+    """The MD5 of a file's contents."""
+    digest = hashlib.md5()
+    with open(filepath, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _unchanged(filepath, entry, name):
+    """
+    Check a file against the size, mtime and checksum recorded for it. It is
+    only hashed if its size is the same but its mtime isn't, as when it was
+    touched or copied without being changed; the new mtime is recorded then.
+    """
+    stat = _stat(filepath)
+    recorded = entry.get(f"{name}_stat")
+    if recorded == stat:
+        return True
+    if recorded and recorded[0] != stat[0]:
+        return False
+    if entry[f"{name}_checksum"] != file_checksum(filepath):
+        return False
+    entry[f"{name}_stat"] = stat
+    return True
+
+
+def _stat(filepath):
+    stat = os.stat(filepath)
+    return [stat.st_size, stat.st_mtime_ns]
@@ -1,22 +1,29 @@
 import os
 import re
 import shlex
-import subprocess
-import time
-from shutil import copyfile
+from functools import partial
 
 import click
-import mutagen
+import mutagen.flac
+import mutagen.id3
+import mutagen.mp3
+from mutagen.easyid3 import EasyID3
 
 from salmon import config
+from salmon.common.figles import FileCopier
+from salmon.common.jobs import Job, TeeJob, run_jobs
+from salmon.constants import MANIFEST_NAME
+from salmon.converter.manifest import COPY_COMMAND, open_output_folder
+from salmon.errors import JobFailedError
 
-THREADS = [None] * config.SIMULTANEOUS_CONVERSIONS
-COMMANDS = {
-    "320": "ffmpeg -i {input_} -acodec libmp3lame -ab 320k {output}",
-    "V0": "flac --decode --stdout {input_} | lame -V 0 -q --add-id3v2 "
-    "--tt {tt} --ta {ta} --ty {ty} --tn {tn} --tl {tl} --tc {tc} --tg {tg} "
-    "--tv TPUB={label} "
-    "- {output}",
+# Every FLAC is decoded to PCM with flac and encoded by lame, whether to one
+# bitrate or teed into an encoder per bitrate, and the tags are copied over from
+# the FLAC afterwards. The encoders read WAV, unless options for another input
+# format are given.
+DECODE_COMMAND = "flac --decode --stdout {input_}"
+ENCODE_COMMANDS = {
+    "320": "lame {input_format} -b 320 -q 0 - {output}",
+    "V0": "lame {input_format} -V 0 -q 0 - {output}",
 }
 FLAC_FOLDER_REGEX = re.compile(r"(24 ?bit )?FLAC", flags=re.IGNORECASE)
 LOSSLESS_FOLDER_REGEX = re.compile(r"Lossless", flags=re.IGNORECASE)
@@ -29,13 +36,37 @@ LOSSY_EXTENSION_LIST = {
 
 
 def transcode_folder(path, bitrate):
+    return transcode_folder_multi(path, [bitrate]).get(bitrate)
+
+
+def transcode_folder_multi(path, bitrates):
+    """
+    Transcode a folder to several bitrates, decoding every FLAC once for all of
+    them. Bitrates whose folder exists, but can't be resumed, are skipped.
+    Returns a dict of the bitrates transcoded to and their folders.
+    """
+    manifests = open_transcode_folders(path, bitrates)
+    if manifests:
+        _transcode_files(path, manifests)
+        for manifest in manifests.values():
+            manifest.finish()
+    return {bitrate: manifest.folder for bitrate, manifest in manifests.items()}
+
+
+def open_transcode_folders(path, bitrates):
+    """
+    Check that a folder is lossless and open the output folder of each bitrate,
+    returning a dict of bitrates and the manifests of the folders that can be
+    transcoded into.
+    """
     _validate_folder_is_lossless(path)
-    new_path = _generate_transcode_path_name(path, bitrate)
-    if os.path.isdir(new_path):
-        return click.secho(
-            f"{new_path} already exists, please delete it to re-transcode.", fg="red"
-        )
-    _transcode_files(path, new_path, bitrate)
+    manifests = {}
+    for bitrate in bitrates:
+        new_path = _generate_transcode_path_name(path, bitrate)
+        manifest = open_output_folder(new_path, "transcode")
+        if manifest:
+            manifests[bitrate] = manifest
+    return manifests
 
 
 def _validate_folder_is_lossless(path):
@@ -51,7 +82,8 @@ def _get_files_to_handle(path):
     files_to_handle = []
     for root, _, files in os.walk(path):
         for f in files:
-            files_to_handle.append(os.path.join(root, f))
+            if f != MANIFEST_NAME:
+                files_to_handle.append(os.path.join(root, f))
     return files_to_handle
 
 
@@ -73,66 +105,199 @@ def _generate_transcode_path_name(path, bitrate):
     return os.path.join(os.path.dirname(path), foldername)
 
 
-def _transcode_files(old_path, new_path, bitrate):
-    files = _get_files_to_handle(old_path)
-    files_left = len([f for f in files if f.lower().endswith(".flac")]) - 1
-    files = iter(sorted(files))
-
-    transcoding = True
-    while transcoding:
-        transcoding = False
-        for i, thread in enumerate(THREADS):
-            if thread and thread.poll() is not None:
-                if thread.poll() != 0:
-                    click.secho(
-                        f"Error transcoding a file, error {thread.poll()}:", fg="red"
-                    )
-                    click.secho(thread.communicate()[1].decode("utf-8", "ignore"))
-                    raise click.Abort
-                try:
-                    thread.kill()
-                except:  # noqa: E722
-                    pass
-
-            if not thread or thread.poll() is not None:
-                try:
-                    file_ = next(files)
-                except StopIteration:
-                    break
-
-                output = file_.replace(old_path, new_path)
-                if file_.lower().endswith(".flac"):
-                    output = re.sub(r".flac$", ".mp3", output, flags=re.IGNORECASE)
-                    THREADS[i] = _transcode_single_file(
-                        file_, output, bitrate, files_left
-                    )
-                    files_left -= 1
-                else:
-                    _create_path(output)
-                    copyfile(file_, output)
-                    click.secho(f"Copied {os.path.basename(file_)}")
-            transcoding = True
-        time.sleep(0.1)
-
-
-def _transcode_single_file(file_, output, bitrate, files_left):
-    click.echo(
-        f"Transcoding {os.path.basename(file_)} [{files_left} left to transcode]"
+def _transcode_files(old_path, manifests):
+    copier = FileCopier()
+    todo = plan_transcodes(old_path, manifests, copier)
+    jobs = (
+        transcode_job(*task, files_left, manifests)
+        for files_left, task in zip(range(len(todo) - 1, -1, -1), todo)
     )
+    run_with_copies(jobs, copier, "transcoding")
+
+
+def plan_transcodes(old_path, manifests, copier):
+    """
+    Queue the other files of a folder to be copied into the output folder of
+    every bitrate, and return the FLACs with outputs left to make, as tuples of
+    the FLAC, its outputs by bitrate, the commands recorded for the outputs and
+    the source and sink commands of its job. With a single bitrate there are no
+    sinks, the source does the whole transcode.
+    """
+    todo = []
+    for file_ in sorted(_get_files_to_handle(old_path)):
+        if not file_.lower().endswith(".flac"):
+            for manifest in manifests.values():
+                queue_copy(
+                    copier, manifest, file_, file_.replace(old_path, manifest.folder)
+                )
+            continue
+
+        outputs = {
+            bitrate: _mp3_path(file_.replace(old_path, manifest.folder))
+            for bitrate, manifest in manifests.items()
+        }
+        source = DECODE_COMMAND.format(input_=shlex.quote(file_))
+        sinks = encode_commands(outputs)
+        commands = {
+            output: f"{source} | {sink}"
+            for output, sink in zip(outputs.values(), sinks)
+        }
+        if len(outputs) == 1:
+            source, sinks = commands[next(iter(outputs.values()))], None
+        # Check every output, so that partial ones are all removed.
+        complete = [
+            manifests[bitrate].complete(file_, output, commands[output])
+            for bitrate, output in outputs.items()
+        ]
+        if all(complete):
+            click.secho(f"Skipping {os.path.basename(file_)}, it is already done")
+        else:
+            todo.append((file_, outputs, commands, source, sinks))
+    return todo
+
+
+def queue_copy(copier, manifest, file_, output, link=True):
+    """Copy a file into an output folder in the background, unless it's there."""
+    if manifest.complete(file_, output, COPY_COMMAND):
+        return
     _create_path(output)
-    try:
-        command = COMMANDS[bitrate].format(
-            input_=shlex.quote(file_), output=shlex.quote(output)
-        )
-    except KeyError:
-        command = COMMANDS[bitrate].format(
-            input_=shlex.quote(file_), output=shlex.quote(output), **_get_tags(file_)
+    copier.copy(
+        file_,
+        output,
+        link=link,
+        on_done=manifest.recorder(file_, {output: COPY_COMMAND}),
+    )
+
+
+def _mp3_path(path):
+    return re.sub(r".flac$", ".mp3", path, flags=re.IGNORECASE)
+
+
+def run_with_copies(jobs, copier, action):
+    """
+    Run conversion jobs while a FileCopier copies the files that go along with
+    them in the background, then wait for the copies.
+    """
+    with copier:
+        try:
+            run_jobs(jobs, config.SIMULTANEOUS_CONVERSIONS)
+            copier.wait()
+        except JobFailedError as e:
+            click.secho(f"Error {action} a file, error {e.returncode}:", fg="red")
+            click.secho(e.stderr)
+            raise click.Abort
+        except OSError as e:
+            click.secho(f"Error writing a file: {e}", fg="red")
+            raise click.Abort
+
+
+def transcode_job(file_, outputs, commands, source, sinks, files_left, manifests):
+    """Create the job of a FLAC planned by `plan_transcodes`."""
+    recorders = [
+        manifests[bitrate].recorder(file_, {output: commands[output]})
+        for bitrate, output in outputs.items()
+    ]
+
+    def on_done(out):
+        for output in outputs.values():
+            copy_tags(file_, output)
+        for record in recorders:
+            record(out)
+
+    if sinks is None:
+        return Job(
+            source,
+            name=os.path.basename(file_),
+            shell=True,
+            on_start=partial(
+                click.echo,
+                f"Transcoding {os.path.basename(file_)} "
+                f"[{files_left} left to transcode]",
+            ),
+            on_done=on_done,
         )
-    return subprocess.Popen(
-        command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True
+    return TeeJob(
+        source,
+        sinks,
+        name=os.path.basename(file_),
+        shell=True,
+        on_start=partial(
+            click.echo,
+            f"Transcoding {os.path.basename(file_)} to {', '.join(outputs)} "
+            f"[{files_left} left to transcode]",
+        ),
+        on_done=on_done,
     )
 
 
+def encode_commands(outputs, input_format=""):
+    """
+    Create the commands encoding PCM from stdin to a dict of bitrates and
+    output paths. The outputs are untagged until `copy_tags` is run on them.
+    """
+    commands = []
+    for bitrate, output in outputs.items():
+        _create_path(output)
+        commands.append(
+            ENCODE_COMMANDS[bitrate].format(
+                input_format=input_format, output=shlex.quote(output)
+            )
+        )
+    return commands
+
+
+def copy_tags(source, output):
+    """
+    Copy the tags and pictures of a FLAC onto a FLAC or MP3 encoded from its raw
+    PCM.
+    """
+    if output.lower().endswith(".mp3"):
+        return _copy_id3_tags(source, output)
+    source, output = mutagen.flac.FLAC(source), mutagen.flac.FLAC(output)
+    if source.tags:
+        if output.tags is None:
+            output.add_tags()
+        for key in source.tags.keys():
+            output.tags[key] = source.tags[key]
+    for picture in source.pictures:
+        output.add_picture(picture)
+    output.save()
+
+
+def _copy_id3_tags(source, output):
+    """Copy the Vorbis comments a FLAC has ID3 frames for onto an MP3."""
+    source = mutagen.flac.FLAC(source)
+    tags = source.tags.as_dict() if source.tags else {}
+    for number, total in [("tracknumber", "tracktotal"), ("discnumber", "disctotal")]:
+        if number in tags and total in tags:
+            tags[number] = [f"{tags[number][0]}/{tags[total][0]}"]
+    if "label" in tags:
+        tags.setdefault("organization", tags["label"])
+
+    mp3 = mutagen.mp3.EasyMP3(output)
+    if mp3.tags is None:
+        mp3.add_tags()
+    for key, values in tags.items():
+        if key in EasyID3.valid_keys:
+            mp3[key] = values
+    mp3.save(v2_version=3)
+
+    id3 = mutagen.id3.ID3(output)
+    if "comment" in tags:
+        id3.add(mutagen.id3.COMM(encoding=3, lang="eng", desc="", text=tags["comment"]))
+    for picture in source.pictures:
+        id3.add(
+            mutagen.id3.APIC(
+                encoding=3,
+                mime=picture.mime,
+                type=picture.type,
+                desc=picture.desc,
+                data=picture.data,
+            )
+        )
+    id3.save(v2_version=3)
+
+
 def _create_path(filepath):
     p = os.path.dirname(filepath)
     if not os.path.isdir(p):
@@ -140,27 +305,3 @@ def _create_path(filepath):
             os.makedirs(p)
         except FileExistsError:
             pass
-
-
-def _get_tags(file_):
-    tags = {}
-    tag_assignments = {
-        "tt": ["title"],
-        "ta": ["artist"],
-        "tl": ["album"],
-        "ty": ["date", "year"],
-        "tn": ["tracknumber"],
-        "tc": ["comment"],
-        "tg": ["genre"],
-        "label": ["label"],
-    }
-
-    track = mutagen.File(file_)
-    for key, tag_keys in tag_assignments.items():
-        for tag_key in tag_keys:
-            try:
-                tags[key] = shlex.quote(track.tags[tag_key][0])
-            except (KeyError, IndexError):
-                if key not in tags or tags[key] != "''":
-                    tags[key] = "''"
-    return tags
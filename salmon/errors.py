@@ -52,6 +52,14 @@ class NoncompliantFolderStructure(Exception):
     pass
 
 
+class JobFailedError(Exception):
+    def __init__(self, job, returncode, stderr):
+        self.job = job
+        self.returncode = returncode
+        self.stderr = (stderr or b"").decode("utf-8", "ignore")
+        super().__init__(f"{job.name} exited with code {returncode}")
+
+
 class WebServerIsAlreadyRunning(Exception):
     pass
 
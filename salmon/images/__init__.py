@@ -170,6 +170,19 @@ def upload_spectrals(spectrals, uploader=HOSTS[config.SPECS_UPLOADER], successfu
     return response
 
 
+async def upload_spectral_async(
+    sid, filename, spectral_paths, uploader=HOSTS[config.SPECS_UPLOADER]
+):
+    """
+    Upload the spectrals of a single track, returning its URLs, or None if the
+    upload failed. Failures can be retried later with `upload_spectrals`.
+    """
+    _, urls = await _spectrals_handler(
+        sid, filename, spectral_paths, uploader.ImageUploader().upload_file
+    )
+    return sid, urls
+
+
 def _handle_failed_spectrals(spectrals, successful):
     while True:
         host = click.prompt(
@@ -4,7 +4,6 @@ from itertools import chain
 
 from salmon.search.base import ArtistRlsData, LabelRlsData, IdentData, SearchMixin
 from salmon.sources import DeezerBase
-from ratelimit import limits, sleep_and_retry
 
 
 class Searcher(DeezerBase, SearchMixin):
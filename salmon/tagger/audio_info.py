@@ -3,7 +3,8 @@ import os
 import click
 import mutagen
 
-from salmon.common import compress, get_audio_files
+from salmon.common import get_audio_files, recompress_files
+from salmon.common.analysis import cached
 from salmon.errors import UploadError
 
 
@@ -18,8 +19,12 @@ def gather_audio_info(path):
 
     audio_info = {}
     for filename in files:
-        mut = mutagen.File(os.path.join(path, filename))
-        audio_info[filename] = _parse_audio_info(mut.info)
+        filepath = os.path.join(path, filename)
+        audio_info[filename] = cached(
+            filepath,
+            "streaminfo",
+            lambda: _parse_audio_info(mutagen.File(filepath).info),
+        )
     return audio_info
 
 
@@ -54,6 +59,4 @@ def recompress_path(path):
     files = get_audio_files(path)
     if not files or not all(".flac" in f for f in files):
         return click.secho("No flacs found to recompress. Skipping...", fg="red")
-    for filename in files:
-        filepath = os.path.join(path, filename)
-        compress(filepath)
+    recompress_files([os.path.join(path, f) for f in files], files)
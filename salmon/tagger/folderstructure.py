@@ -3,7 +3,7 @@ import os
 import click
 
 from salmon import config
-from salmon.constants import ALLOWED_EXTENSIONS
+from salmon.constants import ALLOWED_EXTENSIONS, MANIFEST_NAME
 from salmon.errors import NoncompliantFolderStructure
 
 
@@ -97,7 +97,7 @@ def _check_extensions(path):
                 flac.append(fln)
             elif ext == ".m4a":
                 aac.append(fln)
-            elif ext not in ALLOWED_EXTENSIONS:
+            elif ext not in ALLOWED_EXTENSIONS and fln != MANIFEST_NAME:
                 _handle_bad_extension(os.path.join(root, fln))
 
     if len([li for li in [mp3, flac, aac] if li]) > 1:
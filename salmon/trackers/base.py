@@ -1,19 +1,18 @@
 import asyncio
+import atexit
 import html
+import json
 import re
-import sys
 import time
-from ratelimit import limits, sleep_and_retry
+import weakref
 from collections import namedtuple
 from json.decoder import JSONDecodeError
 
+import aiohttp
 import click
-import requests
 from bs4 import BeautifulSoup
 
 
-from requests.exceptions import ConnectTimeout, ReadTimeout
-
 from salmon import config
 from salmon.constants import RELEASE_TYPES
 from salmon.errors import (
@@ -22,6 +21,8 @@ from salmon.errors import (
     RequestError,
     RequestFailedError,
 )
+from salmon.trackers import cache, sitelog
+from salmon.trackers.throttle import bucket
 
 
 loop = asyncio.get_event_loop()
@@ -49,6 +50,23 @@ SearchReleaseData = namedtuple(
     "SearchReleaseData",
     ["lossless", "lossless_web", "year", "artist", "album", "release_type", "url"],
 )
+TrackerResponse = namedtuple("TrackerResponse", ["status", "url", "text"])
+
+CONNECTIONS_PER_HOST = 4
+# API calls should be quick, uploads stream the .torrent and logs so only the
+# time spent connecting and waiting on a read is limited.
+API_TIMEOUT = aiohttp.ClientTimeout(total=30, sock_connect=10)
+UPLOAD_TIMEOUT = aiohttp.ClientTimeout(total=None, sock_connect=10, sock_read=120)
+
+# The trackers' sessions, which are closed when salmon exits.
+_sessions = weakref.WeakSet()
+
+
+@atexit.register
+def _close_sessions():
+    for session in list(_sessions):
+        if not session.closed and not loop.is_closed():
+            loop.run_until_complete(session.close())
 
 
 class BaseGazelleApi:
@@ -66,8 +84,7 @@ class BaseGazelleApi:
         self.dot_torrents_dir = config.DOTTORRENTS_DIR
         self.cookie = config.RED_SESSION
 
-        self.session = requests.Session()
-        self.session.headers.update(self.headers)
+        self.session = None
 
         self.authkey = None
         self.passkey = None
@@ -81,10 +98,43 @@ class BaseGazelleApi:
         "Given a request ID return a request URL"
         return f"{self.base_url}/requests.php?action=view&id={id}"
 
+    async def get_session(self):
+        """
+        Get the tracker's aiohttp session, creating it on first use. It keeps
+        connections to the site alive and limits how many are open at once, and
+        is closed when salmon exits.
+        """
+        if self.session is None or self.session.closed:
+            self.session = aiohttp.ClientSession(
+                headers=self.headers,
+                cookies={"session": self.cookie} if self.cookie else None,
+                connector=aiohttp.TCPConnector(limit_per_host=CONNECTIONS_PER_HOST),
+                timeout=API_TIMEOUT,
+            )
+            _sessions.add(self.session)
+        return self.session
+
+    async def send(self, method, url, **kwargs):
+        """
+        Make a request to the site with the tracker's session, returning its
+        status, final URL and text. Requests wait for a token from the tracker's
+        rate limit bucket before they are sent. Timeouts and every other aiohttp
+        error are raised as RequestErrors, and undecodable text is replaced.
+        """
+        session = await self.get_session()
+        await bucket(self.site_code).acquire()
+        try:
+            async with session.request(method, url, **kwargs) as resp:
+                return TrackerResponse(
+                    resp.status, str(resp.url), await resp.text(errors="replace")
+                )
+        except asyncio.TimeoutError:
+            raise RequestError(f"The request to {url} timed out, try again later.")
+        except aiohttp.ClientError as e:
+            raise RequestError(f"The request to {url} failed: {e}")
+
     def authenticate(self):
         """Make a request to the site API with the saved cookie and get our authkey."""
-        self.session.cookies.clear()
-        self.session.cookies["session"] = self.cookie
         try:
             acctinfo = loop.run_until_complete(self.request("index"))
         except RequestError:
@@ -92,40 +142,32 @@ class BaseGazelleApi:
         self.authkey = acctinfo["authkey"]
         self.passkey = acctinfo["passkey"]
 
-    @sleep_and_retry
-    @limits(10, 10)
     async def request(self, action, **kwargs):
         """
         Make a request to the site API, accomodating the rate limit.
-        This uses the ratelimit library to ensure that
-        the 10 requests / 10 seconds rate limit isn't violated, while allowing
-        short bursts of requests without a 2 second wait after each one
-        (at the expense of a potentially longer wait later).
+        The tracker's token bucket ensures that the 10 requests / 10 seconds
+        rate limit isn't violated, while allowing short bursts of requests
+        without a 1 second wait after each one (at the expense of a potentially
+        longer wait later). Reads of searches and details are cached for a
+        while, see salmon.trackers.cache.
         """
+        key = cache.cache_key(self.site_code, action, kwargs)
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
 
         url = self.base_url + "/ajax.php"
-        params = {"action": action, **kwargs}
+        params = _form_fields({"action": action, **kwargs})
+        resp = await self.send("GET", url, params=params, allow_redirects=False)
         try:
-            resp = await loop.run_in_executor(
-                None,
-                lambda: self.session.get(
-                    url, params=params, timeout=5, allow_redirects=False
-                ),
-            )
-
             # print(url,params,resp)  debug
-            resp = resp.json()
+            resp = json.loads(resp.text)
         except JSONDecodeError:
             raise RateLimitError
-        except (ConnectTimeout, ReadTimeout):
-            click.secho(
-                "Connection to API timed out, try script again later. Gomen!",
-                fg="red",
-            )
-            sys.exit(1)
 
         if resp["status"] != "success":
             raise RequestFailedError(resp["error"])
+        cache.put(key, resp["response"])
         return resp["response"]
 
     async def torrentgroup(self, group_id):
@@ -235,35 +277,60 @@ class BaseGazelleApi:
         """Fetch a page of the log. No search. Search envokes the sphynx
         Doesn't use the API as there is no API endpoint."""
         url = f'{self.base_url}/log.php'
-        resp = await loop.run_in_executor(
-            None,
-            lambda: self.session.get(url, params={'page': page}, headers=self.headers),
-        )
-        return resp
-
-    def get_uploads_from_log(self, max_pages=10):
-        'Crawls some pages of the log and returns uploads'
-        url = f'{self.base_url}/log.php'
-        recent_uploads = []
-        tasks = [self.fetch_log(i) for i in range(1, max_pages)]
-        for page in loop.run_until_complete(asyncio.gather(*tasks)):
-            recent_uploads += self.parse_uploads_from_log_html(page.text)
-        return recent_uploads
+        return await self.send("GET", url, params={'page': page})
+
+    def get_uploads_from_log(self, max_pages=10, max_age=sitelog.LOG_FRESHNESS):
+        """Returns the uploads on the first max_pages - 1 pages of the log, as
+        of the last crawl of them, plus any uploaded since, newest first.
+        The log is only crawled if it wasn't within the last max_age seconds,
+        and then only up to the first page with an upload already seen."""
+        if not sitelog.is_fresh(self.site_code, max_age):
+            loop.run_until_complete(self.crawl_log(max_pages))
+        return sitelog.recent_uploads(self.site_code)
+
+    async def crawl_log(self, max_pages=10):
+        """Crawls the log for uploads newer than the last crawl and saves them.
+        With nothing seen before, the pages are all fetched at once, and how
+        many uploads they hold is saved as the window the dupe checks use."""
+        high_water, _, window_size = sitelog.crawl_state(self.site_code)
+        new_uploads = []
+        if high_water is None or window_size is None:
+            tasks = [self.fetch_log(i) for i in range(1, max_pages)]
+            for page in await asyncio.gather(*tasks):
+                new_uploads += self.parse_uploads_from_log_html(page.text)
+            window_size = len({u[0] for u in new_uploads})
+        else:
+            window_size = None
+            for i in range(1, max_pages):
+                page = await self.fetch_log(i)
+                uploads = self.parse_uploads_from_log_html(page.text)
+                new_uploads += [u for u in uploads if int(u[0]) > high_water]
+                if any(int(u[0]) <= high_water for u in uploads):
+                    break
+            else:
+                # None of the uploads on the pages had been seen, so they all are
+                # new and the window can be measured again.
+                window_size = len({u[0] for u in new_uploads})
+        sitelog.save_uploads(self.site_code, new_uploads, window_size)
 
     async def api_key_upload(self, data, files):
         """Attempt to upload a torrent to the site.
         using the API"""
         url = self.base_url + "/ajax.php?action=upload"
         data["auth"] = self.authkey
-        # Shallow copy. We don't want the future requests to send the api key.
-        api_key_headers = {**self.headers, "Authorization": self.api_key}
-        resp = await loop.run_in_executor(
-            None,
-            lambda: self.session.post(
-                url, data=data, files=files, headers=api_key_headers
-            ),
+        # Only this request should send the api key.
+        api_key_headers = {"Authorization": self.api_key}
+        resp = await self.send(
+            "POST",
+            url,
+            data=_multipart_form(data, files),
+            headers=api_key_headers,
+            timeout=UPLOAD_TIMEOUT,
         )
-        resp = resp.json()
+        try:
+            resp = json.loads(resp.text)
+        except JSONDecodeError:
+            raise RequestError(f"API upload failed, response text: {resp.text}")
         # print(resp) debug
         try:
             if resp["status"] != "success":
@@ -285,18 +352,15 @@ class BaseGazelleApi:
                         )
                 return resp["response"]["torrentid"]
         except TypeError:
-            raise RequestError(f"API upload failed, response text: {resp.text}")
+            raise RequestError(f"API upload failed, response: {resp}")
 
     async def site_page_upload(self, data, files):
         """Attempt to upload a torrent to the site.
         using the upload.php"""
         url = self.base_url + "/upload.php"
         data["auth"] = self.authkey
-        resp = await loop.run_in_executor(
-            None,
-            lambda: self.session.post(
-                url, data=data, files=files, headers=self.headers
-            ),
+        resp = await self.send(
+            "POST", url, data=_multipart_form(data, files), timeout=UPLOAD_TIMEOUT
         )
 
         if self.announce in resp.text:
@@ -304,9 +368,7 @@ class BaseGazelleApi:
                 r'<p style="color: red; text-align: center;">(.+)<\/p>', resp.text,
             )
             if match:
-                raise RequestError(
-                    f"Site upload failed: {match[1]} ({resp.status_code})"
-                )
+                raise RequestError(f"Site upload failed: {match[1]} ({resp.status})")
         if 'requests.php' in resp.url:
             try:
                 torrent_id = self.parse_torrent_id_from_filled_request_page(resp.text)
@@ -328,10 +390,13 @@ class BaseGazelleApi:
     async def upload(self, data, files):
         """Upload a torrent using upload.php
         or the API depending on whether an API key is set."""
-        if hasattr(self, 'api_key'):
-            return await self.api_key_upload(data, files)
-        else:
-            return await self.site_page_upload(data, files)
+        try:
+            if hasattr(self, 'api_key'):
+                return await self.api_key_upload(data, files)
+            else:
+                return await self.site_page_upload(data, files)
+        finally:
+            cache.invalidate(self.site_code)
 
     async def report_lossy_master(self, torrent_id, comment, source):
         """Automagically report a torrent for lossy master/web approval."""
@@ -348,21 +413,18 @@ class BaseGazelleApi:
             "extra": comment,
             "submit": True,
         }
-        r = await loop.run_in_executor(
-            None,
-            lambda: self.session.post(
-                url, params=params, data=data, headers=self.headers
-            ),
-        )
+        r = await self.send("POST", url, params=params, data=_form_fields(data))
         if "torrents.php" in r.url:
             return True
         raise RequestError(
-            f"Failed to report the torrent for lossy master, code {r.status_code}."
+            f"Failed to report the torrent for lossy master, code {r.status}."
         )
 
     async def append_to_torrent_description(self, torrent_id, description_additon):
         """Adds to the start of an individual torrent description
         Currently not supported by the API"""
+        # The description is edited from its current text, so it mustn't be stale.
+        cache.invalidate(self.site_code)
         current_details = await self.request("torrent", id=torrent_id)
         new_data = {
             'action': 'takeedit',
@@ -385,9 +447,8 @@ class BaseGazelleApi:
 
         url = self.base_url + '/torrents.php'
         new_data["auth"] = self.authkey
-        resp = await loop.run_in_executor(
-            None, lambda: self.session.post(url, data=new_data, headers=self.headers),
-        )
+        resp = await self.send("POST", url, data=_form_fields(new_data))
+        cache.invalidate(self.site_code)
         soup = BeautifulSoup(resp.text, "html.parser")
         edit_error = soup.find('h2', text='Error')
         if edit_error:
@@ -435,6 +496,8 @@ class BaseGazelleApi:
         soup = BeautifulSoup(text, "html.parser")
         for entry in soup.find_all("span", class_="log_upload"):
             torrent_id = entry.find("a")['href'][23:]
+            if not torrent_id.isdigit():
+                continue
             try:
                 # it having class log_upload is no guarantee that is what it is. Nice one log.
                 torrent_string = re.findall(
@@ -452,6 +515,32 @@ class BaseGazelleApi:
         return log_uploads
 
 
+def _form_fields(data):
+    """
+    Turn a dict of form fields into a list of string pairs, the way requests
+    encodes them: list values are repeated and None values are left out.
+    """
+    fields = []
+    for key, value in data.items():
+        for v in value if isinstance(value, (list, tuple)) else [value]:
+            if v is not None:
+                fields.append((key, str(v)))
+    return fields
+
+
+def _multipart_form(data, files):
+    """
+    Build a multipart form of fields and (field, (filename, file, content type))
+    files. The files are streamed from their file objects as the form is sent.
+    """
+    form = aiohttp.FormData()
+    for key, value in _form_fields(data):
+        form.add_field(key, value)
+    for field, (filename, file_, content_type) in files:
+        form.add_field(field, file_, filename=filename, content_type=content_type)
+    return form
+
+
 def compile_artists(artists, release_type):
     """Generate a string to represent the artists."""
     if release_type == 7 or len(artists) > 3:
@@ -0,0 +1,56 @@
+"""
+A short lived in-memory cache of tracker API reads. An upload searches and looks
+up the same groups and requests several times, and again for every tracker, so
+responses are kept for a while, keyed on the site, action and parameters.
+Searches go stale quickly and are kept for SEARCH_TTL seconds, details of groups,
+torrents and requests for DETAILS_TTL. A site's entries are dropped whenever we
+upload to it or edit something on it.
+"""
+
+import copy
+import time
+
+SEARCH_TTL = 60
+DETAILS_TTL = 600
+CACHE_TTLS = {
+    "browse": SEARCH_TTL,
+    "requests": SEARCH_TTL,
+    "artist": SEARCH_TTL,
+    "torrentgroup": DETAILS_TTL,
+    "torrent": DETAILS_TTL,
+    "request": DETAILS_TTL,
+}
+
+_cache = {}
+
+
+def cache_key(site, action, params):
+    return (site, action, tuple(sorted((k, str(v)) for k, v in params.items())))
+
+
+def get(key):
+    """
+    Get a copy of a cached response, so callers can't change the cached one, or
+    None if there is none that is still fresh.
+    """
+    entry = _cache.get(key)
+    if not entry:
+        return None
+    expires, response = entry
+    if expires < time.monotonic():
+        del _cache[key]
+        return None
+    return copy.deepcopy(response)
+
+
+def put(key, response):
+    """Cache a response, if its action is one that is cached."""
+    ttl = CACHE_TTLS.get(key[1])
+    if ttl:
+        _cache[key] = (time.monotonic() + ttl, copy.deepcopy(response))
+
+
+def invalidate(site):
+    """Drop every cached response of a site."""
+    for key in [key for key in _cache if key[0] == site]:
+        del _cache[key]
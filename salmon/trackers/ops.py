@@ -2,7 +2,6 @@ from salmon.trackers.base import BaseGazelleApi
 
 from salmon import config
 import click
-import requests
 from requests.exceptions import ConnectTimeout, ReadTimeout
 
 
@@ -24,8 +23,7 @@ class OpsApi(BaseGazelleApi):
 
         self.cookie = config.OPS_SESSION
 
-        self.session = requests.Session()
-        self.session.headers.update(self.headers)
+        self.session = None
 
         self.authkey = None
         self.passkey = None
@@ -1,9 +1,8 @@
 import click
-import requests
 import asyncio
 from requests.exceptions import ConnectTimeout, ReadTimeout
 
-from salmon.trackers.base import BaseGazelleApi
+from salmon.trackers.base import BaseGazelleApi, _form_fields
 from salmon import config
 from salmon.errors import (
     LoginError,
@@ -35,8 +34,7 @@ class RedApi(BaseGazelleApi):
         else:
             self.dot_torrents_dir = config.DOTTORRENTS_DIR
 
-        self.session = requests.Session()
-        self.session.headers.update(self.headers)
+        self.session = None
 
         self.authkey = None
         self.passkey = None
@@ -57,14 +55,9 @@ class RedApi(BaseGazelleApi):
             "extra": comment,
             "submit": True,
         }
-        r = await loop.run_in_executor(
-            None,
-            lambda: self.session.post(
-                url, params=params, data=data, headers=self.headers
-            ),
-        )
+        r = await self.send("POST", url, params=params, data=_form_fields(data))
         if "torrents.php" in r.url:
             return True
         raise RequestError(
-            f"Failed to report the torrent for lossy master, code {r.status_code}."
+            f"Failed to report the torrent for lossy master, code {r.status}."
         )
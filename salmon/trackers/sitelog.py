@@ -0,0 +1,101 @@
+"""
+A local copy of the uploads in the trackers' site logs. The log has no API, so
+its pages are parsed out of the HTML, which is slow, and the dupe checks read it
+more than once per upload. Parsed uploads are kept in the database with the
+highest torrent ID seen on each site, so a crawl can stop at the first page with
+an upload it has already seen, and within LOG_FRESHNESS seconds of a crawl the
+log is read from the database alone.
+
+The dupe checks only look back as far as they did when they parsed the newest
+pages of the log every time: a crawl of the first pages records how many uploads
+they held, and only that many of the newest saved uploads are returned. Uploads
+older than that are kept for LOG_RETENTION seconds after they were first seen, so
+that an incremental crawl can tell where the uploads it has seen begin, and are
+then pruned. The ones in the window are never pruned.
+"""
+
+import sqlite3
+import time
+
+from salmon.database import DB_PATH
+
+LOG_FRESHNESS = 60
+LOG_RETENTION = 7 * 24 * 60 * 60
+# The uploads of a site in the window the dupe checks look back over.
+WINDOW_QUERY = (
+    "SELECT torrent_id, artist, title FROM site_log WHERE site = ? "
+    "ORDER BY torrent_id DESC LIMIT COALESCE("
+    "(SELECT window_size FROM site_log_crawls WHERE site = ?), -1)"
+)
+
+
+def crawl_state(site):
+    """
+    Get the highest torrent ID seen in a site's log, when it was last crawled
+    and how many uploads the dupe checks look back over, or (None, None, None)
+    if it never has been crawled.
+    """
+    with sqlite3.connect(DB_PATH) as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT high_water, crawled, window_size FROM site_log_crawls "
+            "WHERE site = ?",
+            (site,),
+        )
+        row = cursor.fetchone()
+    return tuple(row) if row else (None, None, None)
+
+
+def is_fresh(site, max_age=LOG_FRESHNESS):
+    """Whether a site's log was crawled within the last `max_age` seconds."""
+    _, crawled, _ = crawl_state(site)
+    return crawled is not None and time.time() - crawled < max_age
+
+
+def save_uploads(site, uploads, window_size=None):
+    """
+    Save the (torrent id, artist, title) uploads of a crawl of a site's log,
+    raise its high-water mark to the highest torrent ID among them and mark it
+    as crawled. A crawl of the first pages of the log passes how many uploads
+    they held as the `window_size` the dupe checks look back over. Uploads past
+    LOG_RETENTION are dropped.
+    """
+    now = time.time()
+    rows = [(site, int(id_), artist, title, now) for id_, artist, title in uploads]
+    high_water = max((row[1] for row in rows), default=0)
+    with sqlite3.connect(DB_PATH) as conn:
+        cursor = conn.cursor()
+        cursor.executemany(
+            "INSERT OR IGNORE INTO site_log (site, torrent_id, artist, title, seen) "
+            "VALUES (?, ?, ?, ?, ?)",
+            rows,
+        )
+        cursor.execute(
+            "INSERT INTO site_log_crawls (site, high_water, crawled, window_size) "
+            "VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (site) DO UPDATE SET "
+            "high_water = MAX(high_water, excluded.high_water), "
+            "crawled = excluded.crawled, "
+            "window_size = COALESCE(excluded.window_size, window_size)",
+            (site, high_water, now, window_size),
+        )
+        cursor.execute(
+            "DELETE FROM site_log WHERE site = ? AND seen < ? AND torrent_id < ("
+            f"SELECT MIN(torrent_id) FROM ({WINDOW_QUERY}))",
+            (site, now - LOG_RETENTION, site, site),
+        )
+        conn.commit()
+
+
+def recent_uploads(site):
+    """
+    Get the saved (torrent id, artist, title) uploads of a site the dupe checks
+    look back over, newest first.
+    """
+    with sqlite3.connect(DB_PATH) as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            WINDOW_QUERY,
+            (site, site),
+        )
+        return [(str(id_), artist, title) for id_, artist, title in cursor.fetchall()]
@@ -0,0 +1,104 @@
+"""
+A token bucket rate limiter for the trackers, shared by every salmon process
+through the database. Each tracker has a bucket of RATE_LIMIT tokens, refilled
+evenly over RATE_PERIOD seconds, and every request to the site takes a token as
+it is sent, sleeping on the event loop until one is free. The bucket is updated
+in an immediate transaction, so processes can't take the same token. The
+transaction runs on the loop's executor, so the other requests in flight carry
+on while another process holds the lock. How long requests waited is recorded
+with the bucket.
+"""
+
+import asyncio
+import sqlite3
+import time
+
+from salmon.database import DB_PATH
+
+RATE_LIMIT = 10
+RATE_PERIOD = 10
+# How long to wait for another process to finish with the bucket.
+LOCK_TIMEOUT = 5
+
+_buckets = {}
+
+
+def bucket(key):
+    """Get the token bucket of a tracker."""
+    if key not in _buckets:
+        _buckets[key] = TokenBucket(key)
+    return _buckets[key]
+
+
+class TokenBucket:
+    def __init__(self, key, limit=RATE_LIMIT, period=RATE_PERIOD):
+        self.key = key
+        self.limit = limit
+        self.period = period
+
+    async def acquire(self):
+        """Take a token, waiting until one is free."""
+        loop = asyncio.get_running_loop()
+        start = time.monotonic()
+        wait = await loop.run_in_executor(None, self._take, 0)
+        while wait:
+            await asyncio.sleep(wait)
+            wait = await loop.run_in_executor(
+                None, self._take, time.monotonic() - start
+            )
+
+    def _take(self, waited):
+        """
+        Take a token if there is one, recording the time waited for it. Returns
+        0 if a token was taken, otherwise how long until one is refilled.
+        """
+        now = time.time()
+        conn = sqlite3.connect(DB_PATH, timeout=LOCK_TIMEOUT, isolation_level=None)
+        try:
+            cursor = conn.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            cursor.execute(
+                "SELECT tokens, updated FROM rate_limits WHERE key = ?", (self.key,)
+            )
+            row = cursor.fetchone()
+            tokens = self.limit
+            if row:
+                refilled = max(now - row[1], 0) * self.limit / self.period
+                tokens = min(row[0] + refilled, self.limit)
+            if tokens < 1:
+                cursor.execute(
+                    "INSERT INTO rate_limits (key, tokens, updated) VALUES (?, ?, ?) "
+                    "ON CONFLICT (key) DO UPDATE SET "
+                    "tokens = excluded.tokens, updated = excluded.updated",
+                    (self.key, tokens, now),
+                )
+                cursor.execute("COMMIT")
+                return (1 - tokens) * self.period / self.limit
+            cursor.execute(
+                "INSERT INTO rate_limits "
+                "(key, tokens, updated, requests, waited, max_wait) "
+                "VALUES (?, ?, ?, 1, ?, ?) "
+                "ON CONFLICT (key) DO UPDATE SET "
+                "tokens = excluded.tokens, updated = excluded.updated, "
+                "requests = requests + 1, waited = waited + excluded.waited, "
+                "max_wait = MAX(max_wait, excluded.max_wait)",
+                (self.key, tokens - 1, now, waited, waited),
+            )
+            cursor.execute("COMMIT")
+        finally:
+            conn.close()
+        return 0
+
+
+def wait_stats():
+    """
+    Get the number of requests, and the total and longest time they waited, of
+    every tracker's bucket across all processes.
+    """
+    with sqlite3.connect(DB_PATH) as conn:
+        conn.row_factory = sqlite3.Row
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT key, requests, waited, max_wait FROM rate_limits ORDER BY key"
+        )
+        return [dict(row) for row in cursor.fetchall()]
@@ -38,6 +38,7 @@ from salmon.uploader.dupe_checker import (
     print_recent_upload_results,
 )
 from salmon.images import upload_cover
+from salmon.uploader.formats import upload_missing_formats
 from salmon.uploader.request_checker import check_requests
 from salmon.uploader.preassumptions import print_preassumptions
 from salmon.uploader.spectrals import (
@@ -47,6 +48,7 @@ from salmon.uploader.spectrals import (
     report_lossy_master,
     generate_lossy_approval_comment,
 )
+from salmon.uploader.torrents import start_hashing
 from salmon.uploader.upload import (
     concat_track_data,
     prepare_and_upload,
@@ -114,6 +116,13 @@ loop = asyncio.get_event_loop()
     is_flag=True,
     help='Assess / upload / report spectrals after torrent upload',
 )
+@click.option(
+    "--missing-formats",
+    "-mf",
+    is_flag=True,
+    help="Make and upload the 16bit FLAC, V0 and 320 torrents the edition lacks "
+    "after uploading",
+)
 def up(
     path,
     group_id,
@@ -126,6 +135,7 @@ def up(
     tracker,
     request,
     spectrals_after,
+    missing_formats,
 ):
     """Command to upload an album folder to a Gazelle Site."""
     gazelle_site = salmon.trackers.get_class(tracker)()
@@ -154,6 +164,7 @@ def up(
         recompress=compress,
         request_id=request,
         spectrals_after=spectrals_after,
+        missing_formats=missing_formats,
     )
 
 
@@ -172,6 +183,7 @@ def upload(
     searchstrs=None,
     request_id=None,
     spectrals_after=False,
+    missing_formats=False,
 ):
     """Upload an album folder to Gazelle Site
     Offer the choice to upload to another tracker after completion."""
@@ -230,60 +242,25 @@ def upload(
         shutil.rmtree(path)
         return click.secho("\nDeleted folder, aborting upload...", fg="red")
 
-    lossy_comment = None
-    if spectrals_after:
-        spectral_urls = None
-    else:
-        if lossy_master:
-            lossy_comment = generate_lossy_approval_comment(
-                source_url, list(track_data.keys())
-            )
-            click.echo()
-
-        spectrals_path = os.path.join(path, "Spectrals")
-        spectral_urls = handle_spectrals_upload_and_deletion(
-            spectrals_path, spectral_ids
+    lossy_comment, spectral_urls = None, None
+    if not spectrals_after:
+        lossy_comment, spectral_urls = _upload_spectrals(
+            path, lossy_master, spectral_ids, source_url, track_data
         )
     if config.LAST_MINUTE_DUPE_CHECK:
         last_min_dupe_check(gazelle_site, searchstrs)
 
-    if not group_id:
-        # This prevents the cover being uploaded more than once for multiple sites.
-        cover_url = upload_cover(path)
-    else:
-        cover_url = None
+    # This prevents the cover being uploaded more than once for multiple sites.
+    cover_url = upload_cover(path) if not group_id else None
 
     # Shallow copy to avoid errors on multiple uploads in one session.
     remaining_gazelle_sites = list(salmon.trackers.tracker_list)
-    tracker = gazelle_site.site_code
-    torrent_id = None
+    # The uploads to fill out the missing formats of once every tracker is done.
+    uploads = []
     while True:
         # Loop until we don't want to upload to any more sites.
-        if not tracker:
-            if spectrals_after and torrent_id:
-                # Here we are checking the spectrals after uploading to the first site
-                # if they were not done before.
-                lossy_master, lossy_comment, spectral_urls = post_upload_spectral_check(
-                    gazelle_site, path, torrent_id, None, track_data, source, source_url
-                )
-                spectrals_after = False
-            click.secho(
-                "Would you like to upload to another tracker? ", fg="magenta", nl=False
-            )
-            tracker = salmon.trackers.choose_tracker(remaining_gazelle_sites)
-            gazelle_site = salmon.trackers.get_class(tracker)()
-
-            click.secho(f"Uploading to {gazelle_site.base_url}", fg="cyan")
-            searchstrs = generate_dupe_check_searchstrs(
-                rls_data["artists"], rls_data["title"], rls_data["catno"]
-            )
-            group_id = check_existing_group(gazelle_site, searchstrs, metadata)
-
-        remaining_gazelle_sites.remove(tracker)
-        if not request_id and config.CHECK_REQUESTS:
-            request_id = check_requests(gazelle_site, searchstrs)
-
-        torrent_id = prepare_and_upload(
+        remaining_gazelle_sites.remove(gazelle_site.site_code)
+        torrent_id = _upload_to_site(
             gazelle_site,
             path,
             group_id,
@@ -295,30 +272,136 @@ def upload(
             spectral_urls,
             lossy_comment,
             request_id,
+            searchstrs,
+            source,
+            source_url,
         )
-        if lossy_master:
-            report_lossy_master(
-                gazelle_site,
-                torrent_id,
-                spectral_urls,
-                track_data,
-                source,
-                lossy_comment,
-                source_url=source_url,
+        uploads.append((gazelle_site, torrent_id))
+        request_id = None
+        if not remaining_gazelle_sites or not config.MULTI_TRACKER_UPLOAD:
+            break
+
+        if spectrals_after and torrent_id:
+            # Here we are checking the spectrals after uploading to the first site
+            # if they were not done before.
+            lossy_master, lossy_comment, spectral_urls = post_upload_spectral_check(
+                gazelle_site, path, torrent_id, None, track_data, source, source_url
             )
+            spectrals_after = False
+        chosen = _choose_another_site(remaining_gazelle_sites, rls_data, metadata)
+        if not chosen:
+            # Not uploading anywhere else still leaves the missing formats.
+            break
+        gazelle_site, searchstrs, group_id = chosen
 
-        url = "{}/torrents.php?torrentid={}".format(gazelle_site.base_url, torrent_id)
-        click.secho(
-            f"\nSuccessfully uploaded {url} ({os.path.basename(path)}).",
-            fg="green",
-            bold=True,
+    if missing_formats:
+        upload_missing_formats(
+            uploads,
+            path,
+            metadata,
+            lossy_master,
+            spectral_urls,
+            lossy_comment,
+            source,
+            source_url=source_url,
         )
-        if config.COPY_UPLOADED_URL_TO_CLIPBOARD:
-            pyperclip.copy(url)
-        tracker = None
-        request_id = None
-        if not remaining_gazelle_sites or not config.MULTI_TRACKER_UPLOAD:
-            return click.secho("\nDone uploading this release.", fg="green")
+    click.secho("\nDone uploading this release.", fg="green")
+
+
+def _choose_another_site(remaining_gazelle_sites, rls_data, metadata):
+    """
+    Ask which tracker to upload to next and check it for an existing group.
+    Returns the site, its dupe check search strings and the group ID, or None if
+    the user is done uploading.
+    """
+    click.secho("Would you like to upload to another tracker? ", fg="magenta", nl=False)
+    try:
+        tracker = salmon.trackers.choose_tracker(remaining_gazelle_sites)
+    except click.Abort:
+        return None
+    gazelle_site = salmon.trackers.get_class(tracker)()
+
+    click.secho(f"Uploading to {gazelle_site.base_url}", fg="cyan")
+    searchstrs = generate_dupe_check_searchstrs(
+        rls_data["artists"], rls_data["title"], rls_data["catno"]
+    )
+    group_id = check_existing_group(gazelle_site, searchstrs, metadata)
+    return gazelle_site, searchstrs, group_id
+
+
+def _upload_spectrals(path, lossy_master, spectral_ids, source_url, track_data):
+    """
+    Upload the chosen spectrals and delete the rest, after asking for the lossy
+    master comment if there is one. Returns the comment and the spectrals' URLs.
+    """
+    lossy_comment = None
+    if lossy_master:
+        lossy_comment = generate_lossy_approval_comment(
+            source_url, list(track_data.keys())
+        )
+        click.echo()
+
+    spectrals_path = os.path.join(path, "Spectrals")
+    spectral_urls = handle_spectrals_upload_and_deletion(spectrals_path, spectral_ids)
+    return lossy_comment, spectral_urls
+
+
+def _upload_to_site(
+    gazelle_site,
+    path,
+    group_id,
+    metadata,
+    cover_url,
+    track_data,
+    hybrid,
+    lossy_master,
+    spectral_urls,
+    lossy_comment,
+    request_id,
+    searchstrs,
+    source,
+    source_url,
+):
+    """
+    Upload the release to one tracker, filling a request if there is one, and
+    report it if it's lossy mastered. Returns the ID of the uploaded torrent.
+    """
+    if not request_id and config.CHECK_REQUESTS:
+        request_id = check_requests(gazelle_site, searchstrs)
+
+    torrent_id = prepare_and_upload(
+        gazelle_site,
+        path,
+        group_id,
+        metadata,
+        cover_url,
+        track_data,
+        hybrid,
+        lossy_master,
+        spectral_urls,
+        lossy_comment,
+        request_id,
+    )
+    if lossy_master:
+        report_lossy_master(
+            gazelle_site,
+            torrent_id,
+            spectral_urls,
+            track_data,
+            source,
+            lossy_comment,
+            source_url=source_url,
+        )
+
+    url = "{}/torrents.php?torrentid={}".format(gazelle_site.base_url, torrent_id)
+    click.secho(
+        f"\nSuccessfully uploaded {url} ({os.path.basename(path)}).",
+        fg="green",
+        bold=True,
+    )
+    if config.COPY_UPLOADED_URL_TO_CLIPBOARD:
+        pyperclip.copy(url)
+    return torrent_id
 
 
 def edit_metadata(path, tags, metadata, source, rls_data, recompress):
@@ -353,6 +436,9 @@ def edit_metadata(path, tags, metadata, source, rls_data, recompress):
         # Refresh tags to accomodate differences in file structure.
         tags = gather_tags(path)
 
+    # The folder is final, so have the torrent hashed while the upload goes on.
+    # The spectrals are deleted before the torrent is made.
+    start_hashing(path, skip=["Spectrals"])
     tags = gather_tags(path)
     audio_info = gather_audio_info(path)
     return path, metadata, tags, audio_info
@@ -385,7 +471,8 @@ def last_min_dupe_check(gazelle_site, searchstrs):
 
     # Should really avoid asking if already shown the same releases from the log.
     click.secho(f"Last Minuite Dupe Check on {gazelle_site.site_code}", fg="cyan")
-    recent_uploads = dupe_check_recent_torrents(gazelle_site, searchstrs)
+    # Always crawl for anything uploaded since the last check.
+    recent_uploads = dupe_check_recent_torrents(gazelle_site, searchstrs, max_age=0)
     if recent_uploads:
         print_recent_upload_results(
             gazelle_site, recent_uploads, " / ".join(searchstrs)
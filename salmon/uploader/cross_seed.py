@@ -0,0 +1,94 @@
+"""
+Bulk cross-seeding. The torrents saved by uploads to every tracker are indexed
+by the name of their folder, and each release folder given gets a torrent for
+the chosen tracker made from an existing one of another tracker, checked against
+a sample of its pieces rather than hashed again.
+"""
+
+import os
+
+import click
+
+from salmon.converter.batch import expand_folders
+from salmon.uploader.torrents import (
+    cross_seed_info,
+    dot_torrents_dirs,
+    encode_torrent,
+    hash_pieces,
+    read_info,
+)
+
+
+def cross_seed_folders(patterns, gazelle_site, rehash=False):
+    """
+    Make torrents of release folders (or globs of them) for a tracker from the
+    existing torrents of other trackers, saving them to its torrents folder.
+    Folders no torrent matches are hashed if `rehash` is set, else skipped.
+    """
+    folders = expand_folders(patterns)
+    if not folders:
+        click.secho("No folders matched.", fg="red")
+        raise click.Abort
+    source = gazelle_site.site_string
+    index = index_torrents(source)
+
+    made, skipped = 0, 0
+    for folder in folders:
+        name = os.path.basename(folder)
+        torrent_path = os.path.join(
+            gazelle_site.dot_torrents_dir, f"{name} - {source}.torrent"
+        )
+        if os.path.exists(torrent_path):
+            click.secho(f"{name}: the {source} torrent exists already", fg="yellow")
+            skipped += 1
+            continue
+        info = next(
+            filter(None, (cross_seed_info(folder, t) for t in index.get(name, []))),
+            None,
+        )
+        if info:
+            click.secho(f"{name}: reusing an existing torrent", fg="green")
+        elif rehash:
+            click.secho(f"{name}: no existing torrent matches, hashing it", fg="cyan")
+            try:
+                info = hash_pieces(folder)
+            except (OSError, ValueError) as e:
+                click.secho(f"{name}: {e}", fg="red")
+        else:
+            click.secho(f"{name}: no existing torrent matches", fg="red")
+        if not info:
+            skipped += 1
+            continue
+        with open(torrent_path, "wb") as f:
+            f.write(encode_torrent(info, gazelle_site.announce, source))
+        made += 1
+
+    click.secho(
+        f"\nMade {made} {source} torrents, skipped {skipped} folders.",
+        fg="green" if not skipped else "yellow",
+        bold=True,
+    )
+
+
+def index_torrents(source):
+    """
+    Index the .torrent files in every tracker's torrents folder by the name of
+    their folder, leaving out the ones for the `source` tracker.
+    """
+    index = {}
+    for folder in set(filter(None, dot_torrents_dirs().values())):
+        if not os.path.isdir(folder):
+            continue
+        for filename in sorted(os.listdir(folder)):
+            if not filename.endswith(".torrent"):
+                continue
+            torrent_path = os.path.join(folder, filename)
+            info = read_info(torrent_path)
+            if not info or info.get("source", b"") == source.encode():
+                continue
+            try:
+                name = info["name"].decode()
+            except (KeyError, AttributeError, UnicodeDecodeError):
+                continue
+            index.setdefault(name, []).append(torrent_path)
+    return index
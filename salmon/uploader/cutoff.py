@@ -0,0 +1,129 @@
+"""
+A pre-screen for lossy masters. The long-term spectrum of a track is taken from
+its Full spectrogram, and the steepest drop in it above MIN_CUTOFF is found.
+Lossy encoders lowpass (or shelve) everything above a fixed frequency, which
+shows up as a cliff well below the Nyquist frequency, where lossless masters
+usually roll off gently or not at all. Every track gets a suspicion score from
+0 to 100 based on how steep its cliff is and how far below the CD bandwidth it
+sits, so the most suspicious spectrals can be pre-selected for review.
+"""
+
+import numpy as np
+
+from salmon.common.analysis import cached, save
+from salmon.uploader.spectrogram import (
+    FULL_HEIGHT,
+    FULL_WIDTH,
+    compute_spectrogram,
+    decode_first_channel,
+    render_spectrals,
+)
+
+# Drops are measured between the mean levels of the bands either side of a bin.
+EDGE_WIDTH = 500
+MIN_CUTOFF = 4000
+# A drop of this many dB counts as a cliff rather than a roll-off.
+STEEP_DROP = 20
+# Content louder than this (dBFS per bin) is above the noise floor, so is kept by
+# a shelf, where a lowpass would cut it.
+SHELF_LEVEL = -105
+SPECTRUM_FLOOR = -140
+# Lossy encoders rarely keep anything above this, whatever the sample rate.
+CD_BANDWIDTH = 22050
+LOSSY_SCORE = 50
+SUSPICIOUS_SCORE = 25
+PRESELECT = 3
+
+
+def estimate_cutoff(levels, sample_rate):
+    """
+    Estimate the cutoff of a track from the dBFS levels of its spectrogram, as
+    returned by `compute_spectrogram`. Returns a dict of the cutoff frequency in
+    Hz, the drop across it in dB, its shape (lowpass, shelf or rolloff), the
+    suspicion score and whether the track is flagged as lossy.
+    """
+    with np.errstate(over="ignore"):
+        power = np.mean(10 ** (levels[::-1] / 10), axis=1)
+    with np.errstate(divide="ignore"):
+        spectrum = np.maximum(10 * np.log10(power), SPECTRUM_FLOOR)
+    nyquist = sample_rate / 2
+    freqs = np.linspace(0, nyquist, len(spectrum))
+    width = max(int(round(EDGE_WIDTH / freqs[1])), 1)
+
+    sums = np.concatenate(([0], np.cumsum(spectrum)))
+    edges = np.arange(width, len(spectrum) - width)
+    below = (sums[edges] - sums[edges - width]) / width
+    above = (sums[edges + width] - sums[edges]) / width
+    drops = np.where(freqs[edges] >= MIN_CUTOFF, below - above, 0)
+
+    if len(drops) and drops.max() >= STEEP_DROP:
+        edge = int(np.argmax(drops))
+        drop = float(drops[edge])
+        cutoff = freqs[edges[edge]]
+        upper = spectrum[edges[edge] :].mean()
+        shape = "shelf" if upper > SHELF_LEVEL else "lowpass"
+    else:
+        drop = float(drops.max()) if len(drops) else 0.0
+        audible = np.flatnonzero(spectrum > SHELF_LEVEL)
+        cutoff = freqs[audible[-1]] if len(audible) else 0.0
+        shape = "rolloff"
+
+    steepness = np.clip((drop - 10) / 30, 0, 1)
+    band = min(nyquist, CD_BANDWIDTH) * 0.98
+    gap = np.clip((band - cutoff) / 4000, 0, 1)
+    score = int(round(100 * steepness * gap))
+    return {
+        "cutoff": int(round(cutoff)),
+        "drop": round(drop, 1),
+        "shape": shape,
+        "score": score,
+        "lossy": score >= LOSSY_SCORE,
+    }
+
+
+def analyse_track(filepath, sample_rate):
+    """Decode a track and estimate its cutoff, going through the analysis cache."""
+    return cached(
+        filepath,
+        "spectral_cutoff",
+        lambda: estimate_cutoff(
+            compute_spectrogram(
+                decode_first_channel(filepath), sample_rate, FULL_WIDTH, FULL_HEIGHT
+            ),
+            sample_rate,
+        ),
+    )
+
+
+def render_and_analyse(filepath, sample_rate, full_path, zoom_path, zoom_startpoint):
+    """
+    Render a track's spectrals and estimate its cutoff from the same decoded
+    audio and Full spectrogram.
+    """
+    levels = render_spectrals(
+        filepath, sample_rate, full_path, zoom_path, zoom_startpoint
+    )
+    analysis = estimate_cutoff(levels, sample_rate)
+    save(filepath, "spectral_cutoff", analysis)
+    return analysis
+
+
+def most_suspicious(analyses, limit=PRESELECT):
+    """
+    Return the IDs of up to `limit` of the most suspicious tracks of a dict of
+    IDs and analyses, in ID order.
+    """
+    ranked = sorted(
+        (sid for sid, a in analyses.items() if a and a["score"] >= SUSPICIOUS_SCORE),
+        key=lambda sid: -analyses[sid]["score"],
+    )
+    return sorted(ranked[:limit])
+
+
+def format_analysis(analysis):
+    if analysis["shape"] == "rolloff":
+        return f"rolls off at {analysis['cutoff'] / 1000:.1f} kHz"
+    return (
+        f"{analysis['shape']} at {analysis['cutoff'] / 1000:.1f} kHz "
+        f"({analysis['drop']:.0f} dB)"
+    )
@@ -10,16 +10,18 @@ from salmon.common import RE_FEAT, make_searchstrs
 from salmon.errors import AbortAndDeleteFolder
 from salmon.errors import RequestError
 from salmon import config
+from salmon.trackers.sitelog import LOG_FRESHNESS
 
 loop = asyncio.get_event_loop()
 
 
-def dupe_check_recent_torrents(gazelle_site, searchstrs):
+def dupe_check_recent_torrents(gazelle_site, searchstrs, max_age=LOG_FRESHNESS):
     """Checks the site log for recent uploads similar to ours.
-    It may be a little slow as it has to fetch multiple pages of the log
-    It also has to do a string distance comparison for each result"""
+    The log is kept in the database, and only crawled for new uploads if it
+    wasn't in the last max_age seconds.
+    It has to do a string distance comparison for each result"""
     searchstr = searchstrs[0]
-    recent_uploads = gazelle_site.get_uploads_from_log()
+    recent_uploads = gazelle_site.get_uploads_from_log(max_age=max_age)
     # Each upload in this list is best guess at (id,artist,title) from log
     hits = []
     seen = []
@@ -0,0 +1,222 @@
+"""
+Fill out the formats of an edition after a FLAC upload. Once the FLAC is up on
+every tracker, the torrent group on each of them is checked for the 16bit FLAC,
+V0 and 320 torrents of the uploaded edition. The formats missing on any of them
+are made from the upload in one pass of the converters, and each is uploaded to
+the groups that lack it with the reviewed metadata and spectrals of the FLAC.
+"""
+
+import asyncio
+import os
+
+import click
+
+from salmon.converter.downconverting import (
+    convert_and_transcode_folder,
+    convert_folder,
+)
+from salmon.converter.transcoding import transcode_folder_multi
+from salmon.errors import RequestError
+from salmon.tagger.audio_info import gather_audio_info
+from salmon.tagger.tags import gather_tags
+from salmon.uploader.spectrals import report_lossy_master
+from salmon.uploader.upload import concat_track_data, prepare_and_upload
+
+loop = asyncio.get_event_loop()
+
+# The format, encoding and whether the encoding is VBR of the torrents the
+# formats are uploaded as.
+MISSING_FORMATS = {
+    "16bit": ("FLAC", "Lossless", False),
+    "V0": ("MP3", "V0 (VBR)", True),
+    "320": ("MP3", "320", False),
+}
+EDITION_KEYS = [
+    "media",
+    "remasterYear",
+    "remasterTitle",
+    "remasterRecordLabel",
+    "remasterCatalogueNumber",
+]
+
+
+def upload_missing_formats(
+    uploads,
+    path,
+    metadata,
+    lossy_master,
+    spectral_urls,
+    lossy_comment,
+    source,
+    source_url=None,
+):
+    """
+    Make and upload the formats the edition of an uploaded FLAC lacks on the
+    trackers it was uploaded to. `uploads` is a list of (gazelle_site, torrent
+    id) of the FLAC's uploads. The formats are made once for all of them.
+    """
+    if metadata["format"] != "FLAC" or not uploads:
+        return
+    click.secho("\nChecking for missing formats...", fg="cyan", bold=True)
+    wanted = []
+    for gazelle_site, torrent_id in uploads:
+        group_id, missing = _check_missing_formats(gazelle_site, torrent_id, metadata)
+        if missing:
+            wanted.append((gazelle_site, group_id, missing))
+    if not wanted:
+        return
+
+    try:
+        folders = make_formats(
+            path,
+            [n for n in MISSING_FORMATS if any(n in m for _, _, m in wanted)],
+        )
+    except click.Abort:
+        return click.secho("Making the missing formats failed.", fg="red")
+
+    for gazelle_site, group_id, missing in wanted:
+        for name in missing:
+            if name not in folders:
+                continue
+            upload_format(
+                gazelle_site,
+                folders[name],
+                group_id,
+                name,
+                metadata,
+                lossy_master,
+                spectral_urls,
+                lossy_comment,
+                source,
+                source_url,
+            )
+
+
+def _check_missing_formats(gazelle_site, torrent_id, metadata):
+    """
+    Find the formats the edition of an uploaded torrent lacks, and ask whether
+    to upload them. Returns the torrent's group ID and the formats to upload.
+    """
+    site = gazelle_site.site_string
+    try:
+        torrent = loop.run_until_complete(
+            gazelle_site.request("torrent", id=torrent_id)
+        )
+        group_id = torrent["group"]["id"]
+        group = loop.run_until_complete(gazelle_site.torrentgroup(group_id))
+    except RequestError as e:
+        click.secho(f"Could not get the torrent group on {site}: {e}", fg="red")
+        return None, []
+
+    missing = find_missing_formats(
+        group["torrents"], torrent["torrent"], metadata["encoding"]
+    )
+    if not missing:
+        click.secho(f"No formats are missing from the edition on {site}.", fg="green")
+        return group_id, []
+    if not click.confirm(
+        click.style(
+            f"The edition on {site} is missing {', '.join(missing)}. Would you like "
+            "to make and upload them?",
+            fg="magenta",
+            bold=True,
+        ),
+        default=True,
+    ):
+        return group_id, []
+    return group_id, missing
+
+
+def upload_format(
+    gazelle_site,
+    folder,
+    group_id,
+    name,
+    metadata,
+    lossy_master,
+    spectral_urls,
+    lossy_comment,
+    source,
+    source_url=None,
+):
+    """Upload a format made of a FLAC upload to its torrent group."""
+    click.secho(
+        f"\nUploading {name} ({os.path.basename(folder)}) to "
+        f"{gazelle_site.site_string}",
+        fg="cyan",
+    )
+    format_, encoding, vbr = MISSING_FORMATS[name]
+    format_metadata = {
+        **metadata,
+        "format": format_,
+        "encoding": encoding,
+        "encoding_vbr": vbr,
+    }
+    track_data = concat_track_data(gather_tags(folder), gather_audio_info(folder))
+    torrent_id = prepare_and_upload(
+        gazelle_site,
+        folder,
+        group_id,
+        format_metadata,
+        None,
+        track_data,
+        False,
+        lossy_master,
+        spectral_urls,
+        lossy_comment,
+        None,
+    )
+    if lossy_master:
+        report_lossy_master(
+            gazelle_site,
+            torrent_id,
+            spectral_urls,
+            track_data,
+            source,
+            lossy_comment,
+            source_url=source_url,
+        )
+    click.secho(
+        f"Successfully uploaded {gazelle_site.base_url}/torrents.php?torrentid="
+        f"{torrent_id} ({os.path.basename(folder)}).",
+        fg="green",
+    )
+
+
+def find_missing_formats(torrents, uploaded, encoding):
+    """
+    Find which of the formats the uploaded torrent's edition lacks in a group's
+    torrents. A 16bit FLAC can only be made from a 24bit one.
+    """
+    edition = [uploaded[k] for k in EDITION_KEYS]
+    existing = {
+        (t["format"], t["encoding"])
+        for t in torrents
+        if [t[k] for k in EDITION_KEYS] == edition
+    }
+    return [
+        name
+        for name, (format_, encoding_, _) in MISSING_FORMATS.items()
+        if (format_, encoding_) not in existing
+        and (name != "16bit" or encoding == "24bit Lossless")
+    ]
+
+
+def make_formats(path, missing):
+    """
+    Make the missing formats from a FLAC folder in one pass, downconverting and
+    transcoding at once when the 16bit FLAC is missing. Returns a dict of the
+    formats made and their folders; folders that existed already but couldn't
+    be resumed are left out.
+    """
+    bitrates = [name for name in missing if name != "16bit"]
+    if "16bit" not in missing:
+        return transcode_folder_multi(path, bitrates)
+    if not bitrates:
+        folder = convert_folder(path)
+        return {"16bit": folder} if folder else {}
+    result = convert_and_transcode_folder(path, bitrates)
+    if not result:
+        return {}
+    folder, mp3_folders = result
+    return {"16bit": folder, **mp3_folders}
@@ -0,0 +1,159 @@
+"""
+A persistent cache of rendered spectrals, their cutoff analysis and the URLs they
+were uploaded to.
+Entries are keyed on the audio checksum of the track plus every parameter that
+affects the images, so a retagged or renamed track still hits the cache. Their
+URLs are only reused if they're on the image host that is configured now. The
+cache is bounded by SPECTRALS_CACHE_SIZE (in MB) with least recently used
+eviction.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import time
+
+from salmon import config
+from salmon.common import audio_checksum
+from salmon.database import DB_PATH
+
+DEFAULT_CACHE_DIR = os.path.abspath(
+    os.path.join(os.path.dirname(os.path.dirname(__file__)), "..", "spectrals_cache")
+)
+# Bump when the rendered images change for the same parameters.
+CACHE_VERSION = 3
+
+
+def cache_dir():
+    return config.SPECTRALS_CACHE_DIR or DEFAULT_CACHE_DIR
+
+
+def cache_key(filepath, sample_rate, zoom_startpoint):
+    """Generate the cache key of a track's spectrals."""
+    params = "|".join(
+        str(p)
+        for p in (
+            CACHE_VERSION,
+            audio_checksum(filepath),
+            sample_rate,
+            config.SPECTRALS_RENDERER,
+            zoom_startpoint,
+            config.COMPRESS_SPECTRALS,
+        )
+    )
+    return hashlib.sha256(params.encode()).hexdigest()
+
+
+def _cached_paths(key):
+    folder = os.path.join(cache_dir(), key[:2])
+    return (
+        os.path.join(folder, f"{key} Full.png"),
+        os.path.join(folder, f"{key} Zoom.png"),
+    )
+
+
+def fetch(key, full_path, zoom_path):
+    """
+    Place the cached spectrals for a key at full_path and zoom_path. Returns
+    whether there was a hit, the URLs they were uploaded to, if any, and the
+    cutoff analysis of the track, if it was analysed.
+    """
+    if not config.SPECTRALS_CACHE_SIZE:
+        return False, None, None
+    with sqlite3.connect(DB_PATH) as conn:
+        conn.row_factory = sqlite3.Row
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT full_url, zoom_url, uploader, analysis FROM spectrals_cache "
+            "WHERE key = ?",
+            (key,),
+        )
+        row = cursor.fetchone()
+        if not row:
+            return False, None, None
+        try:
+            for cached, dest in zip(_cached_paths(key), (full_path, zoom_path)):
+                _link_or_copy(cached, dest)
+        except OSError:
+            cursor.execute("DELETE FROM spectrals_cache WHERE key = ?", (key,))
+            conn.commit()
+            return False, None, None
+        cursor.execute(
+            "UPDATE spectrals_cache SET last_used = ? WHERE key = ?",
+            (time.time(), key),
+        )
+        conn.commit()
+    analysis = json.loads(row["analysis"] or "null")
+    if row["full_url"] and row["zoom_url"] and row["uploader"] == config.SPECS_UPLOADER:
+        return True, [row["full_url"], row["zoom_url"]], analysis
+    return True, None, analysis
+
+
+def store(key, full_path, zoom_path, analysis=None):
+    """Add a track's freshly rendered spectrals and its analysis to the cache."""
+    if not config.SPECTRALS_CACHE_SIZE:
+        return
+    cached_paths = _cached_paths(key)
+    os.makedirs(os.path.dirname(cached_paths[0]), exist_ok=True)
+    for src, cached in zip((full_path, zoom_path), cached_paths):
+        _link_or_copy(src, cached)
+    size = sum(os.path.getsize(p) for p in cached_paths)
+    with sqlite3.connect(DB_PATH) as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "INSERT OR REPLACE INTO spectrals_cache (key, size, last_used, analysis) "
+            "VALUES (?, ?, ?, ?)",
+            (key, size, time.time(), json.dumps(analysis) if analysis else None),
+        )
+        conn.commit()
+    _evict()
+
+
+def store_urls(key, urls):
+    """Remember the URLs a track's spectrals were uploaded to, and the host."""
+    if not config.SPECTRALS_CACHE_SIZE:
+        return
+    with sqlite3.connect(DB_PATH) as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "UPDATE spectrals_cache SET full_url = ?, zoom_url = ?, uploader = ? "
+            "WHERE key = ?",
+            (*urls, config.SPECS_UPLOADER, key),
+        )
+        conn.commit()
+
+
+def _evict():
+    """Delete the least recently used entries until the cache fits its size."""
+    limit = config.SPECTRALS_CACHE_SIZE * 1024 * 1024
+    with sqlite3.connect(DB_PATH) as conn:
+        conn.row_factory = sqlite3.Row
+        cursor = conn.cursor()
+        cursor.execute("SELECT COALESCE(SUM(size), 0) FROM spectrals_cache")
+        total = cursor.fetchone()[0]
+        if total <= limit:
+            return
+        cursor.execute("SELECT key, size FROM spectrals_cache ORDER BY last_used ASC")
+        evicted = []
+        for row in cursor.fetchall():
+            if total <= limit:
+                break
+            for cached in _cached_paths(row["key"]):
+                if os.path.isfile(cached):
+                    os.remove(cached)
+            evicted.append((row["key"],))
+            total -= row["size"]
+        cursor.executemany("DELETE FROM spectrals_cache WHERE key = ?", evicted)
+        conn.commit()
+
+
+def _link_or_copy(src, dest):
+    """Hardlink the file if possible. Neither side is modified in place later."""
+    if os.path.exists(dest):
+        os.remove(dest)
+    try:
+        os.link(src, dest)
+    except OSError:
+        shutil.copyfile(src, dest)
@@ -3,20 +3,31 @@ import os
 import platform
 import shutil
 import subprocess
-import time
+from concurrent.futures import ProcessPoolExecutor
 from os.path import dirname, join
 
 import click
 
 from salmon import config
 from salmon.common import flush_stdin, get_audio_files, prompt_async
+from salmon.common.jobs import Job, Pool, cancel, run_coroutine
 from salmon.errors import (
     AbortAndDeleteFolder,
     ImageUploadFailed,
+    JobFailedError,
     UploadError,
     WebServerIsAlreadyRunning,
 )
+from salmon.images import upload_spectral_async
 from salmon.images import upload_spectrals as upload_spectral_imgs
+from salmon.uploader import spectral_cache
+from salmon.uploader.cutoff import (
+    SUSPICIOUS_SCORE,
+    analyse_track,
+    format_analysis,
+    most_suspicious,
+    render_and_analyse,
+)
 from salmon.web import create_app_async, spectrals
 
 # used by post upload stuff might move.
@@ -25,7 +36,14 @@ from bs4 import BeautifulSoup
 
 
 loop = asyncio.get_event_loop()
-THREADS = [None] * config.SIMULTANEOUS_SPECTRALS
+
+# Spectral URLs uploaded while the spectrals of the current release were generated.
+# The release folder may be renamed before they're used, so they aren't keyed on it.
+PREUPLOADED_SPECTRALS = {}
+# The spectrals cache keys of the current release's tracks, used to store their URLs.
+SPECTRALS_CACHE_KEYS = {}
+# The estimated cutoffs and lossy suspicion scores of the current release's tracks.
+SPECTRAL_ANALYSIS = {}
 
 
 def check_spectrals(
@@ -40,6 +58,7 @@ def check_spectrals(
     spectrals_path = create_specs_folder(path)
     if not spectral_ids:
         all_spectral_ids = generate_spectrals_all(path, spectrals_path, audio_info)
+        print_cutoff_analysis(all_spectral_ids)
         while True:
             view_spectrals(spectrals_path, all_spectral_ids)
             if lossy_master is None and check_lma:
@@ -85,7 +104,10 @@ def generate_spectrals_ids(path, track_ids, spectrals_path, audio_info):
 
     wanted_filenames = get_wanted_filenames(list(audio_info), track_ids)
     files_li = [fn for fn in get_audio_files(path) if fn in wanted_filenames]
-    return _generate_spectrals(path, files_li, spectrals_path, audio_info)
+    # We already know which spectrals go up, so upload them as they're compressed.
+    return _generate_spectrals(
+        path, files_li, spectrals_path, audio_info, upload=config.COMPRESS_SPECTRALS
+    )
 
 
 def get_wanted_filenames(filenames, track_ids):
@@ -96,138 +118,235 @@ def get_wanted_filenames(filenames, track_ids):
         raise UploadError("Spectral IDs out of range.")
 
 
-def _generate_spectrals(path, files_li, spectrals_path, audio_info):
+def _generate_spectrals(path, files_li, spectrals_path, audio_info, upload=False):
     """
-    Iterate over the filenames and generate the spectrals. Abuse async nature of
-    subprocess.Popen to spawn multiple processes and generate multiple spectrals
-    at the same time.
+    Generate the spectrals as a per-track pipeline: as soon as a track's images
+    are rendered they go to compression, and when `upload` is set, on to the
+    image host, while later tracks are still rendering.
     """
-    cur_track = 1
-    spectral_ids = {}
-    files = iter(files_li)
-    broken = False
-    while True:
-        for i in range(len(THREADS)):
-            if THREADS[i] is None or THREADS[i].poll() is not None:
-                try:
-                    filename = next(files)
-                except StopIteration:
-                    broken = True
-                    break
+    spectral_ids = dict(enumerate(files_li, start=1))
+    try:
+        uploaded = run_coroutine(
+            _spectrals_pipeline(path, spectral_ids, spectrals_path, audio_info, upload)
+        )
+    except JobFailedError as e:
+        raise UploadError(f"Failed to generate spectrals for {e.job.name}: {e.stderr}")
+    except subprocess.CalledProcessError as e:
+        raise UploadError(
+            "Failed to decode a track for its spectrals: "
+            f"{e.stderr.decode('utf-8', 'ignore')}"
+        )
 
-                zoom_startpoint = calculate_zoom_startpoint(audio_info[filename])
+    click.secho("Finished generating spectrals.               ", fg="green")
+    PREUPLOADED_SPECTRALS.update(
+        {result[0]: result[1] for result in uploaded if result and result[1]}
+    )
+    return spectral_ids
 
-                click.secho(
-                    f"Generating spectrals for track {cur_track:02d}/"
-                    f"{len(files_li):02d}\r",
-                    nl=False,
-                )
-                cur_track += 1
-                THREADS[i] = subprocess.Popen(
-                    [
-                        "sox",
-                        "--multi-threaded",
-                        os.path.join(path, filename),
-                        "--buffer",
-                        "128000",
-                        "-n",
-                        "remix",
-                        "1",
-                        "spectrogram",
-                        "-x",
-                        "2000",
-                        "-y",
-                        "513",
-                        "-z",
-                        "120",
-                        "-w",
-                        "Kaiser",
-                        "-o",
-                        os.path.join(spectrals_path, f"{cur_track - 1:02d} Full.png"),
-                        "remix",
-                        "1",
-                        "spectrogram",
-                        "-x",
-                        "500",
-                        "-y",
-                        "1025",
-                        "-z",
-                        "120",
-                        "-w",
-                        "Kaiser",
-                        "-S",
-                        str(zoom_startpoint),
-                        "-d",
-                        "0:02",
-                        "-o",
-                        os.path.join(spectrals_path, f"{cur_track - 1:02d} Zoom.png"),
-                    ]
-                )
 
-                spectral_ids[cur_track - 1] = filename
+async def _spectrals_pipeline(path, spectral_ids, spectrals_path, audio_info, upload):
+    pool = Pool(config.SIMULTANEOUS_SPECTRALS)
+    # Renders with the numpy renderer, and estimates the cutoffs of the tracks.
+    executor = ProcessPoolExecutor(max_workers=pool.limit)
+    progress = iter(range(1, len(spectral_ids) + 1))
+    tasks = [
+        asyncio.ensure_future(
+            _spectrals_track_pipeline(
+                pool,
+                executor,
+                os.path.join(path, filename),
+                sid,
+                filename,
+                spectrals_path,
+                audio_info[filename],
+                upload,
+                progress,
+                len(spectral_ids),
+            )
+        )
+        for sid, filename in spectral_ids.items()
+    ]
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        await cancel(tasks)
+        raise
+    finally:
+        executor.shutdown(cancel_futures=True)
 
-        if broken and all(
-            THREADS[i] is None or THREADS[i].poll() is not None
-            for i in range(len(THREADS))
-        ):
-            break
-        time.sleep(0.05)
 
-    click.secho("Finished generating spectrals.               ", fg="green")
-    if config.COMPRESS_SPECTRALS:
-        _compress_spectrals(spectrals_path)
-    return spectral_ids
+async def _spectrals_track_pipeline(
+    pool,
+    executor,
+    filepath,
+    sid,
+    filename,
+    spectrals_path,
+    track_data,
+    upload,
+    progress,
+    num_tracks,
+):
+    """
+    Render, compress and (optionally) upload the spectrals of one track, and
+    estimate its cutoff. Tracks found in the spectrals cache skip straight to the
+    upload, or past it if their spectrals were uploaded before, in which case
+    their URLs are returned even when `upload` isn't set.
+    """
+    full_path = os.path.join(spectrals_path, f"{sid:02d} Full.png")
+    zoom_path = os.path.join(spectrals_path, f"{sid:02d} Zoom.png")
+    zoom_startpoint = calculate_zoom_startpoint(track_data)
+    key = await loop.run_in_executor(
+        None,
+        spectral_cache.cache_key,
+        filepath,
+        track_data["sample rate"],
+        zoom_startpoint,
+    )
+    SPECTRALS_CACHE_KEYS[sid - 1] = key
+    cached, urls, analysis = await loop.run_in_executor(
+        None, spectral_cache.fetch, key, full_path, zoom_path
+    )
+    if cached:
+        SPECTRAL_ANALYSIS[sid] = analysis or await _analyse_track(
+            executor, filepath, track_data["sample rate"]
+        )
+        click.secho(
+            "Loaded cached spectrals for track "
+            f"{next(progress):02d}/{num_tracks:02d}\r",
+            nl=False,
+        )
+        if urls:
+            return sid - 1, urls
+    else:
+        SPECTRAL_ANALYSIS[sid] = await _render_track_spectrals(
+            pool, executor, filepath, filename, track_data, full_path, zoom_path
+        )
+        click.secho(
+            f"Generated spectrals for track {next(progress):02d}/{num_tracks:02d}\r",
+            nl=False,
+        )
+        if config.COMPRESS_SPECTRALS:
+            try:
+                await asyncio.gather(
+                    *(
+                        pool.run(Job(["optipng", "-o2", "-strip", "all", p], name=p))
+                        for p in (full_path, zoom_path)
+                    )
+                )
+            except JobFailedError as e:
+                click.secho(f"Failed to compress {e.job.name}: {e.stderr}", fg="red")
+        await loop.run_in_executor(
+            None,
+            spectral_cache.store,
+            key,
+            full_path,
+            zoom_path,
+            SPECTRAL_ANALYSIS[sid],
+        )
+    if upload:
+        sid, urls = await upload_spectral_async(
+            sid - 1, filename, (full_path, zoom_path)
+        )
+        if urls:
+            await loop.run_in_executor(None, spectral_cache.store_urls, key, urls)
+        return sid, urls
 
 
-def _compress_spectrals(spectrals_path):
+async def _render_track_spectrals(
+    pool, executor, filepath, filename, track_data, full_path, zoom_path
+):
     """
-    Iterate over the spectrals directory and compress them. Abuse async nature of
-    subprocess.Popen to spawn multiple processes and compress multiple simultaneously.
+    Render the spectrals of a track and return its cutoff analysis. The numpy
+    renderer analyses the spectrogram it rendered. With sox, sox renders both
+    spectrals and the track is decoded again alongside to be analysed, unless
+    PRESCREEN_SPECTRALS is turned off.
     """
-    files = [f for f in os.listdir(spectrals_path) if f.endswith(".png")]
-    files_iter = iter(files)
-    cur_file = 1
-    broken = False
-    while True:
-        with open(os.devnull, "rb") as devnull:
-            for i in range(len(THREADS)):
-                if THREADS[i] is None or THREADS[i].poll() is not None:
-                    try:
-                        filename = next(files_iter)
-                    except StopIteration:
-                        broken = True
-                        break
-
-                    click.secho(
-                        f"Compressing spectral image {cur_file:02d}/{len(files):02d}\r",
-                        nl=False,
-                    )
-                    cur_file += 1
-                    THREADS[i] = subprocess.Popen(
-                        [
-                            "optipng",
-                            "-o2",
-                            "-strip",
-                            "all",
-                            os.path.join(spectrals_path, filename),
-                        ],
-                        stdout=devnull,
-                        stderr=devnull,
-                    )
+    zoom_startpoint = calculate_zoom_startpoint(track_data)
+    if config.SPECTRALS_RENDERER == "numpy":
+        return await loop.run_in_executor(
+            executor,
+            render_and_analyse,
+            filepath,
+            track_data["sample rate"],
+            full_path,
+            zoom_path,
+            zoom_startpoint,
+        )
+    _, analysis = await asyncio.gather(
+        pool.run(
+            Job(
+                _sox_spectrals_command(filepath, full_path, zoom_path, zoom_startpoint),
+                name=filename,
+            )
+        ),
+        _analyse_track(executor, filepath, track_data["sample rate"]),
+    )
+    return analysis
 
-        if broken and all(
-            THREADS[i] is None or THREADS[i].poll() is not None
-            for i in range(len(THREADS))
-        ):
-            break
-        time.sleep(0.05)
 
-    click.secho("Finished compressing spectrals.               ", fg="green")
+async def _analyse_track(executor, filepath, sample_rate):
+    """
+    Decode a track to estimate its cutoff, unless PRESCREEN_SPECTRALS is turned
+    off. Returns None if it is, or if the track can't be decoded.
+    """
+    if not config.PRESCREEN_SPECTRALS:
+        return None
+    try:
+        return await loop.run_in_executor(
+            executor, analyse_track, filepath, sample_rate
+        )
+    except (subprocess.CalledProcessError, OSError):
+        return None
+
+
+def _sox_spectrals_command(filepath, full_path, zoom_path, zoom_startpoint):
+    return [
+        "sox",
+        "--multi-threaded",
+        filepath,
+        "--buffer",
+        "128000",
+        "-n",
+        "remix",
+        "1",
+        "spectrogram",
+        "-x",
+        "2000",
+        "-y",
+        "513",
+        "-z",
+        "120",
+        "-w",
+        "Kaiser",
+        "-o",
+        full_path,
+        "remix",
+        "1",
+        "spectrogram",
+        "-x",
+        "500",
+        "-y",
+        "1025",
+        "-z",
+        "120",
+        "-w",
+        "Kaiser",
+        "-S",
+        str(zoom_startpoint),
+        "-d",
+        "0:02",
+        "-o",
+        zoom_path,
+    ]
 
 
 def create_specs_folder(path):
     """Create the spectrals folder."""
     spectrals_path = os.path.join(path, "Spectrals")
+    PREUPLOADED_SPECTRALS.clear()
+    SPECTRALS_CACHE_KEYS.clear()
+    SPECTRAL_ANALYSIS.clear()
     if os.path.isdir(spectrals_path):
         shutil.rmtree(spectrals_path)
     os.mkdir(spectrals_path)
@@ -285,7 +404,7 @@ def _open_specs_in_feh(spectrals_path):
 
 
 async def _open_specs_in_web_server(specs_path, all_spectral_ids):
-    spectrals.set_active_spectrals(all_spectral_ids)
+    spectrals.set_active_spectrals(all_spectral_ids, SPECTRAL_ANALYSIS)
     symlink_path = join(dirname(dirname(__file__)), "web", "static", "specs")
 
     shutdown = True
@@ -324,6 +443,12 @@ def upload_spectrals(spectrals_path, spectral_ids):
     if not spectral_ids:
         return None
 
+    preuploaded = {
+        sid - 1: PREUPLOADED_SPECTRALS[sid - 1]
+        for sid in spectral_ids
+        if sid - 1 in PREUPLOADED_SPECTRALS
+    }
+    PREUPLOADED_SPECTRALS.clear()
     spectrals = []
     for sid, filename in spectral_ids.items():
         spectrals.append(
@@ -338,13 +463,51 @@ def upload_spectrals(spectrals_path, spectral_ids):
         )
 
     try:
-        return upload_spectral_imgs(spectrals)
+        uploaded = upload_spectral_imgs(spectrals, successful=set(preuploaded))
     except ImageUploadFailed as e:
         return click.secho(f"Failed to upload spectral: {e}", fg="red")
+    for sid, urls in uploaded.items():
+        if sid in SPECTRALS_CACHE_KEYS:
+            spectral_cache.store_urls(SPECTRALS_CACHE_KEYS[sid], urls)
+    return {**preuploaded, **uploaded}
+
+
+def print_cutoff_analysis(spectral_ids):
+    """Print the estimated cutoff and lossy suspicion score of every track."""
+    if not any(SPECTRAL_ANALYSIS.get(sid) for sid in spectral_ids):
+        return
+    click.secho(
+        "\nEstimated cutoffs (lossy master suspicion from 0 to 100):",
+        fg="cyan",
+        bold=True,
+    )
+    for sid, filename in spectral_ids.items():
+        click.secho(f"{sid:02d}. ", fg="yellow", nl=False)
+        analysis = SPECTRAL_ANALYSIS.get(sid)
+        if not analysis:
+            click.secho(f"  ? {filename}: could not be analysed")
+            continue
+        if analysis["lossy"]:
+            colour = "red"
+        elif analysis["score"] >= SUSPICIOUS_SCORE:
+            colour = "yellow"
+        else:
+            colour = "green"
+        click.secho(f"{analysis['score']:3d} ", fg=colour, bold=True, nl=False)
+        click.secho(f"{filename}: {format_analysis(analysis)}")
+    flagged = sum(1 for a in SPECTRAL_ANALYSIS.values() if a and a["lossy"])
+    if flagged:
+        click.secho(f"{flagged} track(s) look lossy mastered.", fg="red", bold=True)
 
 
 def prompt_spectrals(spectral_ids, lossy_master, check_lma):
-    """Ask which spectral IDs the user wants to upload."""
+    """
+    Ask which spectral IDs the user wants to upload. The most suspicious tracks
+    of the cutoff analysis are selected by default.
+    """
+    suspicious = most_suspicious(
+        {sid: SPECTRAL_ANALYSIS.get(sid) for sid in spectral_ids}
+    )
     while True:
         ids = click.prompt(
             click.style(
@@ -353,7 +516,7 @@ def prompt_spectrals(spectral_ids, lossy_master, check_lma):
                 fg="magenta",
                 bold=True,
             ),
-            default="",
+            default=" ".join(str(sid) for sid in suspicious),
         )
         if ids.strip() == "*":
             return spectral_ids
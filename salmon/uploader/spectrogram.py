@@ -0,0 +1,342 @@
+"""
+An in-process spectrogram renderer. Each track is decoded once into a NumPy buffer,
+the Full and Zoom spectrograms are computed with a batched, windowed STFT, and the
+PNGs are written directly. The geometry, window, dynamic range and palette mirror
+the `sox ... spectrogram` invocation in `salmon.uploader.spectrals`, so the images
+are equivalent to the ones sox produces.
+"""
+
+import math
+import struct
+import subprocess
+import zlib
+
+import numpy as np
+
+FULL_WIDTH = 2000
+FULL_HEIGHT = 513
+ZOOM_WIDTH = 500
+ZOOM_HEIGHT = 1025
+ZOOM_DURATION = 2
+DB_RANGE = 120
+
+# Border sizes around the plot area, matching sox's spectrogram layout.
+LEFT = 58
+RIGHT = 76
+ABOVE = 38
+BELOW = 48
+SPECTRUM_WIDTH = 14
+
+# Fixed palette entries; the spectrum colours follow them.
+BACKGROUND, TEXT, LABELS, GRID = 0, 1, 2, 3
+FIXED_COLOURS = [(0, 0, 0), (255, 255, 255), (191, 191, 191), (127, 127, 127)]
+SPECTRUM_POINTS = 249
+
+CHUNK_FRAMES = 4096
+
+FONT = {
+    "0": (0x0E, 0x11, 0x13, 0x15, 0x19, 0x11, 0x0E),
+    "1": (0x04, 0x0C, 0x04, 0x04, 0x04, 0x04, 0x0E),
+    "2": (0x0E, 0x11, 0x01, 0x02, 0x04, 0x08, 0x1F),
+    "3": (0x1F, 0x02, 0x04, 0x02, 0x01, 0x11, 0x0E),
+    "4": (0x02, 0x06, 0x0A, 0x12, 0x1F, 0x02, 0x02),
+    "5": (0x1F, 0x10, 0x1E, 0x01, 0x01, 0x11, 0x0E),
+    "6": (0x06, 0x08, 0x10, 0x1E, 0x11, 0x11, 0x0E),
+    "7": (0x1F, 0x01, 0x02, 0x04, 0x08, 0x08, 0x08),
+    "8": (0x0E, 0x11, 0x11, 0x0E, 0x11, 0x11, 0x0E),
+    "9": (0x0E, 0x11, 0x11, 0x0F, 0x01, 0x02, 0x0C),
+    "-": (0x00, 0x00, 0x00, 0x1F, 0x00, 0x00, 0x00),
+    ".": (0x00, 0x00, 0x00, 0x00, 0x00, 0x0C, 0x0C),
+    "k": (0x10, 0x10, 0x12, 0x14, 0x18, 0x14, 0x12),
+    "H": (0x11, 0x11, 0x11, 0x1F, 0x11, 0x11, 0x11),
+    "z": (0x00, 0x00, 0x1F, 0x02, 0x04, 0x08, 0x1F),
+    "s": (0x00, 0x00, 0x0E, 0x10, 0x0E, 0x01, 0x1E),
+    "d": (0x01, 0x01, 0x0D, 0x13, 0x11, 0x11, 0x0F),
+    "B": (0x1E, 0x11, 0x11, 0x1E, 0x11, 0x11, 0x1E),
+    "F": (0x1F, 0x10, 0x10, 0x1E, 0x10, 0x10, 0x10),
+    "S": (0x0F, 0x10, 0x10, 0x0E, 0x01, 0x01, 0x1E),
+    " ": (0x00,) * 7,
+}
+FONT_WIDTH = 5
+FONT_HEIGHT = 7
+
+
+def render_spectrals(filepath, sample_rate, full_path, zoom_path, zoom_startpoint):
+    """
+    Decode the first channel of a track once and render both its Full and its
+    Zoom spectrals from the same buffer. The levels of the Full spectrogram are
+    returned for further analysis.
+    """
+    samples = decode_first_channel(filepath)
+    levels = render_full(samples, sample_rate, full_path)
+    render_zoom(samples, sample_rate, zoom_path, zoom_startpoint)
+    return levels
+
+
+def render_full(samples, sample_rate, output):
+    """Render the spectrogram of the whole track and return its levels."""
+    return _write_spectrogram(
+        output, samples, sample_rate, FULL_WIDTH, FULL_HEIGHT, time_offset=0
+    )
+
+
+def render_zoom(samples, sample_rate, output, zoom_startpoint):
+    """Render the spectrogram of the two seconds after the zoom startpoint."""
+    start = int(zoom_startpoint * sample_rate)
+    # Keep one DFT's worth of audio past the window so the last columns aren't
+    # computed over zero padding.
+    end = start + ZOOM_DURATION * sample_rate + 2 * (ZOOM_HEIGHT - 1)
+    window = samples[start:end]
+    return _write_spectrogram(
+        output,
+        window,
+        sample_rate,
+        ZOOM_WIDTH,
+        ZOOM_HEIGHT,
+        time_offset=zoom_startpoint,
+        duration=ZOOM_DURATION,
+    )
+
+
+def decode_first_channel(filepath):
+    """
+    Decode the first channel of an audio file (the `remix 1` of the sox command)
+    into a float32 buffer normalized to [-1, 1).
+    """
+    resp = subprocess.run(
+        [
+            "ffmpeg",
+            "-v",
+            "error",
+            "-i",
+            filepath,
+            "-map",
+            "0:a:0",
+            "-af",
+            "pan=mono|c0=c0",
+            "-f",
+            "s32le",
+            "-acodec",
+            "pcm_s32le",
+            "-",
+        ],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        check=True,
+    )
+    return np.frombuffer(resp.stdout, dtype="<i4").astype(np.float32) / 2**31
+
+
+def compute_spectrogram(samples, sample_rate, width, height, duration=None):
+    """
+    Compute the dBFS levels of a (height, width) spectrogram with the highest
+    frequency in the first row. Like sox, each column averages the power of
+    every DFT whose window starts within it, and the DFTs step by at most one
+    window length.
+    """
+    dft_size = 2 * (height - 1)
+    if duration is None:
+        duration = len(samples) / sample_rate
+    column_samples = max(duration * sample_rate / width, 1)
+    block_steps = math.ceil(column_samples / dft_size)
+    step = max(int(column_samples / block_steps), 1)
+
+    padded = np.zeros(
+        max(len(samples), int(column_samples * width)) + dft_size, dtype=np.float32
+    )
+    padded[: len(samples)] = samples
+    starts = np.arange(0, int(column_samples * width), step)
+    columns = np.minimum((starts / column_samples).astype(np.int64), width - 1)
+
+    window = np.kaiser(dft_size, _kaiser_beta(DB_RANGE)).astype(np.float32)
+    # Scale so a full-scale sine centred on a bin reads 0 dBFS.
+    norm = (2 / window.sum()) ** 2
+    frames = np.lib.stride_tricks.sliding_window_view(padded, dft_size)
+
+    power = np.zeros((width, height))
+    for i in range(0, len(starts), CHUNK_FRAMES):
+        chunk = frames[starts[i : i + CHUNK_FRAMES]] * window
+        spectrum = np.fft.rfft(chunk, axis=1)
+        chunk_columns, firsts = np.unique(
+            columns[i : i + CHUNK_FRAMES], return_index=True
+        )
+        power[chunk_columns] += np.add.reduceat(
+            spectrum.real**2 + spectrum.imag**2, firsts, axis=0
+        )
+    power *= norm / np.maximum(np.bincount(columns, minlength=width), 1)[:, None]
+    with np.errstate(divide="ignore"):
+        levels = 10 * np.log10(power)
+    return levels.T[::-1]
+
+
+def _kaiser_beta(attenuation):
+    """The Kaiser window beta for a side-lobe attenuation given in dB."""
+    if attenuation > 50:
+        return 0.1102 * (attenuation - 8.7)
+    elif attenuation > 21:
+        return 0.5842 * (attenuation - 21) ** 0.4 + 0.07886 * (attenuation - 21)
+    return 0.0
+
+
+def _write_spectrogram(
+    output, samples, sample_rate, width, height, time_offset, duration=None
+):
+    levels = compute_spectrogram(samples, sample_rate, width, height, duration)
+    if duration is None:
+        duration = len(samples) / sample_rate
+
+    image = np.full(
+        (ABOVE + height + BELOW, LEFT + width + RIGHT), BACKGROUND, dtype=np.uint8
+    )
+    image[ABOVE : ABOVE + height, LEFT : LEFT + width] = _levels_to_colours(levels)
+    _draw_box(image, LEFT - 1, ABOVE - 1, width + 2, height + 2)
+    _draw_frequency_axis(image, sample_rate, height)
+    _draw_time_axis(image, time_offset, duration, width, height)
+    _draw_colour_bar(image, width, height)
+    write_png(output, image, _make_palette())
+    return levels
+
+
+def _levels_to_colours(levels):
+    scaled = np.clip((levels + DB_RANGE) / DB_RANGE, 0, 1)
+    return (len(FIXED_COLOURS) + np.rint(scaled * (SPECTRUM_POINTS - 1))).astype(
+        np.uint8
+    )
+
+
+def _make_palette():
+    """The fixed colours followed by sox's default spectrum colour map."""
+    palette = list(FIXED_COLOURS)
+    for i in range(SPECTRUM_POINTS):
+        x = i / (SPECTRUM_POINTS - 1)
+        if x < 0.13:
+            red = 0
+        elif x < 0.73:
+            red = math.sin((x - 0.13) / 0.60 * math.pi / 2)
+        else:
+            red = 1
+        if x < 0.60:
+            green = 0
+        elif x < 0.91:
+            green = math.sin((x - 0.60) / 0.31 * math.pi / 2)
+        else:
+            green = 1
+        if x < 0.60:
+            blue = 0.5 * math.sin(x / 0.6 * math.pi)
+        elif x < 0.78:
+            blue = 0
+        else:
+            blue = (x - 0.78) / 0.22
+        palette.append(tuple(int(c * 255 + 0.5) for c in (red, green, blue)))
+    return palette
+
+
+def _draw_box(image, x, y, width, height):
+    image[y, x : x + width] = LABELS
+    image[y + height - 1, x : x + width] = LABELS
+    image[y : y + height, x] = LABELS
+    image[y : y + height, x + width - 1] = LABELS
+
+
+def _draw_frequency_axis(image, sample_rate, height):
+    nyquist = sample_rate / 2000
+    step = _tick_step(nyquist, height)
+    khz = 0.0
+    while khz <= nyquist:
+        row = ABOVE + height - 1 - int(round(khz / nyquist * (height - 1)))
+        image[row, LEFT - 5 : LEFT - 1] = LABELS
+        label = _format_tick(khz, step)
+        _draw_text(
+            image,
+            LEFT - 7 - len(label) * (FONT_WIDTH + 1),
+            row - FONT_HEIGHT // 2,
+            label,
+            TEXT,
+        )
+        khz += step
+    _draw_text(image, LEFT - 3 * (FONT_WIDTH + 1), ABOVE - 2 * FONT_HEIGHT, "kHz", TEXT)
+
+
+def _draw_time_axis(image, time_offset, duration, width, height):
+    if duration <= 0:
+        return
+    step = _tick_step(duration, width)
+    seconds = math.ceil(time_offset / step) * step
+    while seconds <= time_offset + duration:
+        col = LEFT + int(round((seconds - time_offset) / duration * (width - 1)))
+        image[ABOVE + height + 1 : ABOVE + height + 5, col] = LABELS
+        label = _format_tick(seconds, step)
+        _draw_text(
+            image,
+            col - len(label) * (FONT_WIDTH + 1) // 2,
+            ABOVE + height + 8,
+            label,
+            TEXT,
+        )
+        seconds += step
+    _draw_text(
+        image, LEFT + width - FONT_WIDTH, ABOVE + height + 10 + FONT_HEIGHT, "s", TEXT
+    )
+
+
+def _draw_colour_bar(image, width, height):
+    left = LEFT + width + 12
+    rows = np.linspace(SPECTRUM_POINTS - 1, 0, height).astype(np.uint8)
+    image[ABOVE : ABOVE + height, left : left + SPECTRUM_WIDTH] = (
+        len(FIXED_COLOURS) + rows
+    )[:, None]
+    _draw_box(image, left - 1, ABOVE - 1, SPECTRUM_WIDTH + 2, height + 2)
+    for db in range(0, -DB_RANGE - 1, -20):
+        row = ABOVE + int(round(-db / DB_RANGE * (height - 1)))
+        _draw_text(
+            image, left + SPECTRUM_WIDTH + 4, row - FONT_HEIGHT // 2, str(db), TEXT
+        )
+    _draw_text(image, left - 2, ABOVE - 2 * FONT_HEIGHT, "dBFS", TEXT)
+
+
+def _tick_step(span, pixels, min_spacing=60):
+    """Pick a 1/2/5 * 10^n tick step that keeps labels at least min_spacing apart."""
+    target = span * min_spacing / max(pixels, 1)
+    magnitude = 10 ** math.floor(math.log10(target)) if target > 0 else 1
+    for mult in (1, 2, 5, 10):
+        if mult * magnitude >= target:
+            return mult * magnitude
+    return 10 * magnitude
+
+
+def _format_tick(value, step):
+    if step >= 1:
+        return str(int(round(value)))
+    decimals = max(0, -math.floor(math.log10(step)))
+    return f"{value:.{decimals}f}"
+
+
+def _draw_text(image, x, y, text, colour):
+    for char in text:
+        for row, bits in enumerate(FONT.get(char, FONT[" "])):
+            for col in range(FONT_WIDTH):
+                if bits >> (FONT_WIDTH - 1 - col) & 1:
+                    py, px = y + row, x + col
+                    if 0 <= py < image.shape[0] and 0 <= px < image.shape[1]:
+                        image[py, px] = colour
+        x += FONT_WIDTH + 1
+
+
+def write_png(output, image, palette):
+    """Write a 2D array of palette indices as an 8-bit indexed PNG."""
+    rows, cols = image.shape
+    raw = np.zeros((rows, cols + 1), dtype=np.uint8)
+    raw[:, 1:] = image  # Filter type 0 (None) on every scanline.
+    with open(output, "wb") as f:
+        f.write(b"\x89PNG\r\n\x1a\n")
+        _write_chunk(f, b"IHDR", struct.pack(">IIBBBBB", cols, rows, 8, 3, 0, 0, 0))
+        _write_chunk(f, b"PLTE", bytes(c for colour in palette for c in colour))
+        _write_chunk(f, b"IDAT", zlib.compress(raw.tobytes(), 6))
+        _write_chunk(f, b"IEND", b"")
+
+
+def _write_chunk(f, chunk_type, data):
+    f.write(struct.pack(">I", len(data)))
+    f.write(chunk_type)
+    f.write(data)
+    f.write(struct.pack(">I", zlib.crc32(chunk_type + data) & 0xFFFFFFFF))
@@ -0,0 +1,334 @@
+"""
+Torrent files for uploads. A release uploaded to several trackers gets a torrent
+per tracker that differs only in its announce URL and its source, which changes
+the info hash, so the pieces of a release are hashed once and kept in memory.
+The cached pieces are reused as long as the release's files have the same names,
+sizes and modification times.
+
+The files are memory mapped and the pieces hashed in ranges on a thread pool, as
+hashlib lets go of the GIL while it hashes. The files and piece size are the ones
+dottorrent would pick, so the torrents are the same as the ones it makes.
+
+Uploads start hashing a release in the background once its metadata is final,
+so the torrent is ready by the time it is uploaded. The background hash starts
+over if the files change while it runs, and is only used if they haven't changed
+since.
+
+A release that already has a torrent from another tracker isn't hashed at all.
+If the existing torrent's files and sizes match the folder, none of the files
+were modified after the torrent was made, and the first piece of every file
+(where its tags are) and SAMPLED_PIECES others match the files on disk, its
+pieces are reused for the new torrent.
+"""
+
+import fnmatch
+import math
+import mmap
+import os
+import random
+import threading
+from bisect import bisect_right
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager
+from hashlib import sha1
+from itertools import accumulate
+
+from bencoder import BTFailure, bdecode, bencode
+from dottorrent import DEFAULT_CREATOR, MAX_PIECE_SIZE, MIN_PIECE_SIZE, is_hidden_file
+
+from salmon import config
+from salmon.constants import MANIFEST_NAME
+from salmon.trackers import tracker_classes
+
+EXCLUDE = [MANIFEST_NAME]
+# dottorrent aims for about this many pieces.
+TARGET_PIECES = 1500
+# The ranges of pieces per worker, so that a slow range doesn't hold up the rest.
+RANGES_PER_WORKER = 4
+# How many times a background hash starts over before leaving it to the upload.
+BACKGROUND_ATTEMPTS = 3
+# How many pieces of an existing torrent are checked before it is cross-seeded.
+SAMPLED_PIECES = 16
+
+_hashed = {}
+_hashing = {}
+_lock = threading.Lock()
+
+
+def make_torrent(path, announce, source):
+    """
+    Make the bencoded private torrent of a release for a tracker, from another
+    tracker's torrent of it if there is one.
+    """
+    return encode_torrent(
+        find_cross_seed(path, source) or hash_pieces(path), announce, source
+    )
+
+
+def encode_torrent(info, announce, source):
+    """Bencode a torrent of an info dict for a tracker."""
+    info = OrderedDict(info)
+    info["source"] = source.encode()
+    info["private"] = 1
+    data = OrderedDict()
+    data["announce"] = announce.encode()
+    data["created by"] = DEFAULT_CREATOR.encode()
+    data["info"] = info
+    return bencode(data)
+
+
+def hash_pieces(path):
+    """
+    Get the info dict of a release folder's torrent, without a source, hashing
+    its pieces unless they are cached.
+    """
+    path = os.path.normpath(path)
+    with _lock:
+        background = _hashing.get(path)
+    if background:
+        background.wait()
+    fingerprint = _fingerprint(path)
+    cached = _hashed.get(path)
+    if cached and cached[0] == fingerprint:
+        return cached[1]
+    info = _make_info(path, fingerprint)
+    _hashed[path] = (fingerprint, info)
+    return info
+
+
+def start_hashing(path, skip=()):
+    """
+    Start hashing a release folder on a background thread, as it will be once
+    the top level folders in `skip` are deleted. Does nothing if it's already
+    being hashed.
+    """
+    path = os.path.normpath(path)
+    with _lock:
+        if path in _hashing:
+            return
+        _hashing[path] = done = threading.Event()
+    threading.Thread(
+        target=_hash_in_background, args=(path, skip, done), daemon=True
+    ).start()
+
+
+def _hash_in_background(path, skip, done):
+    try:
+        fingerprint = _fingerprint(path, skip)
+        for _ in range(BACKGROUND_ATTEMPTS):
+            try:
+                info = _make_info(path, fingerprint)
+            except (OSError, ValueError):
+                info = None
+            new_fingerprint = _fingerprint(path, skip)
+            if new_fingerprint == fingerprint:
+                if info:
+                    _hashed[path] = (fingerprint, info)
+                break
+            # The files changed while they were hashed, so start over.
+            fingerprint = new_fingerprint
+    except OSError:
+        pass
+    finally:
+        with _lock:
+            del _hashing[path]
+        done.set()
+
+
+def _make_info(path, fingerprint):
+    """Make the info dict of a torrent of the fingerprinted files of a folder."""
+    files = [(filepath, size) for filepath, size, _ in fingerprint]
+    total_size = sum(size for _, size in files)
+    if not total_size:
+        raise ValueError(f"There are no files to make a torrent of in {path}")
+    piece_size = get_piece_size(total_size)
+
+    info = OrderedDict()
+    info["files"] = []
+    for filepath, size in files:
+        file_info = OrderedDict()
+        file_info["length"] = size
+        file_info["path"] = [
+            p.encode() for p in os.path.relpath(filepath, path).split(os.sep)
+        ]
+        info["files"].append(file_info)
+    info["name"] = os.path.basename(path).encode()
+    info["pieces"] = hash_files(files, piece_size)
+    info["piece length"] = piece_size
+    info["private"] = 1
+    return info
+
+
+def find_cross_seed(path, source):
+    """
+    Look for a torrent of a release folder saved by an upload to another
+    tracker, and get its info dict if it can be cross-seeded.
+    """
+    name = os.path.basename(os.path.normpath(path))
+    for code, folder in dot_torrents_dirs().items():
+        if code != source and folder:
+            info = cross_seed_info(
+                path, os.path.join(folder, f"{name} - {code}.torrent")
+            )
+            if info:
+                return info
+    return None
+
+
+def cross_seed_info(path, torrent_path):
+    """
+    Get the info dict of an existing torrent if it is a torrent of a folder:
+    its files and sizes must match the folder's, the files must not have been
+    modified since the torrent was, and the pieces holding the start of every
+    file, as a retag changes the tags there without changing the file's size,
+    and SAMPLED_PIECES others must match the files on disk. Returns None
+    otherwise.
+    """
+    path = os.path.normpath(path)
+    info = read_info(torrent_path)
+    if (
+        not info
+        or "files" not in info
+        or info.get("name") != os.path.basename(path).encode()
+    ):
+        return None
+    try:
+        files = [
+            (os.path.join(path, *(p.decode() for p in f[b"path"])), f[b"length"])
+            for f in info["files"]
+        ]
+        fingerprint = _fingerprint(path)
+        on_disk = {(filepath, size) for filepath, size, _ in fingerprint}
+        if set(files) != on_disk or len(files) != len(on_disk):
+            return None
+        made = os.stat(torrent_path).st_mtime_ns
+        if any(mtime > made for _, _, mtime in fingerprint):
+            return None
+        piece_size = info["piece length"]
+        num_pieces = len(info["pieces"]) // 20
+        offsets = list(accumulate((size for _, size in files), initial=0))
+        if num_pieces != math.ceil(offsets[-1] / piece_size):
+            return None
+        sampled = (
+            {offset // piece_size for offset in offsets[:-1]}
+            | {num_pieces - 1}
+            | set(random.sample(range(num_pieces), min(SAMPLED_PIECES, num_pieces)))
+        )
+        if not verify_pieces(files, piece_size, info["pieces"], sorted(sampled)):
+            return None
+    except (KeyError, TypeError, UnicodeDecodeError, OSError):
+        return None
+    return info
+
+
+def read_info(torrent_path):
+    """Read the info dict of a .torrent file, or None if it can't be read."""
+    try:
+        with open(torrent_path, "rb") as f:
+            data = bdecode(f.read())
+        return {k.decode(): v for k, v in data[b"info"].items()}
+    except (OSError, BTFailure, KeyError, AttributeError, UnicodeDecodeError):
+        return None
+
+
+def dot_torrents_dirs():
+    """Get the folder every tracker's torrents are saved to."""
+    return {
+        code: getattr(config, f"{code}_DOTTORRENTS_DIR") or config.DOTTORRENTS_DIR
+        for code in tracker_classes
+    }
+
+
+def get_piece_size(total_size):
+    """Pick the power of 2 piece size dottorrent would for a total size."""
+    piece_size = 1 << max(0, math.ceil(math.log2(total_size / TARGET_PIECES)))
+    return min(max(piece_size, MIN_PIECE_SIZE), MAX_PIECE_SIZE)
+
+
+def hash_files(files, piece_size, workers=None):
+    """
+    SHA1 the pieces of a list of (filepath, size) files, laid end to end, across
+    a thread pool. `workers` defaults to SIMULTANEOUS_JOBS. Returns the hashes
+    concatenated.
+    """
+    offsets = list(accumulate((size for _, size in files), initial=0))
+    num_pieces = math.ceil(offsets[-1] / piece_size)
+    workers = workers or config.SIMULTANEOUS_JOBS or os.cpu_count() or 1
+
+    with _mapped(files) as views:
+
+        def hash_range(first, last):
+            return b"".join(
+                _hash_piece(views, offsets, piece, piece_size)
+                for piece in range(first, last)
+            )
+
+        step = max(1, math.ceil(num_pieces / (workers * RANGES_PER_WORKER)))
+        firsts = range(0, num_pieces, step)
+        lasts = [min(first + step, num_pieces) for first in firsts]
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return b"".join(executor.map(hash_range, firsts, lasts))
+
+
+def verify_pieces(files, piece_size, pieces, indices):
+    """
+    Check the pieces at some indices of a list of (filepath, size) files, laid
+    end to end, against their concatenated hashes.
+    """
+    offsets = list(accumulate((size for _, size in files), initial=0))
+    with _mapped(files) as views:
+        return all(
+            _hash_piece(views, offsets, i, piece_size) == pieces[i * 20 : i * 20 + 20]
+            for i in indices
+        )
+
+
+@contextmanager
+def _mapped(files):
+    """Memory map a list of (filepath, size) files, yielding views of them."""
+    with ExitStack() as stack:
+        views = []
+        for filepath, size in files:
+            f = stack.enter_context(open(filepath, "rb"))
+            mapped = stack.enter_context(
+                mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            )
+            if len(mapped) != size:
+                raise OSError(f"{filepath} changed while it was being hashed")
+            # Views are released before their maps are closed, as the stack unwinds.
+            views.append(stack.enter_context(memoryview(mapped)))
+        yield views
+
+
+def _hash_piece(views, offsets, piece, piece_size):
+    start = piece * piece_size
+    end = min(start + piece_size, offsets[-1])
+    # A piece can span the end of one file and the start of the next.
+    i = bisect_right(offsets, start) - 1
+    hasher = sha1()
+    while start < end:
+        stop = min(end, offsets[i + 1])
+        hasher.update(views[i][start - offsets[i] : stop - offsets[i]])
+        start = stop
+        i += 1
+    return hasher.digest()
+
+
+def _fingerprint(path, skip=()):
+    """
+    List the files dottorrent would hash, with their sizes and mtimes, leaving
+    out the top level folders in `skip`.
+    """
+    files = []
+    for root, dirs, filenames in os.walk(path):
+        if root == path:
+            dirs[:] = [d for d in dirs if d not in skip]
+        for filename in filenames:
+            if any(fnmatch.fnmatch(filename, ext) for ext in EXCLUDE):
+                continue
+            filepath = os.path.normpath(os.path.join(root, filename))
+            stat = os.stat(filepath)
+            if stat.st_size and not is_hidden_file(filepath):
+                files.append((filepath, stat.st_size, stat.st_mtime_ns))
+    return tuple(files)
@@ -4,7 +4,6 @@ import shutil
 import tempfile
 
 import click
-from dottorrent import Torrent
 
 from salmon import config
 from salmon.common import str_to_int_if_int
@@ -14,6 +13,7 @@ from salmon.images import upload_cover
 from salmon.errors import RequestError
 
 from salmon.uploader.spectrals import make_spectral_bbcode
+from salmon.uploader.torrents import make_torrent
 
 
 from salmon.sources import SOURCE_ICONS
@@ -202,19 +202,13 @@ def generate_catno(metadata):
 def generate_torrent(gazelle_site, path):
     """Call the dottorrent function to generate a torrent."""
     click.secho("Generating torrent file...", fg="yellow", nl=False)
-    t = Torrent(
-        path,
-        trackers=[gazelle_site.announce],
-        private=True,
-        source=gazelle_site.site_string,
-    )
-    t.generate()
+    torrent = make_torrent(path, gazelle_site.announce, gazelle_site.site_string)
     tpath = os.path.join(
         tempfile.gettempdir(),
         f"{os.path.basename(path)} - {gazelle_site.site_string}.torrent",
     )
     with open(tpath, "wb") as tf:
-        t.save(tf)
+        tf.write(torrent)
     click.secho(" done!", fg="yellow")
     return tpath, open(tpath, "rb")
 
@@ -1,3 +1,4 @@
+import json
 import sqlite3
 from itertools import chain
 
@@ -14,15 +15,21 @@ async def handle_spectrals(request, **kwargs):
     return aiohttp.web.HTTPNrtFound()
 
 
-def set_active_spectrals(spectrals):
+def set_active_spectrals(spectrals, analysis=None):
+    analysis = analysis or {}
     with sqlite3.connect(DB_PATH) as conn:
         conn.row_factory = sqlite3.Row
         cursor = conn.cursor()
         cursor.execute("DELETE FROM spectrals")
         cursor.execute(
-            "INSERT INTO spectrals (id, filename) VALUES "
-            + ", ".join("(?, ?)" for _ in range(len(spectrals))),
-            tuple(chain.from_iterable(list(spectrals.items()))),
+            "INSERT INTO spectrals (id, filename, analysis) VALUES "
+            + ", ".join("(?, ?, ?)" for _ in range(len(spectrals))),
+            tuple(
+                chain.from_iterable(
+                    (id_, filename, json.dumps(analysis.get(id_)))
+                    for id_, filename in spectrals.items()
+                )
+            ),
         )
         conn.commit()
 
@@ -31,5 +38,9 @@ def get_active_spectrals():
     with sqlite3.connect(DB_PATH) as conn:
         conn.row_factory = sqlite3.Row
         cursor = conn.cursor()
-        cursor.execute("SELECT id, filename FROM spectrals ORDER BY ID ASC")
-        return {"spectrals": {r["id"]: r["filename"] for r in cursor.fetchall()}}
+        cursor.execute("SELECT id, filename, analysis FROM spectrals ORDER BY ID ASC")
+        rows = cursor.fetchall()
+        return {
+            "spectrals": {r["id"]: r["filename"] for r in rows},
+            "analysis": {r["id"]: json.loads(r["analysis"] or "null") for r in rows},
+        }
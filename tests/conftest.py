@@ -0,0 +1,37 @@
+import os
+import sqlite3
+import sys
+import types
+
+import pytest
+
+# salmon reads its settings from the user's config.py, which the tests run
+# without, so every setting has its default unless a test sets it.
+config = sys.modules["config"] = types.ModuleType("config")
+# Sources read their API tokens as they are imported.
+config.DISCOGS_TOKEN = None
+
+MIG_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "migrations")
+
+
+@pytest.fixture
+def database(tmp_path):
+    """The path of a new database with every migration run."""
+    db_path = str(tmp_path / "smoked.db")
+    with sqlite3.connect(db_path) as conn:
+        for migration in sorted(os.listdir(MIG_DIR)):
+            if migration.endswith(".sql"):
+                with open(os.path.join(MIG_DIR, migration)) as f:
+                    conn.executescript(f.read())
+    return db_path
+
+
+@pytest.fixture
+def settings(monkeypatch):
+    """Set config options for a test, as the user's config.py would."""
+
+    def set_options(**options):
+        for name, value in options.items():
+            monkeypatch.setattr(config, name, value, raising=False)
+
+    return set_options
@@ -0,0 +1,162 @@
+import numpy as np
+import pytest
+import soundfile as sf
+
+from salmon.common import flac
+from salmon.common.flac import FlacFile, _parse_frame_header
+
+RATE = 44100
+LENGTH = RATE * 2 + 1234  # The last frame is a short one.
+
+
+def write_flac(path, samples, subtype="PCM_16", level=1.0):
+    """Write int samples as a FLAC with libFLAC, through soundfile."""
+    dtype = "int16" if subtype in {"PCM_S8", "PCM_16"} else "int32"
+    if subtype in {"PCM_S8", "PCM_24"}:
+        # soundfile scales the samples to the container's width.
+        samples = samples << 8
+    sf.write(str(path), samples.astype(dtype), RATE, subtype, compression_level=level)
+    return str(path)
+
+
+def read_reference(path, start=0, stop=None, subtype="PCM_16"):
+    """Read a FLAC with libsndfile, in the decoder's int32 sample units."""
+    dtype = "int16" if subtype in {"PCM_S8", "PCM_16"} else "int32"
+    samples = sf.read(path, start=start, stop=stop, dtype=dtype, always_2d=True)[0]
+    samples = samples.astype(np.int32)
+    return samples >> 8 if subtype in {"PCM_S8", "PCM_24"} else samples
+
+
+def noise(rng, amplitude, length=LENGTH):
+    return rng.integers(-amplitude, amplitude, length)
+
+
+def assignments(path):
+    """The channel assignments of a FLAC's frames."""
+    offsets = FlacFile(path).frames()[0]
+    with open(path, "rb") as f:
+        data = f.read()
+    return {_parse_frame_header(data, o)[3] for o in offsets.tolist()}
+
+
+def add_seektable(path, every=4):
+    """
+    Add a SEEKTABLE with a seekpoint every `every` frames to a FLAC without one,
+    after its STREAMINFO.
+    """
+    original = FlacFile(path)
+    offsets, samples, sizes, _ = original.frames()
+    points = b"".join(
+        int(sample).to_bytes(8, "big")
+        + int(offset - original.audio_offset).to_bytes(8, "big")
+        + int(size).to_bytes(2, "big")
+        for offset, sample, size in list(zip(offsets, samples, sizes))[::every]
+    )
+    with open(path, "rb") as f:
+        data = f.read()
+    streaminfo_end = 4 + 4 + 34
+    last = data[4] & 0x80
+    header = bytes([3 | last]) + len(points).to_bytes(3, "big")
+    data = (
+        data[:4]
+        + bytes([data[4] & 0x7F])
+        + data[5:streaminfo_end]
+        + header
+        + points
+        + data[streaminfo_end:]
+    )
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+@pytest.mark.parametrize("level", [0.0, 0.5, 1.0])
+@pytest.mark.parametrize("subtype", ["PCM_S8", "PCM_16", "PCM_24"])
+def test_decodes_like_libflac(tmp_path, level, subtype):
+    rng = np.random.default_rng(1)
+    amplitude = {"PCM_S8": 100, "PCM_16": 20000, "PCM_24": 4_000_000}[subtype]
+    t = np.arange(LENGTH)
+    tone = (np.sin(t * 0.01) * amplitude * 0.5).astype(np.int64)
+    samples = np.stack([tone + noise(rng, amplitude // 50), noise(rng, amplitude)], 1)
+    # Silence makes constant subframes.
+    samples[RATE : RATE + 8192] = 0
+    path = write_flac(tmp_path / "test.flac", samples, subtype, level)
+
+    decoded = FlacFile(path).decode()
+    assert decoded.dtype == np.int32
+    assert np.array_equal(decoded, read_reference(path, subtype=subtype))
+
+
+def test_block_sizes(tmp_path):
+    rng = np.random.default_rng(2)
+    samples = noise(rng, 1000)[:, None]
+    sizes = set()
+    for level in [0.0, 1.0]:
+        path = write_flac(tmp_path / f"{level}.flac", samples, level=level)
+        sizes |= set(FlacFile(path).frames()[2].tolist())
+        assert np.array_equal(FlacFile(path).decode(), read_reference(path))
+    assert {1152, 4096} <= sizes
+
+
+@pytest.mark.parametrize(
+    "make_channels, assignment",
+    [
+        # Loud and quiet noise are cheapest coded apart.
+        (lambda a, b: (a, b // 100), 1),
+        # The right channel is the left plus something, so left and side.
+        (lambda a, b: (a, a + b // 10), 8),
+        (lambda a, b: (a + b // 10, a), 9),
+        # The sum and difference are both quieter than either channel.
+        (lambda a, b: (a + b, a - b), 10),
+    ],
+)
+def test_stereo_decorrelation(tmp_path, make_channels, assignment):
+    rng = np.random.default_rng(3)
+    a, b = noise(rng, 8000), noise(rng, 8000)
+    samples = np.stack(make_channels(a, b), 1)
+    path = write_flac(tmp_path / "test.flac", samples)
+
+    assert assignment in assignments(path)
+    assert np.array_equal(FlacFile(path).decode(), read_reference(path))
+
+
+def test_wasted_bits(tmp_path):
+    rng = np.random.default_rng(4)
+    samples = np.stack([noise(rng, 1000) << 4, noise(rng, 1000) << 2], 1)
+    path = write_flac(tmp_path / "test.flac", samples)
+    flac_file = FlacFile(path)
+    offsets, _, _, stop = flac_file.frames()
+
+    assert set(flac_file.wasted_bits([(offsets, stop)]).tolist()) == {2, 4}
+    assert np.array_equal(flac_file.decode(), read_reference(path))
+
+
+def test_seek_through_seektable(tmp_path):
+    rng = np.random.default_rng(5)
+    samples = np.stack([noise(rng, 20000), noise(rng, 300)], 1)
+    path = write_flac(tmp_path / "test.flac", samples)
+    add_seektable(path)
+    flac_file = FlacFile(path)
+    assert flac_file.seekpoints
+
+    start, end = RATE + 1000, RATE + 5000
+    # Only the frames between the seekpoints around the range are indexed.
+    offsets = flac_file._index(start, end)[0]
+    assert offsets[0] > flac_file.audio_offset
+    assert offsets[-1] < flac_file.file_size - flac_file.max_frame_size * 4
+    assert np.array_equal(
+        flac_file.decode(start, end), read_reference(path, start, end)
+    )
+    assert np.array_equal(
+        flac_file.decode(LENGTH - 10), read_reference(path, LENGTH - 10)
+    )
+
+
+@pytest.mark.parametrize("start, end", [(0, None), (12345, 67890)])
+def test_decode_across_processes(tmp_path, start, end):
+    rng = np.random.default_rng(6)
+    samples = np.stack([noise(rng, 20000), noise(rng, 20000)], 1)
+    path = write_flac(tmp_path / "test.flac", samples)
+
+    assert np.array_equal(
+        flac.decode(path, start, end, workers=3), read_reference(path, start, end)
+    )
@@ -0,0 +1,197 @@
+import asyncio
+import os
+import sys
+import time
+
+import pytest
+
+from salmon.common import jobs
+from salmon.common.jobs import Job, TeeJob, run_jobs
+from salmon.errors import JobFailedError
+
+LIMIT = 2
+GLOBAL_LIMIT = 3
+
+# Marks itself as running in a folder, prints how many jobs were running then,
+# and unmarks itself once it is done.
+RUNNING = """
+import os, sys, time
+marker = os.path.join(sys.argv[1], sys.argv[2])
+open(marker, "w").close()
+print(len(os.listdir(sys.argv[1])))
+time.sleep(float(sys.argv[3]))
+os.remove(marker)
+"""
+
+
+@pytest.fixture(autouse=True)
+def global_slots(settings, monkeypatch):
+    """Give the pools more slots than the tests' machine may have cores."""
+    settings(SIMULTANEOUS_JOBS=GLOBAL_LIMIT)
+    monkeypatch.setattr(jobs, "GLOBAL_SLOTS", asyncio.Semaphore(GLOBAL_LIMIT))
+
+
+def python(script, *args, **kwargs):
+    return Job(
+        [sys.executable, "-c", script, *map(str, args)], capture_stdout=True, **kwargs
+    )
+
+
+def test_outputs_in_order():
+    durations = [0.3, 0.0, 0.2, 0.1]
+    outs = run_jobs(
+        (
+            python(f"import time; time.sleep({d}); print({i})")
+            for i, d in enumerate(durations)
+        ),
+        limit=LIMIT,
+    )
+    assert [int(out) for out in outs] == list(range(len(durations)))
+
+
+def test_concurrency_limit(tmp_path):
+    outs = run_jobs(
+        (python(RUNNING, tmp_path, i, 0.2) for i in range(8)),
+        limit=LIMIT,
+    )
+    assert max(int(out) for out in outs) == LIMIT
+    assert not os.listdir(tmp_path)
+
+
+def test_global_limit(tmp_path):
+    outs = run_jobs(
+        (python(RUNNING, tmp_path, i, 0.2) for i in range(8)),
+        limit=GLOBAL_LIMIT + 2,
+    )
+    assert max(int(out) for out in outs) == GLOBAL_LIMIT
+
+
+def test_map_backpressure():
+    queued, done = [], []
+
+    def generate():
+        for i in range(8):
+            queued.append(len(queued) - len(done))
+            yield python("print()", on_done=done.append)
+
+    run_jobs(generate(), limit=LIMIT)
+    assert len(done) == 8
+    # Only a pool's worth of jobs (plus the one waiting for a slot) is pulled
+    # ahead of the jobs that are done.
+    assert max(queued) <= LIMIT + 1
+
+
+def test_tee_fan_out(tmp_path):
+    source = tmp_path / "source"
+    source.write_bytes(os.urandom(jobs.TEE_CHUNK * 10 + 123))
+    outputs = [tmp_path / f"out{i}" for i in range(3)]
+    started, finished = [], []
+    run_jobs(
+        [
+            TeeJob(
+                f"cat {source}",
+                [f"cat > {output}" for output in outputs],
+                shell=True,
+                on_start=lambda: started.append(1),
+                on_done=finished.append,
+            )
+        ]
+    )
+    assert started == [1] and finished == [None]
+    for output in outputs:
+        assert output.read_bytes() == source.read_bytes()
+
+
+def test_tee_sink_failure(tmp_path):
+    with pytest.raises(JobFailedError) as e:
+        run_jobs(
+            [
+                TeeJob(
+                    "head -c 1000000 /dev/zero",
+                    [f"cat > {tmp_path / 'out'}", "echo broken >&2; exit 3"],
+                    shell=True,
+                )
+            ]
+        )
+    assert e.value.returncode == 3
+    assert "broken" in e.value.stderr
+
+
+def test_failure_cancels_the_rest(tmp_path):
+    pidfile = tmp_path / "pid"
+    start = time.monotonic()
+    with pytest.raises(JobFailedError) as e:
+        run_jobs(
+            [
+                Job(f"echo $$ > {pidfile}; exec sleep 30", shell=True),
+                Job("sleep 0.2; echo failed >&2; exit 2", shell=True),
+                Job("sleep 30", shell=True),
+            ],
+            limit=LIMIT,
+        )
+    assert time.monotonic() - start < 10
+    assert e.value.returncode == 2
+    assert e.value.stderr.strip() == "failed"
+    assert_dead(int(pidfile.read_text()))
+
+
+def test_return_exceptions():
+    outs = run_jobs(
+        [
+            python("print(1)"),
+            Job("echo failed >&2; exit 4", shell=True),
+            python("import time; time.sleep(0.2); print(3)"),
+        ],
+        limit=LIMIT,
+        return_exceptions=True,
+    )
+    assert int(outs[0]) == 1
+    assert isinstance(outs[1], JobFailedError) and outs[1].returncode == 4
+    assert int(outs[2]) == 3
+
+
+def test_return_exceptions_from_callbacks():
+    def bad_tags(_):
+        raise ValueError("bad tag")
+
+    outs = run_jobs(
+        [python("print(1)", on_done=bad_tags), python("print(2)")],
+        limit=LIMIT,
+        return_exceptions=True,
+    )
+    assert isinstance(outs[0], ValueError)
+    assert int(outs[1]) == 2
+
+
+def test_keyboard_interrupt_kills_jobs(tmp_path):
+    def interrupt():
+        raise KeyboardInterrupt
+
+    pidfiles = [tmp_path / f"pid{i}" for i in range(LIMIT)]
+    handle = jobs.loop.call_later(1, interrupt)
+    try:
+        with pytest.raises(KeyboardInterrupt):
+            run_jobs(
+                [
+                    # The pipeline's processes run in the shell's process group.
+                    Job(f"echo $$ > {pidfile}; sleep 30 | sleep 30", shell=True)
+                    for pidfile in pidfiles
+                ],
+                limit=LIMIT,
+            )
+    finally:
+        handle.cancel()
+    for pidfile in pidfiles:
+        assert_dead(int(pidfile.read_text()), group=True)
+
+
+def assert_dead(pid, group=False):
+    """Check that a process, or its process group, is gone."""
+    kill = os.killpg if group else os.kill
+    for _ in range(50):
+        try:
+            kill(pid, 0)
+        except ProcessLookupError:
+            return
+        time.sleep(0.1)
+    pytest.fail(f"Process {pid} is still running")
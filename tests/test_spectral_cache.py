@@ -0,0 +1,41 @@
+import pytest
+
+from salmon.uploader import spectral_cache
+
+KEY = "ab" * 32
+URLS = ["https://host.example/full.png", "https://host.example/zoom.png"]
+
+
+@pytest.fixture
+def spectrals(database, settings, tmp_path, monkeypatch):
+    """A track's rendered spectrals, with a cache to put them in."""
+    monkeypatch.setattr(spectral_cache, "DB_PATH", database)
+    settings(SPECTRALS_CACHE_DIR=str(tmp_path / "cache"), SPECS_UPLOADER="emp")
+    paths = []
+    for name in ["Full", "Zoom"]:
+        path = tmp_path / f"{name}.png"
+        path.write_bytes(name.encode())
+        paths.append(str(path))
+    return paths
+
+
+def fetch(tmp_path):
+    return spectral_cache.fetch(
+        KEY, str(tmp_path / "Full out.png"), str(tmp_path / "Zoom out.png")
+    )
+
+
+def test_urls_are_reused(spectrals, tmp_path):
+    spectral_cache.store(KEY, *spectrals, {"score": 10})
+    assert fetch(tmp_path) == (True, None, {"score": 10})
+    spectral_cache.store_urls(KEY, URLS)
+    assert fetch(tmp_path) == (True, URLS, {"score": 10})
+    assert (tmp_path / "Zoom out.png").read_bytes() == b"Zoom"
+
+
+def test_urls_of_another_host_are_not_reused(spectrals, settings, tmp_path):
+    spectral_cache.store(KEY, *spectrals)
+    spectral_cache.store_urls(KEY, URLS)
+    settings(SPECS_UPLOADER="ptpimg")
+    # The images are still cached, only their URLs are left out.
+    assert fetch(tmp_path) == (True, None, None)
@@ -0,0 +1,89 @@
+import asyncio
+
+import pytest
+
+from salmon.trackers import throttle
+from salmon.trackers.throttle import TokenBucket
+
+
+class Clock:
+    """Wall and monotonic time that only move when told to, or slept through."""
+
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def time(self):
+        return self.now
+
+    def monotonic(self):
+        return self.now
+
+    async def sleep(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(database, monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(throttle, "DB_PATH", database)
+    monkeypatch.setattr(throttle, "time", clock)
+    monkeypatch.setattr(throttle.asyncio, "sleep", clock.sleep)
+    return clock
+
+
+def test_bursts_up_to_the_limit(clock):
+    bucket = TokenBucket("RED", limit=10, period=10)
+    assert all(bucket._take(0) == 0 for _ in range(10))
+    assert bucket._take(0) == pytest.approx(1)
+
+
+def test_refills_evenly(clock):
+    bucket = TokenBucket("RED", limit=10, period=10)
+    for _ in range(10):
+        bucket._take(0)
+    clock.now += 0.5
+    assert bucket._take(0) == pytest.approx(0.5)
+    clock.now += 0.5
+    assert bucket._take(0) == 0
+    clock.now += 3
+    assert [bucket._take(0) for _ in range(4)] == [0, 0, 0, pytest.approx(1)]
+
+
+def test_refill_is_capped_at_the_limit(clock):
+    bucket = TokenBucket("RED", limit=10, period=10)
+    bucket._take(0)
+    clock.now += 3600
+    assert all(bucket._take(0) == 0 for _ in range(10))
+    assert bucket._take(0) > 0
+
+
+def test_buckets_are_shared_by_key(clock):
+    # Buckets of other processes are other instances reading the same row.
+    first, second = TokenBucket("RED", 2, 10), TokenBucket("RED", 2, 10)
+    other_site = TokenBucket("OPS", 2, 10)
+    assert first._take(0) == 0
+    assert second._take(0) == 0
+    assert first._take(0) > 0
+    assert other_site._take(0) == 0
+
+
+def test_acquire_waits_for_a_token(clock):
+    bucket = TokenBucket("RED", limit=2, period=10)
+    start = clock.now
+
+    async def acquire(n):
+        for _ in range(n):
+            await bucket.acquire()
+
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(acquire(4))
+    finally:
+        loop.close()
+    # Two tokens at once, then one every five seconds.
+    assert clock.now - start == pytest.approx(10)
+    (stats,) = throttle.wait_stats()
+    assert stats["key"] == "RED"
+    assert stats["requests"] == 4
+    assert stats["waited"] == pytest.approx(10)
+    assert stats["max_wait"] == pytest.approx(5)
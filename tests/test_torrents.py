@@ -0,0 +1,170 @@
+import os
+from types import SimpleNamespace
+
+import dottorrent
+import pytest
+from bencoder import bdecode
+
+from salmon.constants import MANIFEST_NAME
+from salmon.uploader import torrents
+from salmon.uploader.cross_seed import cross_seed_folders
+
+ANNOUNCE = "https://tracker.example/announce"
+SOURCE = "RED"
+PIECE_SIZE = 1 << 14
+
+# Files that are smaller than a piece, that end mid-piece, and that are a whole
+# number of pieces, so that pieces span file boundaries.
+SIZES = {
+    "01 - One.flac": PIECE_SIZE * 3 + 100,
+    "02 - Two.flac": 200,
+    "03 - Three.flac": PIECE_SIZE * 2,
+    "CD2/01 - Four.flac": PIECE_SIZE + 1,
+    "CD2/02 - Five.flac": PIECE_SIZE * 5 - 301,
+    "cover.jpg": 4321,
+}
+
+
+@pytest.fixture(autouse=True)
+def torrents_dir(settings, tmp_path, monkeypatch):
+    """Every tracker's torrents folder, with no torrents unless a test saves one."""
+    path = tmp_path / "torrents"
+    path.mkdir()
+    settings(DOTTORRENTS_DIR=str(path))
+    monkeypatch.setattr(torrents, "_hashed", {})
+    return path
+
+
+@pytest.fixture
+def release(tmp_path):
+    path = tmp_path / "Artist - Album (2020) [FLAC]"
+    for name, size in SIZES.items():
+        (path / name).parent.mkdir(parents=True, exist_ok=True)
+        (path / name).write_bytes(os.urandom(size))
+    # dottorrent leaves out empty and hidden files.
+    (path / "empty.txt").touch()
+    (path / ".hidden").write_bytes(b"hidden")
+    (path / MANIFEST_NAME).write_text("{}")
+    return str(path)
+
+
+def dottorrent_torrent(path, piece_size=None):
+    torrent = dottorrent.Torrent(
+        path,
+        trackers=[ANNOUNCE],
+        piece_size=piece_size,
+        private=True,
+        source=SOURCE,
+        exclude=[MANIFEST_NAME],
+    )
+    torrent.generate()
+    return torrent.dump()
+
+
+def save_torrent(torrents_dir, path, source):
+    """Save a torrent of a release as an upload to a tracker would."""
+    torrent_path = torrents_dir / f"{os.path.basename(path)} - {source}.torrent"
+    torrent_path.write_bytes(torrents.make_torrent(path, ANNOUNCE, source))
+    torrents._hashed.clear()
+    return str(torrent_path)
+
+
+def set_mtime(path, torrent_path, later):
+    """Make a file's modification time later or earlier than a torrent's."""
+    mtime = os.stat(torrent_path).st_mtime_ns + (1 if later else -1) * 10**9
+    os.utime(path, ns=(mtime, mtime))
+
+
+def files_of(path):
+    return [(filepath, size) for filepath, size, _ in torrents._fingerprint(path)]
+
+
+def test_torrent_matches_dottorrent(release):
+    made = torrents.make_torrent(release, ANNOUNCE, SOURCE)
+    assert made == dottorrent_torrent(release)
+
+
+@pytest.mark.parametrize("workers", [1, 2, 3, 8, 64])
+def test_hash_files_matches_dottorrent(release, workers):
+    expected = bdecode(dottorrent_torrent(release, PIECE_SIZE))[b"info"][b"pieces"]
+    assert torrents.hash_files(files_of(release), PIECE_SIZE, workers) == expected
+
+
+@pytest.mark.parametrize("total_size", [1, 10**6, 10**8, 5 * 10**9, 10**11])
+def test_piece_size_matches_dottorrent(tmp_path, total_size):
+    # Sparse files make large releases without writing them out.
+    with open(tmp_path / "big.flac", "wb") as f:
+        f.truncate(total_size)
+    piece_size = dottorrent.Torrent(str(tmp_path)).get_info()[2]
+    assert torrents.get_piece_size(total_size) == piece_size
+
+
+def test_matching_torrent_is_reused(release, torrents_dir, monkeypatch):
+    expected = torrents.make_torrent(release, ANNOUNCE, SOURCE)
+    save_torrent(torrents_dir, release, "OPS")
+
+    def hash_pieces(path):
+        raise AssertionError("The release was hashed")
+
+    monkeypatch.setattr(torrents, "hash_pieces", hash_pieces)
+    assert torrents.make_torrent(release, ANNOUNCE, SOURCE) == expected
+
+
+def test_cross_seeded_torrent_matches_a_hashed_one(release, torrents_dir):
+    expected = torrents.make_torrent(release, ANNOUNCE, SOURCE)
+    ops_torrent = save_torrent(torrents_dir, release, "OPS")
+    info = torrents.cross_seed_info(release, ops_torrent)
+    assert info is not None
+    assert torrents.encode_torrent(info, ANNOUNCE, SOURCE) == expected
+
+
+def test_own_torrent_is_not_cross_seeded(release, torrents_dir):
+    save_torrent(torrents_dir, release, SOURCE)
+    assert torrents.find_cross_seed(release, SOURCE) is None
+
+
+@pytest.mark.parametrize(
+    "change",
+    [
+        lambda path: open(os.path.join(path, "new.log"), "w").write("log"),
+        lambda path: os.remove(os.path.join(path, "cover.jpg")),
+        lambda path: open(os.path.join(path, "02 - Two.flac"), "ab").write(b"x"),
+    ],
+)
+def test_other_files_are_not_cross_seeded(release, torrents_dir, change):
+    ops_torrent = save_torrent(torrents_dir, release, "OPS")
+    change(release)
+    for filepath, _ in files_of(release):
+        set_mtime(filepath, ops_torrent, later=False)
+    assert torrents.cross_seed_info(release, ops_torrent) is None
+
+
+def test_files_newer_than_the_torrent_are_not_cross_seeded(release, torrents_dir):
+    ops_torrent = save_torrent(torrents_dir, release, "OPS")
+    assert torrents.cross_seed_info(release, ops_torrent) is not None
+    set_mtime(os.path.join(release, "cover.jpg"), ops_torrent, later=True)
+    assert torrents.cross_seed_info(release, ops_torrent) is None
+
+
+def test_retagged_files_are_not_cross_seeded(release, torrents_dir, monkeypatch):
+    # Only the first piece of every file is checked, and the last piece.
+    monkeypatch.setattr(torrents, "SAMPLED_PIECES", 0)
+    ops_torrent = save_torrent(torrents_dir, release, "OPS")
+    filepath = os.path.join(release, "CD2", "02 - Five.flac")
+    with open(filepath, "r+b") as f:
+        first = f.read(1)
+        f.seek(0)
+        f.write(bytes([first[0] ^ 0xFF]))
+    set_mtime(filepath, ops_torrent, later=False)
+    assert torrents.cross_seed_info(release, ops_torrent) is None
+
+
+def test_cross_seed_folders(release, torrents_dir, tmp_path):
+    expected = torrents.make_torrent(release, ANNOUNCE, SOURCE)
+    save_torrent(torrents_dir, release, "OPS")
+    site = SimpleNamespace(
+        site_string=SOURCE, announce=ANNOUNCE, dot_torrents_dir=str(tmp_path)
+    )
+    cross_seed_folders([release], site)
+    name = os.path.basename(release)
+    assert (tmp_path / f"{name} - {SOURCE}.torrent").read_bytes() == expected
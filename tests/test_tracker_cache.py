@@ -0,0 +1,103 @@
+import json
+
+import pytest
+
+from salmon.trackers import base, cache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache, "time", clock)
+    monkeypatch.setattr(cache, "_cache", {})
+    return clock
+
+
+class FakeSite(base.BaseGazelleApi):
+    """A tracker whose API answers with how many times it has been called."""
+
+    def __init__(self, site_code="RED"):
+        self.site_code = site_code
+        self.base_url = "https://tracker.example"
+        self.calls = []
+
+    async def send(self, method, url, **kwargs):
+        self.calls.append(dict(kwargs["params"])["action"])
+        response = {"status": "success", "response": {"calls": len(self.calls)}}
+        return base.TrackerResponse(200, url, json.dumps(response))
+
+    async def site_page_upload(self, data, files):
+        return 1
+
+
+def request(site, action, **kwargs):
+    return base.loop.run_until_complete(site.request(action, **kwargs))
+
+
+def test_get_returns_a_copy(clock):
+    key = cache.cache_key("RED", "torrentgroup", {"id": 1})
+    cache.put(key, {"torrents": []})
+    cache.get(key)["torrents"].append("changed")
+    assert cache.get(key) == {"torrents": []}
+
+
+def test_key_ignores_parameter_order(clock):
+    assert cache.cache_key("RED", "browse", {"a": 1, "b": 2}) == cache.cache_key(
+        "RED", "browse", {"b": "2", "a": "1"}
+    )
+
+
+def test_only_reads_are_cached(clock):
+    key = cache.cache_key("RED", "index", {})
+    cache.put(key, {"authkey": "x"})
+    assert cache.get(key) is None
+
+
+@pytest.mark.parametrize(
+    "action, ttl", [("browse", cache.SEARCH_TTL), ("torrentgroup", cache.DETAILS_TTL)]
+)
+def test_entries_expire(clock, action, ttl):
+    key = cache.cache_key("RED", action, {"id": 1})
+    cache.put(key, {"id": 1})
+    clock.now += ttl - 1
+    assert cache.get(key) == {"id": 1}
+    clock.now += 2
+    assert cache.get(key) is None
+    assert key not in cache._cache
+
+
+def test_invalidate_drops_one_site(clock):
+    red = cache.cache_key("RED", "torrentgroup", {"id": 1})
+    ops = cache.cache_key("OPS", "torrentgroup", {"id": 1})
+    cache.put(red, {"site": "RED"})
+    cache.put(ops, {"site": "OPS"})
+    cache.invalidate("RED")
+    assert cache.get(red) is None
+    assert cache.get(ops) == {"site": "OPS"}
+
+
+def test_requests_are_cached_until_expiry(clock):
+    site = FakeSite()
+    assert request(site, "torrentgroup", id=1) == {"calls": 1}
+    assert request(site, "torrentgroup", id=1) == {"calls": 1}
+    assert request(site, "torrentgroup", id=2) == {"calls": 2}
+    clock.now += cache.DETAILS_TTL + 1
+    assert request(site, "torrentgroup", id=1) == {"calls": 3}
+
+
+def test_upload_invalidates_the_site(clock):
+    red, ops = FakeSite("RED"), FakeSite("OPS")
+    request(red, "browse", searchstr="x")
+    request(ops, "browse", searchstr="x")
+    base.loop.run_until_complete(red.upload({}, []))
+
+    assert request(red, "browse", searchstr="x") == {"calls": 2}
+    assert request(ops, "browse", searchstr="x") == {"calls": 1}